@@ -0,0 +1,165 @@
+"""Benchmarks the panel feature engineering functions in `src.feature_engineering`
+against the plain pandas groupby implementations they replaced.
+
+Run from the root of the repository:
+    python scripts/benchmark_feature_engineering.py
+"""
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from src.feature_engineering.autoregressive_features import (  # noqa: E402
+    add_ewma,
+    add_lags,
+    add_rolling_features,
+)
+
+
+def make_panel(n_series: int, n_timesteps: int, seed: int = 42) -> pd.DataFrame:
+    """Creates a synthetic long format panel similar to the London Smart Meters data"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "LCLid": np.repeat(
+                [f"MAC{i:06d}" for i in range(n_series)], n_timesteps
+            ),
+            "energy_consumption": rng.gamma(2, 0.1, size=n_series * n_timesteps),
+        }
+    )
+
+
+def _time_it(func, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _pandas_lags(df, lags, column, ts_id):
+    return df.assign(
+        **{f"{column}_lag_{l}": df.groupby([ts_id])[column].shift(l) for l in lags}
+    )
+
+
+def benchmark_lags(n_series_list=(100, 1000), n_lags_list=(5, 20, 50), n_timesteps=1000):
+    # Compiling the kernel before timing
+    add_lags(make_panel(2, 10), [1], "energy_consumption", "LCLid")
+    rows = []
+    for n_series in n_series_list:
+        df = make_panel(n_series, n_timesteps)
+        for n_lags in n_lags_list:
+            lags = list(range(1, n_lags + 1))
+            pandas_time = _time_it(
+                lambda: _pandas_lags(df, lags, "energy_consumption", "LCLid")
+            )
+            engine_time = _time_it(
+                lambda: add_lags(df, lags, "energy_consumption", "LCLid")
+            )
+            rows.append(
+                {
+                    "n_series": n_series,
+                    "n_rows": len(df),
+                    "n_lags": n_lags,
+                    "pandas (s)": pandas_time,
+                    "add_lags (s)": engine_time,
+                    "speedup": pandas_time / engine_time,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def _pandas_rolling(df, rolls, column, agg_funcs, ts_id):
+    rolling_df = pd.concat(
+        [
+            df.groupby(ts_id)[column]
+            .shift(1)
+            .rolling(l)
+            .agg({f"{column}_rolling_{l}_{agg}": agg for agg in agg_funcs})
+            for l in rolls
+        ],
+        axis=1,
+    )
+    return df.assign(**rolling_df.to_dict("list"))
+
+
+def benchmark_rolling(n_series_list=(100, 1000), n_timesteps=1000):
+    rolls = [3, 6, 12, 48]
+    agg_funcs = ["mean", "std", "min", "max"]
+    add_rolling_features(make_panel(2, 10), [1], "energy_consumption", ts_id="LCLid")
+    rows = []
+    for n_series in n_series_list:
+        df = make_panel(n_series, n_timesteps)
+        pandas_time = _time_it(
+            lambda: _pandas_rolling(df, rolls, "energy_consumption", agg_funcs, "LCLid")
+        )
+        engine_time = _time_it(
+            lambda: add_rolling_features(
+                df, rolls, "energy_consumption", agg_funcs, ts_id="LCLid"
+            )
+        )
+        rows.append(
+            {
+                "n_series": n_series,
+                "n_rows": len(df),
+                "n_features": len(rolls) * len(agg_funcs),
+                "pandas (s)": pandas_time,
+                "add_rolling_features (s)": engine_time,
+                "speedup": pandas_time / engine_time,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def _pandas_ewma(df, alphas, column, ts_id):
+    return df.assign(
+        **{
+            f"{column}_ewma_alpha_{alpha}": df.groupby([ts_id])[column]
+            .shift(1)
+            .ewm(alpha=alpha, adjust=False)
+            .mean()
+            for alpha in alphas
+        }
+    )
+
+
+def benchmark_ewma(n_series_list=(100, 1000), n_timesteps=1000):
+    alphas = [0.1, 0.3, 0.5, 0.7, 0.9]
+    add_ewma(make_panel(2, 10), "energy_consumption", alphas=[0.5], ts_id="LCLid")
+    rows = []
+    for n_series in n_series_list:
+        df = make_panel(n_series, n_timesteps)
+        pandas_time = _time_it(
+            lambda: _pandas_ewma(df, alphas, "energy_consumption", "LCLid")
+        )
+        engine_time = _time_it(
+            lambda: add_ewma(df, "energy_consumption", alphas=alphas, ts_id="LCLid")
+        )
+        rows.append(
+            {
+                "n_series": n_series,
+                "n_rows": len(df),
+                "n_alphas": len(alphas),
+                "pandas (s)": pandas_time,
+                "add_ewma (s)": engine_time,
+                "speedup": pandas_time / engine_time,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    print("add_lags")
+    print(benchmark_lags().round(3).to_string(index=False))
+    print("add_rolling_features")
+    print(benchmark_rolling().round(3).to_string(index=False))
+    print("add_ewma")
+    print(benchmark_ewma().round(3).to_string(index=False))
@@ -13,6 +13,8 @@ from sklearn.linear_model import RidgeCV
 from statsmodels.tools.data import _is_using_pandas
 from statsmodels.tsa.seasonal import DecomposeResult
 
+from src.feature_engineering.temporal_features import FourierEncoder
+
 
 # Ported from statsmodels
 def _get_pandas_wrapper(X, trim_head=None, trim_tail=None, names=None):
@@ -421,12 +423,7 @@ class FourierDecomposition(BaseDecomposition):
 
     def _calculate_fourier_terms(self, seasonal_cycle: np.ndarray, max_cycle: int):
         """Calculates Fourier Terms given the seasonal cycle and max_cycle"""
-        sin_X = np.empty((len(seasonal_cycle), self.n_fourier_terms), dtype="float64")
-        cos_X = np.empty((len(seasonal_cycle), self.n_fourier_terms), dtype="float64")
-        for i in range(1, self.n_fourier_terms + 1):
-            sin_X[:, i - 1] = np.sin((2 * np.pi * seasonal_cycle * i) / max_cycle)
-            cos_X[:, i - 1] = np.cos((2 * np.pi * seasonal_cycle * i) / max_cycle)
-        return np.hstack([sin_X, cos_X])
+        return FourierEncoder(max_cycle, self.n_fourier_terms).transform(seasonal_cycle)
 
     def _prepare_X(self, detrended, **seasonality_kwargs):
         if (
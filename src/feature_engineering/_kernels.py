@@ -0,0 +1,371 @@
+"""Compiled kernels for panel (long format) feature engineering
+
+The panel is represented as a ts_id sorted array of values along with a CSR style
+`offsets` array, where the rows of the i-th time series are `values[offsets[i]:offsets[i+1]]`.
+The group boundaries are computed once and shared by all the features.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numba import njit
+
+
+def _get_group_offsets(
+    df: pd.DataFrame, ts_id: Optional[str] = None
+) -> Tuple[Optional[np.ndarray], np.ndarray, Optional[np.ndarray]]:
+    """Computes the group boundaries of the time series in the dataframe
+
+    Args:
+        df (pd.DataFrame): The dataframe in long format
+        ts_id (str, optional): Column name of Unique ID of a time series. If None,
+            assumes dataframe only has a single timeseries. Defaults to None.
+
+    Returns:
+        Tuple[Optional[np.ndarray], np.ndarray, Optional[np.ndarray]]: A tuple of the
+            stable sort order which makes the time series contiguous (None if it already is),
+            the offsets array, and a mask of rows with a missing ts_id (None if there are none)
+    """
+    if ts_id is None:
+        return None, np.array([0, len(df)], dtype=np.int64), None
+    codes, _ = pd.factorize(df[ts_id], sort=False)
+    null_mask = codes < 0
+    if null_mask.any():
+        # Missing ids form a group of their own, which is masked out later
+        codes = np.where(null_mask, codes.max() + 1, codes)
+    else:
+        null_mask = None
+    # factorize assigns codes in the order of appearance, so the codes are
+    # non-decreasing only if every time series is contiguous
+    if len(codes) > 1 and np.any(codes[1:] < codes[:-1]):
+        sort_order = np.argsort(codes, kind="stable")
+    else:
+        sort_order = None
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes))]).astype(np.int64)
+    return sort_order, offsets, null_mask
+
+
+def _get_sorted_values(
+    df: pd.DataFrame, column: str, sort_order: Optional[np.ndarray]
+) -> np.ndarray:
+    """Returns the column as a float64 array in the ts_id sorted order"""
+    values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+    if sort_order is not None:
+        values = values[sort_order]
+    return np.ascontiguousarray(values)
+
+
+def _allocate_block(n_features: int, n_rows: int, use_32_bit: bool) -> np.ndarray:
+    """Allocates a (features x rows) block. The transpose is what pandas stores internally"""
+    return np.empty(
+        (n_features, n_rows), dtype=np.float32 if use_32_bit else np.float64
+    )
+
+
+def _restore_order(
+    block: np.ndarray,
+    sort_order: Optional[np.ndarray],
+    null_mask: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Scatters a (features x rows) block computed in the sorted order back to the original row order, in place"""
+    if sort_order is not None:
+        # A feature at a time through a single row of scratch, instead of a second block
+        buffer = np.empty(block.shape[1], dtype=block.dtype)
+        for row in block:
+            buffer[:] = row
+            row[sort_order] = buffer
+    if null_mask is not None:
+        block[:, null_mask] = np.nan
+    return block
+
+
+def _attach_block(
+    df: pd.DataFrame, block: np.ndarray, feature_names: List[str]
+) -> pd.DataFrame:
+    """Attaches a (features x rows) block to the dataframe as new columns"""
+    return _attach_blocks(df, [(block, feature_names)])
+
+
+def _attach_blocks(
+    df: pd.DataFrame, blocks: List[Tuple[np.ndarray, List[str]]]
+) -> pd.DataFrame:
+    """Attaches (features x rows) blocks, possibly of different dtypes, to the dataframe in a single concat"""
+    feat_dfs = [
+        pd.DataFrame(block.T, index=df.index, columns=feature_names, copy=False)
+        for block, feature_names in blocks
+    ]
+    feature_names = [c for feat_df in feat_dfs for c in feat_df.columns]
+    if len(set(feature_names).intersection(df.columns)) > 0:
+        # Overwriting existing columns. Keeping the column positions as `assign` would
+        return df.assign(
+            **{c: feat_df[c] for feat_df in feat_dfs for c in feat_df.columns}
+        )
+    # The blocks are not used after this, so they are attached without a copy
+    return pd.concat([df] + feat_dfs, axis=1, copy=False)
+
+
+def _get_ewma_alphas(params: List[float], use_spans: bool) -> np.ndarray:
+    """Converts the spans or alphas to the smoothing factor exactly as pandas does.
+    pandas converts both to the center of mass and back, alpha = 1/(1+com)"""
+    return np.asarray(
+        [
+            1.0 / (1.0 + ((param - 1) / 2 if use_spans else 1 / param - 1))
+            for param in params
+        ],
+        dtype=np.float64,
+    )
+
+
+@njit
+def _lag_kernel(values, offsets, lags, out):
+    """Fills all the lags in a single pass over the sorted values. out has shape (len(lags), len(values))"""
+    for g in range(len(offsets) - 1):
+        start, end = offsets[g], offsets[g + 1]
+        for j in range(len(lags)):
+            lag = lags[j]
+            for i in range(start, end):
+                k = i - lag
+                if k >= start and k < end:
+                    out[j, i] = values[k]
+                else:
+                    out[j, i] = np.nan
+
+
+ROLLING_AGG_CODES = {"mean": 0, "std": 1, "min": 2, "max": 3}
+
+
+@njit
+def _shift_group(values, start, end, n_shift, x):
+    """Writes the group values[start:end] shifted by n_shift into the first end-start positions of x"""
+    n = end - start
+    for i in range(n):
+        k = i - n_shift
+        if k >= 0 and k < n:
+            x[i] = values[start + k]
+        else:
+            x[i] = np.nan
+
+
+@njit
+def _window_moments(x, lo, hi):
+    """Exact count, mean and sum of squared deviations of the non missing values in x[lo:hi] in two passes"""
+    nobs = 0
+    total = 0.0
+    for k in range(lo, hi):
+        if not np.isnan(x[k]):
+            nobs += 1
+            total += x[k]
+    if nobs == 0:
+        return 0, 0.0, 0.0
+    mean = total / nobs
+    m2 = 0.0
+    for k in range(lo, hi):
+        if not np.isnan(x[k]):
+            d = x[k] - mean
+            m2 += d * d
+    return nobs, mean, m2
+
+
+@njit
+def _rolling_kernel(values, offsets, n_shift, windows, agg_codes, out):
+    """Computes all the rolling aggregations for all the windows with per series resets.
+
+    Mean and std come from a Welford update which adds the value entering the window and removes
+    the one leaving it. The moments are recomputed exactly from the window every `window` steps,
+    so the rounding error cannot build up over long or trending series, at an amortized cost of
+    one extra pass. Min/max come from monotonic deques. Like pandas with the default `min_periods`,
+    a window only produces a value if all of its observations are present.
+    out has shape (len(windows) * len(agg_codes), len(values)).
+    """
+    n_aggs = len(agg_codes)
+    need_min = False
+    need_max = False
+    need_moments = False
+    for a in range(n_aggs):
+        if agg_codes[a] == 2:
+            need_min = True
+        elif agg_codes[a] == 3:
+            need_max = True
+        else:
+            need_moments = True
+    max_len = 0
+    for g in range(len(offsets) - 1):
+        max_len = max(max_len, offsets[g + 1] - offsets[g])
+    x = np.empty(max_len)
+    min_q = np.empty(max_len, dtype=np.int64)
+    max_q = np.empty(max_len, dtype=np.int64)
+    for g in range(len(offsets) - 1):
+        start, end = offsets[g], offsets[g + 1]
+        n = end - start
+        _shift_group(values, start, end, n_shift, x)
+        for w in range(len(windows)):
+            l = windows[w]
+            min_head, min_tail, max_head, max_tail = 0, 0, 0, 0
+            # Number of non missing values in the window and their Welford moments
+            nobs, mean, m2 = 0, 0.0, 0.0
+            since_anchor = 0
+            for i in range(n):
+                if not np.isnan(x[i]):
+                    nobs += 1
+                    if need_moments:
+                        d = x[i] - mean
+                        mean += d / nobs
+                        m2 += d * (x[i] - mean)
+                if i >= l and not np.isnan(x[i - l]):
+                    nobs -= 1
+                    if need_moments:
+                        if nobs == 0:
+                            mean, m2 = 0.0, 0.0
+                        else:
+                            d = x[i - l] - mean
+                            mean -= d / nobs
+                            m2 -= d * (x[i - l] - mean)
+                if need_moments:
+                    since_anchor += 1
+                    if since_anchor >= l:
+                        since_anchor = 0
+                        nobs, mean, m2 = _window_moments(x, max(i - l + 1, 0), i + 1)
+                if need_min or need_max:
+                    if not np.isnan(x[i]):
+                        if need_min:
+                            while (
+                                min_tail > min_head and x[min_q[min_tail - 1]] >= x[i]
+                            ):
+                                min_tail -= 1
+                            min_q[min_tail] = i
+                            min_tail += 1
+                        if need_max:
+                            while (
+                                max_tail > max_head and x[max_q[max_tail - 1]] <= x[i]
+                            ):
+                                max_tail -= 1
+                            max_q[max_tail] = i
+                            max_tail += 1
+                    while min_tail > min_head and min_q[min_head] <= i - l:
+                        min_head += 1
+                    while max_tail > max_head and max_q[max_head] <= i - l:
+                        max_head += 1
+                valid = i >= l - 1 and nobs == l
+                for a in range(n_aggs):
+                    row = w * n_aggs + a
+                    code = agg_codes[a]
+                    if not valid:
+                        out[row, start + i] = np.nan
+                    elif code == 0:
+                        out[row, start + i] = mean
+                    elif code == 1:
+                        if l < 2:
+                            out[row, start + i] = np.nan
+                        else:
+                            out[row, start + i] = np.sqrt(max(m2 / (l - 1), 0.0))
+                    elif code == 2:
+                        out[row, start + i] = x[min_q[min_head]]
+                    else:
+                        out[row, start + i] = x[max_q[max_head]]
+
+
+@njit
+def _seasonal_rolling_kernel(
+    values, offsets, n_shift, season_length, windows, agg, out
+):
+    """Applies a window_ops seasonal rolling aggregation for all windows to all the series in one call.
+
+    Each series is shifted by n_shift seasonal cycles and `agg` works on the (cycles x season_length)
+    strided view of it. out has shape (len(windows), len(values)).
+    """
+    max_len = 0
+    for g in range(len(offsets) - 1):
+        max_len = max(max_len, offsets[g + 1] - offsets[g])
+    x = np.empty(max_len)
+    for g in range(len(offsets) - 1):
+        start, end = offsets[g], offsets[g + 1]
+        n = end - start
+        _shift_group(values, start, end, n_shift * season_length, x)
+        for w in range(len(windows)):
+            out[w, start:end] = agg(x[:n], season_length, windows[w])
+
+
+@njit
+def _ewma_kernel(values, offsets, n_shift, alphas, out):
+    """Computes the ewma for all alphas in a single sweep, resetting the state at every series.
+
+    Follows the pandas `ewm(alpha, adjust=False, ignore_na=False).mean()` recursion exactly,
+    including the decay of the old weight over missing values.
+    out has shape (len(alphas), len(values)).
+    """
+    for g in range(len(offsets) - 1):
+        start, end = offsets[g], offsets[g + 1]
+        n = end - start
+        for j in range(len(alphas)):
+            alpha = alphas[j]
+            old_wt_factor = 1.0 - alpha
+            weighted = np.nan
+            old_wt = 1.0
+            for i in range(n):
+                k = i - n_shift
+                cur = values[start + k] if k >= 0 and k < n else np.nan
+                is_observation = not np.isnan(cur)
+                if not np.isnan(weighted):
+                    old_wt *= old_wt_factor
+                    if is_observation:
+                        # avoid numerical errors on constant series
+                        if weighted != cur:
+                            weighted = (old_wt * weighted + alpha * cur) / (
+                                old_wt + alpha
+                            )
+                        old_wt = 1.0
+                elif is_observation:
+                    weighted = cur
+                out[j, start + i] = weighted
+
+
+@njit
+def _ewma_state_kernel(values, offsets, n_shift, alphas, weighted_out, old_wt_out):
+    """Runs the `_ewma_kernel` recursion up to the time step after the end of every series and
+    returns the final state. weighted_out and old_wt_out have shape (len(offsets) - 1, len(alphas))
+    """
+    for g in range(len(offsets) - 1):
+        start, end = offsets[g], offsets[g + 1]
+        n = end - start
+        for j in range(len(alphas)):
+            alpha = alphas[j]
+            old_wt_factor = 1.0 - alpha
+            weighted = np.nan
+            old_wt = 1.0
+            # The value at the next time step is the one n_shift steps before it
+            for k in range(0, n - n_shift + 1):
+                cur = values[start + k]
+                is_observation = not np.isnan(cur)
+                if not np.isnan(weighted):
+                    old_wt *= old_wt_factor
+                    if is_observation:
+                        if weighted != cur:
+                            weighted = (old_wt * weighted + alpha * cur) / (
+                                old_wt + alpha
+                            )
+                        old_wt = 1.0
+                elif is_observation:
+                    weighted = cur
+            weighted_out[g, j] = weighted
+            old_wt_out[g, j] = old_wt
+
+
+@njit
+def _horizon_gather_kernel(block, sorted_position, position_in_series, horizons, out):
+    """Gathers the features of every row for every horizon from the (features x rows) block computed
+    for horizon 1. Horizon h of a row reads the row h-1 steps earlier in the same series, or NaN if the
+    series does not go back that far (or position_in_series is negative). The output is written row by
+    row, so the writes to the (rows x horizons x features) out are sequential.
+    """
+    n_features = block.shape[0]
+    for i in range(len(sorted_position)):
+        for k in range(len(horizons)):
+            shift = horizons[k] - 1
+            if position_in_series[i] >= shift:
+                source = sorted_position[i] - shift
+                for f in range(n_features):
+                    out[i, k, f] = block[f, source]
+            else:
+                for f in range(n_features):
+                    out[i, k, f] = np.nan
@@ -0,0 +1,172 @@
+"""Runs the compiled feature kernels over shards of time series in a process pool
+
+The time series are split into shards of contiguous groups with roughly the same number of rows.
+The sorted values and the output block are placed in shared memory once, and the workers attach
+to them by name, so only the small per shard `offsets` array is pickled. The compiled kernels are
+sent by reference to the module they are defined in, so that the workers reuse the kernels
+compiled in the parent instead of compiling their own copies. Every worker writes into
+the disjoint rows of its shard, which keeps the output in the same sorted order as the single
+process run.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from multiprocessing import shared_memory
+from typing import Callable, List, Tuple
+
+import numpy as np
+from numba.core.dispatcher import Dispatcher
+
+from src.feature_engineering.memory_planner import _get_compute_dtype
+from src.utils.general import _get_n_jobs
+
+# A task is (kernel, sorted values, kernel arguments, first row of the block, last row of the block).
+# The kernel is called as kernel(values, offsets, *args, block[row_start:row_end])
+KernelTask = Tuple[Callable, np.ndarray, tuple, int, int]
+
+# Shared memory segments the worker has attached to, by name
+_attached_segments = {}
+
+# A compiled function, by the module and the name it is defined with
+_FunctionReference = namedtuple("_FunctionReference", ["module", "name"])
+
+
+def _to_reference(obj):
+    """A pickled numba dispatcher is rebuilt as a new object in the worker and compiled again.
+    Passing it by reference gets the already compiled one from the imported module instead"""
+    if isinstance(obj, Dispatcher):
+        return _FunctionReference(obj.py_func.__module__, obj.py_func.__qualname__)
+    return obj
+
+
+def _from_reference(obj):
+    if isinstance(obj, _FunctionReference):
+        return getattr(import_module(obj.module), obj.name)
+    return obj
+
+
+def _get_shards(offsets: np.ndarray, n_shards: int) -> List[Tuple[int, int]]:
+    """Splits the groups into at most n_shards contiguous ranges of groups with a balanced number of rows"""
+    n_groups = len(offsets) - 1
+    row_cuts = np.linspace(0, offsets[-1], n_shards + 1)[1:-1]
+    group_cuts = np.searchsorted(offsets, row_cuts)
+    bounds = np.unique(np.concatenate([[0], group_cuts, [n_groups]]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _to_shared_memory(
+    array: np.ndarray,
+) -> Tuple[shared_memory.SharedMemory, Tuple[str, tuple, str]]:
+    """Copies the array to a new shared memory segment and returns the segment and the spec to attach to it"""
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+    shared[...] = array
+    return segment, (segment.name, array.shape, array.dtype.str)
+
+
+def _attach(spec: Tuple[str, tuple, str]) -> np.ndarray:
+    name, shape, dtype = spec
+    if name not in _attached_segments:
+        _attached_segments[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=_attached_segments[name].buf)
+
+
+def _run_shard(
+    kernel: _FunctionReference,
+    values_spec: Tuple[str, tuple, str],
+    block_spec: Tuple[str, tuple, str],
+    rows: Tuple[int, int],
+    offsets: np.ndarray,
+    args: tuple,
+) -> None:
+    values = _attach(values_spec)
+    block = _attach(block_spec)
+    kernel = _from_reference(kernel)
+    args = tuple(_from_reference(arg) for arg in args)
+    kernel(values, offsets, *args, block[rows[0] : rows[1]])
+
+
+def _run_kernels(
+    tasks: List[KernelTask], offsets: np.ndarray, block: np.ndarray, n_jobs: int = 1
+) -> int:
+    """Runs the kernel tasks over all the time series, filling the block in place
+
+    The kernels cannot write into a float16 block, so every task is then computed into a scratch of
+    its own rows in float32 and cast into the block, instead of computing the whole block in float32.
+
+    Args:
+        tasks (List[KernelTask]): The kernels along with their inputs and the rows of the block they fill
+        offsets (np.ndarray): The group offsets of the sorted values
+        block (np.ndarray): The (features x rows) block the kernels write into
+        n_jobs (int, optional): Number of processes. -1 uses all the cores. Defaults to 1.
+
+    Returns:
+        int: The bytes of shared memory the block and the values were copied to, 0 if run in this process.
+            The segments are outside the Python heap, so tracemalloc does not see them
+    """
+    compute_dtype = _get_compute_dtype(block.dtype)
+    if compute_dtype != block.dtype:
+        shared_bytes = 0
+        if len(tasks) > 0:
+            scratch = np.empty(
+                (
+                    max(row_end - row_start for *_, row_start, row_end in tasks),
+                    block.shape[1],
+                ),
+                dtype=compute_dtype,
+            )
+        for kernel, values, args, row_start, row_end in tasks:
+            n_rows = row_end - row_start
+            shared_bytes = max(
+                shared_bytes,
+                _run_kernels(
+                    [(kernel, values, args, 0, n_rows)],
+                    offsets,
+                    scratch[:n_rows],
+                    n_jobs,
+                ),
+            )
+            block[row_start:row_end] = scratch[:n_rows]
+        return shared_bytes
+    n_jobs = _get_n_jobs(n_jobs)
+    shards = _get_shards(offsets, n_jobs) if n_jobs > 1 else []
+    if len(shards) < 2:
+        for kernel, values, args, row_start, row_end in tasks:
+            kernel(values, offsets, *args, block[row_start:row_end])
+        return 0
+    for kernel, values, args, row_start, row_end in tasks:
+        # Compiling in the parent with an empty set of groups, so that forked workers inherit the compiled kernels
+        kernel(values, offsets[:1], *args, block[row_start:row_end])
+    segments = []
+    try:
+        block_segment, block_spec = _to_shared_memory(block)
+        segments.append(block_segment)
+        values_specs = {}
+        for _, values, *_ in tasks:
+            if id(values) not in values_specs:
+                segment, values_specs[id(values)] = _to_shared_memory(values)
+                segments.append(segment)
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [
+                executor.submit(
+                    _run_shard,
+                    _to_reference(kernel),
+                    values_specs[id(values)],
+                    block_spec,
+                    (row_start, row_end),
+                    offsets[group_start : group_end + 1],
+                    tuple(_to_reference(arg) for arg in args),
+                )
+                for kernel, values, args, row_start, row_end in tasks
+                for group_start, group_end in shards
+            ]
+            for future in futures:
+                future.result()
+        block[...] = np.ndarray(block.shape, dtype=block.dtype, buffer=block_segment.buf)
+    finally:
+        shared_bytes = sum(segment.size for segment in segments)
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    return shared_bytes
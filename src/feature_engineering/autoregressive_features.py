@@ -1,6 +1,7 @@
 import warnings
 from typing import List, Tuple
 
+import numpy as np
 import pandas as pd
 from pandas.api.types import is_list_like
 from window_ops.rolling import (
@@ -10,6 +11,21 @@ from window_ops.rolling import (
     seasonal_rolling_std,
 )
 
+from src.feature_engineering._kernels import (
+    ROLLING_AGG_CODES,
+    _allocate_block,
+    _attach_block,
+    _ewma_kernel,
+    _get_ewma_alphas,
+    _get_group_offsets,
+    _get_sorted_values,
+    _lag_kernel,
+    _restore_order,
+    _rolling_kernel,
+    _seasonal_rolling_kernel,
+)
+from src.feature_engineering._parallel import _run_kernels
+from src.utils.cache import cache_preprocessing
 from src.utils.data_utils import _get_32_bit_dtype
 
 ALLOWED_AGG_FUNCS = ["mean", "max", "min", "std"]
@@ -33,16 +49,22 @@ train_df['lag1']=train_df.groupby(["LCLid"])['energy_consumption'].transform(lam
 from window_ops.shift import shift_array
 train_df['lag1'] = train_df.groupby(["LCLid"])['energy_consumption'].transform(lambda x: shift_array(x.values, 1))
 1.58 s ± 27.3 ms per loop (mean ± std. dev. of 7 runs, 1 loop each)
+4. (for multiple lags, `scripts/benchmark_feature_engineering.py`)
+Group boundaries computed once and all lags filled in a single numba pass into a preallocated block
+1000 series x 1000 timesteps, 5 lags: 412 ms (groupby shift per lag) vs 140 ms
+1000 series x 1000 timesteps, 50 lags: 4.11 s (groupby shift per lag) vs 394 ms
 
 """
 
 
+@cache_preprocessing(ignore=["n_jobs"])
 def add_lags(
     df: pd.DataFrame,
     lags: List[int],
     column: str,
     ts_id: str = None,
     use_32_bit: bool = False,
+    n_jobs: int = 1,
 ) -> Tuple[pd.DataFrame, List]:
     """Create Lags for the column provided and adds them as other columns in the provided dataframe
 
@@ -53,6 +75,8 @@ def add_lags(
         ts_id (str, optional): Column name of Unique ID of a time series to be grouped by before applying the lags.
             If None assumes dataframe only has a single timeseries. Defaults to None.
         use_32_bit (bool, optional): Flag to use float32 or int32 to reduce memory. Defaults to False.
+        n_jobs (int, optional): Number of processes across which the time series are sharded. -1 uses all
+            the cores. Defaults to 1.
 
     Returns:
         Tuple(pd.DataFrame, List): Returns a tuple of the new dataframe and a list of features which were added
@@ -66,31 +90,25 @@ def add_lags(
         warnings.warn(
             "Assuming just one unique time series in dataset. If there are multiple, provide `ts_id` argument"
         )
-        # Assuming just one unique time series in dataset
-        if use_32_bit and _32_bit_dtype is not None:
-            col_dict = {
-                f"{column}_lag_{l}": df[column].shift(l).astype(_32_bit_dtype)
-                for l in lags
-            }
-        else:
-            col_dict = {f"{column}_lag_{l}": df[column].shift(l) for l in lags}
     else:
         assert (
             ts_id in df.columns
         ), "`ts_id` should be a valid column in the provided dataframe"
-        if use_32_bit and _32_bit_dtype is not None:
-            col_dict = {
-                f"{column}_lag_{l}": df.groupby([ts_id])[column]
-                .shift(l)
-                .astype(_32_bit_dtype)
-                for l in lags
-            }
-        else:
-            col_dict = {
-                f"{column}_lag_{l}": df.groupby([ts_id])[column].shift(l) for l in lags
-            }
-    df = df.assign(**col_dict)
-    added_features = list(col_dict.keys())
+    # Group boundaries are computed once and all the lags are filled in a single pass
+    sort_order, offsets, null_mask = _get_group_offsets(df, ts_id)
+    values = _get_sorted_values(df, column, sort_order)
+    added_features = [f"{column}_lag_{l}" for l in lags]
+    block = _allocate_block(
+        len(lags), len(df), use_32_bit=use_32_bit and _32_bit_dtype is not None
+    )
+    _run_kernels(
+        [(_lag_kernel, values, (np.asarray(lags, dtype=np.int64),), 0, len(block))],
+        offsets,
+        block,
+        n_jobs,
+    )
+    block = _restore_order(block, sort_order, null_mask)
+    df = _attach_block(df, block, added_features)
     return df, added_features
 
 
@@ -108,9 +126,13 @@ train_df["rolling_3_mean"]=train_df.groupby(["LCLid"])['energy_consumption'].tra
 4. (for multiple aggregations)
 train_df.groupby(["LCLid"])['energy_consumption'].shift(1).rolling(3).agg({"rolling_3_mean": "mean", "rolling_3_std": "std"})
 1.8 s ± 26.3 ms per loop (mean ± std. dev. of 7 runs, 1 loop each)
+5. (for multiple windows and aggregations, `scripts/benchmark_feature_engineering.py`)
+Fused kernel with windowed Welford moments for mean/std and monotonic deques for min/max, resetting at every series
+1000 series x 1000 timesteps, 4 windows x [mean, std, min, max]: 4.99 s (groupby shift rolling agg) vs 278 ms
 """
 
 
+@cache_preprocessing(ignore=["n_jobs"])
 def add_rolling_features(
     df: pd.DataFrame,
     rolls: List[int],
@@ -119,6 +141,7 @@ def add_rolling_features(
     ts_id: str = None,
     n_shift: int = 1,
     use_32_bit: bool = False,
+    n_jobs: int = 1,
 ) -> Tuple[pd.DataFrame, List]:
     """Add rolling statistics from the column provided and adds them as other columns in the provided dataframe
 
@@ -131,6 +154,8 @@ def add_rolling_features(
         n_shift (int, optional): Number of time steps to shift before computing rolling statistics.
             Typically used to avoid data leakage. Defaults to 1.
         use_32_bit (bool, optional): Flag to use float32 or int32 to reduce memory. Defaults to False.
+        n_jobs (int, optional): Number of processes across which the time series are sharded. -1 uses all
+            the cores. Defaults to 1.
 
     Returns:
         Tuple[pd.DataFrame, List]: Returns a tuple of the new dataframe and a list of features which were added
@@ -149,40 +174,48 @@ def add_rolling_features(
         warnings.warn(
             "Assuming just one unique time series in dataset. If there are multiple, provide `ts_id` argument"
         )
-        # Assuming just one unique time series in dataset
-        rolling_df = pd.concat(
-            [
-                df[column]
-                .shift(n_shift)
-                .rolling(l)
-                .agg({f"{column}_rolling_{l}_{agg}": agg for agg in agg_funcs})
-                for l in rolls
-            ],
-            axis=1,
-        )
-
     else:
         assert (
             ts_id in df.columns
         ), "`ts_id` should be a valid column in the provided dataframe"
-        rolling_df = pd.concat(
-            [
-                df.groupby(ts_id)[column]
-                .shift(n_shift)
-                .rolling(l)
-                .agg({f"{column}_rolling_{l}_{agg}": agg for agg in agg_funcs})
-                for l in rolls
-            ],
-            axis=1,
-        )
-
-    df = df.assign(**rolling_df.to_dict("list"))
-    added_features = rolling_df.columns.tolist()
-    if use_32_bit and _32_bit_dtype is not None:
-        df[added_features] = df[added_features].astype(_32_bit_dtype)
+    agg_funcs = list(dict.fromkeys(agg_funcs))
+    # All windows and aggregations are computed in one fused pass with per series resets
+    sort_order, offsets, null_mask = _get_group_offsets(df, ts_id)
+    values = _get_sorted_values(df, column, sort_order)
+    added_features = [
+        f"{column}_rolling_{l}_{agg}" for l in rolls for agg in agg_funcs
+    ]
+    block = _allocate_block(
+        len(added_features),
+        len(df),
+        use_32_bit=use_32_bit and _32_bit_dtype is not None,
+    )
+    _run_kernels(
+        [
+            (
+                _rolling_kernel,
+                values,
+                (
+                    n_shift,
+                    np.asarray(rolls, dtype=np.int64),
+                    np.asarray(
+                        [ROLLING_AGG_CODES[agg] for agg in agg_funcs], dtype=np.int64
+                    ),
+                ),
+                0,
+                len(block),
+            )
+        ],
+        offsets,
+        block,
+        n_jobs,
+    )
+    block = _restore_order(block, sort_order, null_mask)
+    df = _attach_block(df, block, added_features)
     return df, added_features
 
 
+@cache_preprocessing(ignore=["n_jobs"])
 def add_seasonal_rolling_features(
     df: pd.DataFrame,
     seasonal_periods: List[int],
@@ -192,6 +225,7 @@ def add_seasonal_rolling_features(
     ts_id: str = None,
     n_shift: int = 1,
     use_32_bit: bool = False,
+    n_jobs: int = 1,
 ) -> Tuple[pd.DataFrame, List]:
     """Add seasonal rolling statistics from the column provided and adds them as other columns in the provided dataframe
 
@@ -205,6 +239,8 @@ def add_seasonal_rolling_features(
         n_shift (int, optional): The number of seasonal shifts to be applied before the seasonal rolling operation.
             Typically used to avoid data leakage. Defaults to 1.
         use_32_bit (bool, optional): Flag to use float32 or int32 to reduce memory. Defaults to False.
+        n_jobs (int, optional): Number of processes across which the time series are sharded. -1 uses all
+            the cores. Defaults to 1.
 
     Returns:
         Tuple[pd.DataFrame, List]: Returns a tuple of the new dataframe and a list of features which were added
@@ -223,76 +259,45 @@ def add_seasonal_rolling_features(
     ), f"`agg_funcs` should be one of {ALLOWED_AGG_FUNCS}"
     _32_bit_dtype = _get_32_bit_dtype(df[column])
     agg_funcs = {agg: SEASONAL_ROLLING_MAP[agg] for agg in agg_funcs}
-    added_features = []
+    if ts_id is None:
+        warnings.warn(
+            "Assuming just one unique time series in dataset. If there are multiple, provide `ts_id` argument"
+        )
+    else:
+        assert (
+            ts_id in df.columns
+        ), "`ts_id` should be a valid column in the provided dataframe"
+    sort_order, offsets, null_mask = _get_group_offsets(df, ts_id)
+    values = _get_sorted_values(df, column, sort_order)
+    windows = np.asarray(rolls, dtype=np.int64)
+    added_features = [
+        f"{column}_{sp}_seasonal_rolling_{l}_{name}"
+        for sp in seasonal_periods
+        for name in agg_funcs.keys()
+        for l in rolls
+    ]
+    block = _allocate_block(
+        len(added_features),
+        len(df),
+        use_32_bit=use_32_bit and _32_bit_dtype is not None,
+    )
+    # One compiled call per aggregation evaluates all the windows for all the series
+    tasks = []
     for sp in seasonal_periods:
-        if ts_id is None:
-            warnings.warn(
-                "Assuming just one unique time series in dataset. If there are multiple, provide `ts_id` argument"
+        for agg in agg_funcs.values():
+            row = len(tasks) * len(rolls)
+            tasks.append(
+                (
+                    _seasonal_rolling_kernel,
+                    values,
+                    (n_shift, sp, windows, agg),
+                    row,
+                    row + len(rolls),
+                )
             )
-            # Assuming just one unique time series in dataset
-            if use_32_bit and _32_bit_dtype is not None:
-                col_dict = {
-                    f"{column}_{sp}_seasonal_rolling_{l}_{name}": df[column]
-                    .transform(
-                        lambda x: agg(
-                            x.shift(n_shift * sp).values,
-                            season_length=sp,
-                            window_size=l,
-                        )
-                    )
-                    .astype(_32_bit_dtype)
-                    for (name, agg) in agg_funcs.items()
-                    for l in rolls
-                }
-            else:
-                col_dict = {
-                    f"{column}_{sp}_seasonal_rolling_{l}_{name}": df[column].transform(
-                        lambda x: agg(
-                            x.shift(n_shift * sp).values,
-                            season_length=sp,
-                            window_size=l,
-                        )
-                    )
-                    for (name, agg) in agg_funcs.items()
-                    for l in rolls
-                }
-
-        else:
-            assert (
-                ts_id in df.columns
-            ), "`ts_id` should be a valid column in the provided dataframe"
-            if use_32_bit and _32_bit_dtype is not None:
-                col_dict = {
-                    f"{column}_{sp}_seasonal_rolling_{l}_{name}": df.groupby(ts_id)[
-                        column
-                    ]
-                    .transform(
-                        lambda x: agg(
-                            x.shift(n_shift * sp).values,
-                            season_length=sp,
-                            window_size=l,
-                        )
-                    )
-                    .astype(_32_bit_dtype)
-                    for (name, agg) in agg_funcs.items()
-                    for l in rolls
-                }
-            else:
-                col_dict = {
-                    f"{column}_{sp}_seasonal_rolling_{l}_{name}": df.groupby(ts_id)[
-                        column
-                    ].transform(
-                        lambda x: agg(
-                            x.shift(n_shift * sp).values,
-                            season_length=sp,
-                            window_size=l,
-                        )
-                    )
-                    for (name, agg) in agg_funcs.items()
-                    for l in rolls
-                }
-        df = df.assign(**col_dict)
-        added_features += list(col_dict.keys())
+    _run_kernels(tasks, offsets, block, n_jobs)
+    block = _restore_order(block, sort_order, null_mask)
+    df = _attach_block(df, block, added_features)
     return df, added_features
 
 
@@ -308,9 +313,13 @@ train_df["ewma_alpha_0.9"]=train_df.groupby(["LCLid"])['energy_consumption'].tra
 from window_ops.ewm import ewm_mean
 train_df["ewma_alpha_0.9"]=train_df.groupby(["LCLid"])['energy_consumption'].transform(lambda x: ewm_mean(x.shift(1).values, alpha=0.9))
 1.9 s ± 53 ms per loop (mean ± std. dev. of 7 runs, 1 loop each)
+4. (for multiple alphas, `scripts/benchmark_feature_engineering.py`)
+All alphas in a single numba sweep over the ts_id sorted values, resetting at every series
+1000 series x 1000 timesteps, 5 alphas: 481 ms (groupby shift ewm per alpha) vs 140 ms
 """
 
 
+@cache_preprocessing(ignore=["n_jobs"])
 def add_ewma(
     df: pd.DataFrame,
     column: str,
@@ -319,6 +328,7 @@ def add_ewma(
     ts_id: str = None,
     n_shift: int = 1,
     use_32_bit: bool = False,
+    n_jobs: int = 1,
 ) -> Tuple[pd.DataFrame, List]:
     """Create Exponentially Weighted Average for the column provided and adds them as other columns in the provided dataframe
 
@@ -333,10 +343,13 @@ def add_ewma(
         n_shift (int, optional): Number of time steps to shift before computing ewma.
             Typically used to avoid data leakage. Defaults to 1.
         use_32_bit (bool, optional): Flag to use float32 or int32 to reduce memory. Defaults to False.
+        n_jobs (int, optional): Number of processes across which the time series are sharded. -1 uses all
+            the cores. Defaults to 1.
 
     Returns:
         Tuple(pd.DataFrame, List): Returns a tuple of the new dataframe and a list of features which were added
     """
+    use_spans = False
     if spans is not None:
         assert isinstance(
             spans, list
@@ -358,64 +371,28 @@ def add_ewma(
         warnings.warn(
             "Assuming just one unique time series in dataset. If there are multiple, provide `ts_id` argument"
         )
-        # Assuming just one unique time series in dataset
-        if use_32_bit and _32_bit_dtype is not None:
-            col_dict = {
-                f"{column}_ewma_{'span' if use_spans else 'alpha'}_{param}": df[column]
-                .shift(n_shift)
-                .ewm(
-                    alpha=None if use_spans else param,
-                    span=param if use_spans else None,
-                    adjust=False,
-                )
-                .mean()
-                .astype(_32_bit_dtype)
-                for param in (spans if use_spans else alphas)
-            }
-        else:
-            col_dict = {
-                f"{column}_ewma_{'span' if use_spans else 'alpha'}_{param}": df[column]
-                .shift(n_shift)
-                .ewm(
-                    alpha=None if use_spans else param,
-                    span=param if use_spans else None,
-                    adjust=False,
-                )
-                .mean()
-                for param in (spans if use_spans else alphas)
-            }
     else:
         assert (
             ts_id in df.columns
         ), "`ts_id` should be a valid column in the provided dataframe"
-        if use_32_bit and _32_bit_dtype is not None:
-            col_dict = {
-                f"{column}_ewma_{'span' if use_spans else 'alpha'}_{param}": df.groupby(
-                    [ts_id]
-                )[column]
-                .shift(n_shift)
-                .ewm(
-                    alpha=None if use_spans else param,
-                    span=param if use_spans else None,
-                    adjust=False,
-                )
-                .mean()
-                .astype(_32_bit_dtype)
-                for param in (spans if use_spans else alphas)
-            }
-        else:
-            col_dict = {
-                f"{column}_ewma_{'span' if use_spans else 'alpha'}_{param}": df.groupby(
-                    [ts_id]
-                )[column]
-                .shift(n_shift)
-                .ewm(
-                    alpha=None if use_spans else param,
-                    span=param if use_spans else None,
-                    adjust=False,
-                )
-                .mean()
-                for param in (spans if use_spans else alphas)
-            }
-    df = df.assign(**col_dict)
-    return df, list(col_dict.keys())
+    params = spans if use_spans else alphas
+    smoothing = _get_ewma_alphas(params, use_spans)
+    sort_order, offsets, null_mask = _get_group_offsets(df, ts_id)
+    values = _get_sorted_values(df, column, sort_order)
+    added_features = [
+        f"{column}_ewma_{'span' if use_spans else 'alpha'}_{param}" for param in params
+    ]
+    block = _allocate_block(
+        len(added_features),
+        len(df),
+        use_32_bit=use_32_bit and _32_bit_dtype is not None,
+    )
+    _run_kernels(
+        [(_ewma_kernel, values, (n_shift, smoothing), 0, len(block))],
+        offsets,
+        block,
+        n_jobs,
+    )
+    block = _restore_order(block, sort_order, null_mask)
+    df = _attach_block(df, block, added_features)
+    return df, added_features
@@ -0,0 +1,309 @@
+"""Autoregressive features for direct multi-step forecasting
+
+A direct model for horizon h can only use the information available h steps before the target,
+which is the same as computing the features with a shift of h instead of 1. Since shifting
+commutes with lags, rolling windows and ewma within a time series, the features for horizon h are
+the features for horizon 1 moved down by h-1 rows of the same series. So the features are computed
+once and every horizon is an offset into the same base block.
+"""
+
+import warnings
+from dataclasses import MISSING, dataclass, field
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_list_like
+
+from src.feature_engineering._kernels import (
+    ROLLING_AGG_CODES,
+    _allocate_block,
+    _ewma_kernel,
+    _get_ewma_alphas,
+    _get_group_offsets,
+    _get_sorted_values,
+    _horizon_gather_kernel,
+    _lag_kernel,
+    _rolling_kernel,
+)
+from src.feature_engineering._parallel import _run_kernels
+from src.feature_engineering.autoregressive_features import ALLOWED_AGG_FUNCS
+from src.utils.cache import cache_preprocessing
+from src.utils.data_utils import _get_32_bit_dtype
+
+ALLOWED_OUTPUTS = ["tensor", "long", "views"]
+
+
+@dataclass
+class HorizonFeatureViews:
+
+    base: np.ndarray = field(
+        default=MISSING,
+        metadata={
+            "help": "The (padded rows x features) features for horizon 1 in the ts_id sorted order, with max(horizons)-1 rows of NaN before every time series"
+        },
+    )
+    positions: np.ndarray = field(
+        default=MISSING,
+        metadata={
+            "help": "The row of every row of the dataframe (in its original order) in the horizon views"
+        },
+    )
+    horizons: List[int] = field(
+        default=MISSING, metadata={"help": "The forecast horizons"}
+    )
+    feature_names: List[str] = field(
+        default=MISSING,
+        metadata={"help": "The names of the features, as they are for horizon 1"},
+    )
+
+    @property
+    def _pad(self) -> int:
+        return max(self.horizons) - 1
+
+    def __getitem__(self, horizon: int) -> np.ndarray:
+        """The (padded rows x features) features for the horizon, a view into `base` at an offset of horizon-1
+        rows. The rows are in the ts_id sorted order, use `positions` to get the rows of the dataframe
+        """
+        assert horizon in self.horizons, f"`horizon` should be one of {self.horizons}"
+        start = self._pad - (horizon - 1)
+        return self.base[start : start + len(self.base) - self._pad]
+
+    def take(self, horizon: int) -> np.ndarray:
+        """The (rows x features) features for the horizon in the row order of the dataframe. This is a copy"""
+        return self[horizon][self.positions]
+
+    def as_tensor_view(self) -> np.ndarray:
+        """All the horizons as a read only (padded rows x horizons x features) strided view into `base`, in the
+        ts_id sorted order. Only possible if the horizons are equally spaced, for eg. 1 to 24
+        """
+        steps = np.diff(self.horizons)
+        assert len(steps) == 0 or np.all(
+            steps == steps[0]
+        ), "`horizons` should be equally spaced to be viewed as a single tensor"
+        step = steps[0] if len(steps) > 0 else 0
+        row_stride, feature_stride = self.base.strides
+        return np.lib.stride_tricks.as_strided(
+            self[self.horizons[0]],
+            shape=(len(self.base) - self._pad, len(self.horizons), self.base.shape[1]),
+            strides=(row_stride, -step * row_stride, feature_stride),
+            writeable=False,
+        )
+
+
+def _get_horizon_views(
+    block: np.ndarray,
+    offsets: np.ndarray,
+    sort_order: np.ndarray,
+    null_mask: np.ndarray,
+    horizons: List[int],
+    feature_names: List[str],
+) -> HorizonFeatureViews:
+    """Lays the (features x rows) block out as the padded base of `HorizonFeatureViews`"""
+    pad = max(horizons) - 1
+    n_rows, n_groups = block.shape[1], len(offsets) - 1
+    # Every time series is moved down by the padding of itself and the series before it
+    padded_position = np.arange(n_rows, dtype=np.int64) + pad * np.repeat(
+        np.arange(1, n_groups + 1, dtype=np.int64), np.diff(offsets)
+    )
+    base = np.full((n_rows + n_groups * pad, len(feature_names)), np.nan, block.dtype)
+    base[padded_position] = block.T
+    if null_mask is not None:
+        # Rows with a missing ts_id form a group of their own, which is NaN for all horizons
+        base[
+            padded_position[
+                null_mask[sort_order] if sort_order is not None else null_mask
+            ]
+        ] = np.nan
+    positions = padded_position - pad
+    if sort_order is not None:
+        positions = np.empty_like(padded_position)
+        positions[sort_order] = padded_position - pad
+    return HorizonFeatureViews(
+        base=base,
+        positions=positions,
+        horizons=list(horizons),
+        feature_names=feature_names,
+    )
+
+
+@cache_preprocessing(ignore=["n_jobs"])
+def get_direct_horizon_features(
+    df: pd.DataFrame,
+    column: str,
+    horizons: List[int],
+    lags: List[int] = None,
+    rolls: List[int] = None,
+    agg_funcs: List[str] = ["mean", "std"],
+    alphas: List[float] = None,
+    spans: List[float] = None,
+    ts_id: str = None,
+    output: str = "tensor",
+    use_32_bit: bool = False,
+    n_jobs: int = 1,
+) -> Tuple[Union[np.ndarray, pd.DataFrame, HorizonFeatureViews], List]:
+    """Creates the lag, rolling and ewma features of the column for all the forecast horizons at once
+
+    The features for horizon h are the ones `add_lags`, `add_rolling_features` and `add_ewma` would create
+    with the data shifted by h instead of 1 (`n_shift=h`, or lags l+h-1). They are computed once for horizon 1
+    in the ts_id sorted order and every horizon reads the same base block at an offset of h-1 rows, masked at
+    the start of every series, in a single compiled pass which writes the output in the original row order.
+    The "tensor" and "long" outputs are in the row order of `df`, which cannot be a view into the sorted base
+    block, so they hold a copy of the features for every horizon. The "views" output does not copy per
+    horizon: the base block is laid out with NaN rows before every series, so that every horizon is a plain
+    offset view into it.
+
+    Args:
+        df (pd.DataFrame): The dataframe from which the features are created
+        column (str): The column used for feature engineering
+        horizons (List[int]): The forecast horizons, starting at 1 for the next time step
+        lags (List[int], optional): List of lags to be created. Defaults to None.
+        rolls (List[int], optional): Different windows over which the rolling aggregations to be done. Defaults to None.
+        agg_funcs (List[str], optional): The different aggregations to be done on the rolling window. Defaults to ["mean", "std"].
+        alphas (List[float], optional): List of alphas (smoothing parameters) using which ewmas are be created. Defaults to None.
+        spans (List[float], optional): List of spans using which ewmas are be created. If span is given, we ignore alpha.
+            Defaults to None.
+        ts_id (str, optional): Unique id for a time series. If None assumes dataframe only has a single timeseries.
+            Defaults to None.
+        output (str, optional): "tensor" returns a (rows x horizons x features) array in the row order of `df`.
+            "long" returns the same values stacked into a dataframe of (rows x horizons) rows, indexed by the index
+            of `df` and the horizon. "views" returns a `HorizonFeatureViews` with a single base block of the
+            size of one horizon (plus max(horizons)-1 rows per series), of which every horizon is a view.
+            Defaults to "tensor".
+        use_32_bit (bool, optional): Flag to use float32 to reduce memory. Defaults to False.
+        n_jobs (int, optional): Number of processes across which the time series are sharded. -1 uses all
+            the cores. Defaults to 1.
+
+    Returns:
+        Tuple[Union[np.ndarray, pd.DataFrame, HorizonFeatureViews], List]: Returns a tuple of the features and a
+            list of the feature names, named as they are for horizon 1
+    """
+    assert (
+        column in df.columns
+    ), "`column` should be a valid column in the provided dataframe"
+    assert (
+        is_list_like(horizons) and len(horizons) > 0 and min(horizons) >= 1
+    ), "`horizons` should be a list of positive integers"
+    assert (
+        lags is not None or rolls is not None or alphas is not None or spans is not None
+    ), "At least one of `lags`, `rolls`, `alphas` or `spans` should be provided"
+    assert (
+        len(set(agg_funcs) - set(ALLOWED_AGG_FUNCS)) == 0
+    ), f"`agg_funcs` should be one of {ALLOWED_AGG_FUNCS}"
+    assert output in ALLOWED_OUTPUTS, f"`output` should be one of {ALLOWED_OUTPUTS}"
+    if ts_id is None:
+        warnings.warn(
+            "Assuming just one unique time series in dataset. If there are multiple, provide `ts_id` argument"
+        )
+    else:
+        assert (
+            ts_id in df.columns
+        ), "`ts_id` should be a valid column in the provided dataframe"
+    _32_bit_dtype = _get_32_bit_dtype(df[column])
+    sort_order, offsets, null_mask = _get_group_offsets(df, ts_id)
+    values = _get_sorted_values(df, column, sort_order)
+    n_rows = len(df)
+
+    tasks, feature_names = [], []
+    if lags is not None:
+        assert is_list_like(lags), "`lags` should be a list of all required lags"
+        tasks.append(
+            (
+                _lag_kernel,
+                values,
+                (np.asarray(lags, dtype=np.int64),),
+                len(feature_names),
+                len(feature_names) + len(lags),
+            )
+        )
+        feature_names += [f"{column}_lag_{l}" for l in lags]
+    if rolls is not None:
+        assert is_list_like(
+            rolls
+        ), "`rolls` should be a list of all required rolling windows"
+        agg_funcs = list(dict.fromkeys(agg_funcs))
+        names = [f"{column}_rolling_{l}_{agg}" for l in rolls for agg in agg_funcs]
+        tasks.append(
+            (
+                _rolling_kernel,
+                values,
+                (
+                    1,
+                    np.asarray(rolls, dtype=np.int64),
+                    np.asarray(
+                        [ROLLING_AGG_CODES[agg] for agg in agg_funcs], dtype=np.int64
+                    ),
+                ),
+                len(feature_names),
+                len(feature_names) + len(names),
+            )
+        )
+        feature_names += names
+    if spans is not None or alphas is not None:
+        use_spans = spans is not None
+        params = spans if use_spans else alphas
+        assert isinstance(
+            params, list
+        ), "`spans` or `alphas` should be a list of all required parameters"
+        tasks.append(
+            (
+                _ewma_kernel,
+                values,
+                (1, _get_ewma_alphas(params, use_spans)),
+                len(feature_names),
+                len(feature_names) + len(params),
+            )
+        )
+        feature_names += [
+            f"{column}_ewma_{'span' if use_spans else 'alpha'}_{param}"
+            for param in params
+        ]
+
+    block = _allocate_block(
+        len(feature_names),
+        n_rows,
+        use_32_bit=use_32_bit and _32_bit_dtype is not None,
+    )
+    _run_kernels(tasks, offsets, block, n_jobs)
+    if output == "views":
+        return (
+            _get_horizon_views(
+                block, offsets, sort_order, null_mask, horizons, feature_names
+            ),
+            feature_names,
+        )
+
+    # Position of every row in the sorted block and within its own time series
+    sorted_position = np.arange(n_rows, dtype=np.int64)
+    position_in_series = sorted_position - np.repeat(offsets[:-1], np.diff(offsets))
+    if sort_order is not None:
+        # Back to the original row order
+        sorted_position = np.empty_like(sort_order)
+        sorted_position[sort_order] = np.arange(n_rows, dtype=np.int64)
+        position_in_series = position_in_series[sorted_position]
+    if null_mask is not None:
+        # Rows with a missing ts_id get NaN for all horizons
+        position_in_series[null_mask] = -1
+
+    tensor = np.empty((n_rows, len(horizons), len(feature_names)), dtype=block.dtype)
+    _horizon_gather_kernel(
+        block,
+        sorted_position,
+        position_in_series,
+        np.asarray(horizons, dtype=np.int64),
+        tensor,
+    )
+    if output == "tensor":
+        return tensor, feature_names
+    index = pd.MultiIndex.from_product(
+        [df.index, horizons], names=[df.index.name, "horizon"]
+    )
+    return (
+        pd.DataFrame(
+            tensor.reshape(n_rows * len(horizons), len(feature_names)),
+            index=index,
+            columns=feature_names,
+            copy=False,
+        ),
+        feature_names,
+    )
@@ -0,0 +1,112 @@
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import humanize
+import numpy as np
+import pandas as pd
+
+ALLOWED_FLOAT_DTYPES = ["float16", "float32", "float64"]
+
+
+@dataclass
+class MemoryPlan:
+
+    lags_dtype: str = field(
+        default="float32",
+        metadata={"help": "dtype of the lag features. Defaults to float32"},
+    )
+    rolling_dtype: str = field(
+        default="float32",
+        metadata={
+            "help": "dtype of the rolling and seasonal rolling statistics. float16 halves the memory again, but only keeps ~3 significant digits. Defaults to float32"
+        },
+    )
+    ewma_dtype: str = field(
+        default="float32",
+        metadata={"help": "dtype of the exponentially weighted averages. Defaults to float32"},
+    )
+    fourier_dtype: str = field(
+        default="float32",
+        metadata={"help": "dtype of the fourier terms. Defaults to float32"},
+    )
+    narrow_calendar: bool = field(
+        default=True,
+        metadata={
+            "help": "Store every calendar feature in the smallest integer dtype which holds its range, for eg. int8 for Month. Defaults to True"
+        },
+    )
+    categorical_ids: bool = field(
+        default=True,
+        metadata={
+            "help": "Convert the ts_id column to a categorical if it is stored as strings. Defaults to True"
+        },
+    )
+
+    def __post_init__(self):
+        for dtype in [
+            self.lags_dtype,
+            self.rolling_dtype,
+            self.ewma_dtype,
+            self.fourier_dtype,
+        ]:
+            assert (
+                dtype in ALLOWED_FLOAT_DTYPES
+            ), f"The dtypes of the features should be one of {ALLOWED_FLOAT_DTYPES}"
+
+    def get_dtype(self, kind: str) -> np.dtype:
+        """Returns the dtype in which the features of the family are stored
+
+        Args:
+            kind (str): The feature family. One of "lags", "rolling", "seasonal_rolling", "ewma" or "fourier"
+
+        Returns:
+            np.dtype: The dtype of the features
+        """
+        return np.dtype(
+            {
+                "lags": self.lags_dtype,
+                "rolling": self.rolling_dtype,
+                "seasonal_rolling": self.rolling_dtype,
+                "ewma": self.ewma_dtype,
+                "fourier": self.fourier_dtype,
+            }[kind]
+        )
+
+
+def _get_compute_dtype(dtype: np.dtype) -> np.dtype:
+    """The compiled kernels do not support float16, so those features are computed in float32 a task at a time"""
+    return np.dtype("float32") if dtype == np.float16 else np.dtype(dtype)
+
+
+def get_memory_report(
+    df: pd.DataFrame, features: List[str], families: Dict[str, str] = None
+) -> pd.DataFrame:
+    """Returns the dtype and the memory used by every feature
+
+    Args:
+        df (pd.DataFrame): The dataframe with the features
+        features (List[str]): The features to be reported
+        families (Dict[str, str], optional): Mapping of the feature to its family, for eg. "lags". Defaults to None.
+
+    Returns:
+        pd.DataFrame: The report with the feature, family, dtype and bytes of every feature
+    """
+    families = {} if families is None else families
+    return pd.DataFrame(
+        {
+            "feature": features,
+            "family": [families.get(f) for f in features],
+            "dtype": [str(df[f].dtype) for f in features],
+            "bytes": [int(df[f].memory_usage(index=False, deep=True)) for f in features],
+        }
+    )
+
+
+def print_memory_report(report: pd.DataFrame) -> None:
+    """Prints the memory report from `get_memory_report` along with the total of every family"""
+    report = report.assign(memory=report["bytes"].apply(humanize.naturalsize))
+    print(report.drop(columns="bytes").to_string(index=False))
+    totals = report.groupby("family", dropna=False, sort=False)["bytes"].sum()
+    for family, n_bytes in totals.items():
+        print(f"{family}: {humanize.naturalsize(n_bytes)}")
+    print(f"Total Feature Memory: {humanize.naturalsize(report['bytes'].sum())}")
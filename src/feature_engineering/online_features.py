@@ -0,0 +1,279 @@
+import warnings
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_list_like
+
+from src.feature_engineering._kernels import (
+    _ewma_state_kernel,
+    _get_ewma_alphas,
+    _get_group_offsets,
+    _get_sorted_values,
+)
+from src.feature_engineering.autoregressive_features import ALLOWED_AGG_FUNCS
+
+_SINGLE_SERIES_ID = "__single_series__"
+
+
+class OnlineFeatureState:
+    def __init__(
+        self,
+        column: str,
+        lags: Optional[List[int]] = None,
+        rolls: Optional[List[int]] = None,
+        agg_funcs: List[str] = ["mean", "std"],
+        rolling_n_shift: int = 1,
+        alphas: Optional[List[float]] = None,
+        spans: Optional[List[float]] = None,
+        ewma_n_shift: int = 1,
+        ts_id: str = None,
+        use_32_bit: bool = False,
+    ) -> None:
+        """Incrementally updated state of the autoregressive features for inference.
+
+        Holds a ring buffer of the recent history and the ewma recursion of every time series,
+        so that the features of the next time step are available without a full recompute. The
+        rolling statistics are computed from the windows in the buffer when they are asked for
+        rather than kept as running sums, which would lose precision as the stream runs. The
+        specifications and feature names are the same as `add_lags`, `add_rolling_features`
+        and `add_ewma`, and the features match what those functions would produce for the
+        time step after the last observation.
+
+        Args:
+            column (str): Name of the column from which the features are created
+            lags (List[int], optional): List of lags to be created. Should be >= 1. Defaults to None.
+            rolls (List[int], optional): Different windows over which the rolling aggregations
+                to be done. Defaults to None.
+            agg_funcs (List[str], optional): The different aggregations to be done on the rolling window.
+                Defaults to ["mean", "std"].
+            rolling_n_shift (int, optional): Number of time steps to shift before computing rolling
+                statistics. Should be >= 1. Defaults to 1.
+            alphas (List[float], optional): List of alphas (smoothing parameters) using which ewmas
+                are be created. Defaults to None.
+            spans (List[float], optional): List of spans using which ewmas are be created.
+                If span is given, we ignore alpha. Defaults to None.
+            ewma_n_shift (int, optional): Number of time steps to shift before computing ewma.
+                Should be >= 1. Defaults to 1.
+            ts_id (str, optional): Unique ID of a time series. If None assumes dataframe only
+                has a single timeseries. Defaults to None.
+            use_32_bit (bool, optional): Flag to use float32 to reduce memory. Defaults to False.
+        """
+        self.column = column
+        self.lags = list(lags) if lags is not None else []
+        self.rolls = list(rolls) if rolls is not None else []
+        self.agg_funcs = list(dict.fromkeys(agg_funcs))
+        self.rolling_n_shift = rolling_n_shift
+        self.use_spans = spans is not None
+        self.ewma_params = (
+            list(spans)
+            if self.use_spans
+            else list(alphas) if alphas is not None else []
+        )
+        self.ewma_n_shift = ewma_n_shift
+        self.ts_id = ts_id
+        self.use_32_bit = use_32_bit
+        for param in ["lags", "rolls", "ewma_params"]:
+            assert is_list_like(getattr(self, param)), f"`{param}` should be a list"
+        assert all(
+            l >= 1 for l in self.lags
+        ), "`lags` should be >= 1 to be computed online"
+        assert rolling_n_shift >= 1, "`rolling_n_shift` should be >= 1"
+        assert ewma_n_shift >= 1, "`ewma_n_shift` should be >= 1"
+        assert (
+            len(set(self.agg_funcs) - set(ALLOWED_AGG_FUNCS)) == 0
+        ), f"`agg_funcs` should be one of {ALLOWED_AGG_FUNCS}"
+        self._alphas = _get_ewma_alphas(self.ewma_params, self.use_spans)
+        # The buffer should hold the largest lag and the oldest value of every rolling window
+        self._buffer_size = (
+            max(self.lags + [rolling_n_shift + l for l in self.rolls] + [ewma_n_shift])
+            + 1
+        )
+        self.feature_names = (
+            [f"{column}_lag_{l}" for l in self.lags]
+            + [
+                f"{column}_rolling_{l}_{agg}"
+                for l in self.rolls
+                for agg in self.agg_funcs
+            ]
+            + [
+                f"{column}_ewma_{'span' if self.use_spans else 'alpha'}_{param}"
+                for param in self.ewma_params
+            ]
+        )
+        self._fitted = False
+
+    def _get_ts_ids(self, df: pd.DataFrame) -> pd.Series:
+        if self.ts_id is None:
+            return pd.Series(_SINGLE_SERIES_ID, index=df.index)
+        assert (
+            self.ts_id in df.columns
+        ), "`ts_id` should be a valid column in the provided dataframe"
+        return df[self.ts_id]
+
+    def fit(self, df: pd.DataFrame):
+        """Builds the state from the full history
+
+        Args:
+            df (pd.DataFrame): The history in long format, with each time series sorted in time
+
+        Returns:
+            OnlineFeatureState: The fitted state
+        """
+        assert (
+            self.column in df.columns
+        ), "`column` should be a valid column in the provided dataframe"
+        if self.ts_id is None:
+            warnings.warn(
+                "Assuming just one unique time series in dataset. If there are multiple, provide `ts_id` argument"
+            )
+            df = df.assign(**{_SINGLE_SERIES_ID: _SINGLE_SERIES_ID})
+            ts_id = _SINGLE_SERIES_ID
+        else:
+            ts_id = self.ts_id
+        df = df.loc[self._get_ts_ids(df).notnull()]
+        self._index = pd.Index(pd.unique(df[ts_id]))
+        sort_order, offsets, _ = _get_group_offsets(df, ts_id)
+        values = _get_sorted_values(df, self.column, sort_order)
+        n_series, B = len(self._index), self._buffer_size
+        self._n_obs = np.diff(offsets)
+        # Ring buffer slot of the value at position p is p % B
+        positions = self._n_obs[:, None] - B + np.arange(B)[None, :]
+        in_history = positions >= 0
+        self._buffer = np.full((n_series, B), np.nan)
+        rows, cols = np.nonzero(in_history)
+        self._buffer[rows, positions[rows, cols] % B] = values[
+            offsets[:-1][rows] + positions[rows, cols]
+        ]
+        self._ewma_weighted = np.empty((n_series, len(self._alphas)))
+        self._ewma_old_wt = np.empty((n_series, len(self._alphas)))
+        _ewma_state_kernel(
+            values,
+            offsets,
+            self.ewma_n_shift,
+            self._alphas,
+            self._ewma_weighted,
+            self._ewma_old_wt,
+        )
+        self._fitted = True
+        return self
+
+    def _buffer_at(self, rows: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        """Values at the given positions of the series, NaN for positions before the start"""
+        positions = np.asarray(positions)
+        values = self._buffer[
+            rows.reshape(-1, *([1] * (positions.ndim - 1))),
+            positions % self._buffer_size,
+        ]
+        return np.where(positions >= 0, values, np.nan)
+
+    def _window_values(self, rows: np.ndarray, window: int) -> np.ndarray:
+        """The values of the rolling window for the next time step, shape (len(rows), window)"""
+        end = self._n_obs[rows] - self.rolling_n_shift
+        positions = end[:, None] - np.arange(window - 1, -1, -1)[None, :]
+        return self._buffer_at(rows, positions)
+
+    def update(self, df: pd.DataFrame):
+        """Appends new observations to the state
+
+        Args:
+            df (pd.DataFrame): The new observations with the `column` and `ts_id` columns. If there
+                are multiple observations for a time series, they should be in time order.
+
+        Returns:
+            OnlineFeatureState: The updated state
+        """
+        assert self._fitted, "`fit` should be called with the history before `update`"
+        ts_ids = self._get_ts_ids(df)
+        rows = self._index.get_indexer(ts_ids)
+        if np.any(rows < 0):
+            raise ValueError(
+                f"These time series were not present in the history: {ts_ids[rows < 0].unique().tolist()}"
+            )
+        values = df[self.column].to_numpy(dtype=np.float64, na_value=np.nan)
+        # Multiple observations of the same series are applied one step at a time
+        step = pd.Series(rows).groupby(rows).cumcount().values
+        for s in range(step.max() + 1 if len(step) > 0 else 0):
+            mask = step == s
+            self._push(rows[mask], values[mask])
+        return self
+
+    def _push(self, rows: np.ndarray, values: np.ndarray):
+        B = self._buffer_size
+        self._buffer[rows, self._n_obs[rows] % B] = values
+        self._n_obs[rows] += 1
+        n_obs = self._n_obs[rows]
+        if len(self._alphas) > 0:
+            cur = self._buffer_at(rows, n_obs - self.ewma_n_shift)[:, None]
+            weighted = self._ewma_weighted[rows]
+            old_wt = self._ewma_old_wt[rows]
+            is_observation = ~np.isnan(cur)
+            started = ~np.isnan(weighted)
+            old_wt = np.where(started, old_wt * (1.0 - self._alphas), old_wt)
+            weighted = np.where(
+                started & is_observation & (weighted != cur),
+                (old_wt * weighted + self._alphas * cur) / (old_wt + self._alphas),
+                weighted,
+            )
+            old_wt = np.where(started & is_observation, 1.0, old_wt)
+            weighted = np.where(~started & is_observation, cur, weighted)
+            self._ewma_weighted[rows] = weighted
+            self._ewma_old_wt[rows] = old_wt
+
+    def transform(self, ts_ids: Optional[List] = None) -> pd.DataFrame:
+        """Returns the features for the time step after the last observation
+
+        Args:
+            ts_ids (List, optional): The time series for which the features are needed.
+                If None, returns the features for all the time series. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The features indexed by the ts_id
+        """
+        assert (
+            self._fitted
+        ), "`fit` should be called with the history before `transform`"
+        if ts_ids is None:
+            rows = np.arange(len(self._index))
+        else:
+            rows = self._index.get_indexer(ts_ids)
+            if np.any(rows < 0):
+                raise ValueError("Some of the `ts_ids` were not present in the history")
+        features = np.empty(
+            (len(self.feature_names), len(rows)),
+            dtype=np.float32 if self.use_32_bit else np.float64,
+        )
+        n_obs = self._n_obs[rows]
+        i = 0
+        for l in self.lags:
+            features[i] = self._buffer_at(rows, n_obs - l)
+            i += 1
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for l in self.rolls:
+                window = self._window_values(rows, l)
+                # Like pandas, a window only produces a value if all of its observations are present.
+                # Positions before the start of the series are NaN as well
+                valid = ~np.isnan(window).any(axis=1)
+                for agg in self.agg_funcs:
+                    if agg == "mean":
+                        feat = window.mean(axis=1)
+                    elif agg == "std":
+                        feat = (
+                            window.std(axis=1, ddof=1)
+                            if l > 1
+                            else np.full(len(rows), np.nan)
+                        )
+                    elif agg == "min":
+                        feat = window.min(axis=1, initial=np.inf)
+                    else:
+                        feat = window.max(axis=1, initial=-np.inf)
+                    features[i] = np.where(valid, feat, np.nan)
+                    i += 1
+        for j in range(len(self._alphas)):
+            features[i] = self._ewma_weighted[rows, j]
+            i += 1
+        return pd.DataFrame(
+            features.T,
+            index=self._index[rows].rename(self.ts_id),
+            columns=self.feature_names,
+        )
@@ -0,0 +1,190 @@
+"""Out-of-core execution of a `FeaturePipeline` over a panel stored on disk
+
+All the autoregressive features are computed within a time series and the temporal features
+within a row, so a partition made of whole time series carries the full lookback every feature
+needs. The panel is streamed from a parquet or feather file in partitions of whole time series,
+sized so that a partition along with its features fits in the memory budget, and every
+partition is written back to disk before the next one is read. pyarrow is only needed, and
+imported, when the pipeline is run out of core.
+"""
+
+import warnings
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple, Union
+
+import humanize
+import numpy as np
+import pandas as pd
+from tqdm.autonotebook import tqdm
+
+from src.feature_engineering.pipeline import FeaturePipeline
+
+if TYPE_CHECKING:
+    import pyarrow.dataset as ds
+
+ALLOWED_FORMATS = ["parquet", "feather"]
+
+
+def _infer_format(path: Union[str, Path]) -> str:
+    suffix = Path(path).suffix.lstrip(".")
+    file_format = {"pq": "parquet", "ftr": "feather", "arrow": "feather"}.get(
+        suffix, suffix
+    )
+    assert (
+        file_format in ALLOWED_FORMATS
+    ), f"Could not infer the format from `{path}`. `file_format` should be one of {ALLOWED_FORMATS}"
+    return file_format
+
+
+def _read_partition(
+    dataset: "ds.Dataset", ts_id: str, ids: np.ndarray, columns: List[str]
+) -> pd.DataFrame:
+    """Reads the rows of the time series in `ids`, in the order they are stored in the file"""
+    import pyarrow.compute as pc
+
+    table = dataset.to_table(
+        columns=columns, filter=pc.field(ts_id).isin(np.asarray(ids))
+    )
+    return table.to_pandas()
+
+
+def _get_partitions(
+    n_rows_per_series: np.ndarray, max_rows: int
+) -> List[np.ndarray]:
+    """Greedily packs consecutive time series into partitions of at most `max_rows` rows.
+    A time series longer than `max_rows` gets a partition of its own"""
+    partitions, current, current_rows = [], [], 0
+    for i, n_rows in enumerate(n_rows_per_series):
+        if len(current) > 0 and current_rows + n_rows > max_rows:
+            partitions.append(np.asarray(current))
+            current, current_rows = [], 0
+        current.append(i)
+        current_rows += n_rows
+    if len(current) > 0:
+        partitions.append(np.asarray(current))
+    return partitions
+
+
+def run_out_of_core(
+    pipeline: FeaturePipeline,
+    input_path: Union[str, Path],
+    output_dir: Union[str, Path],
+    memory_budget: int,
+    file_format: str = None,
+    output_format: str = "parquet",
+    n_calibration_rows: int = 10000,
+) -> Tuple[List[Path], List]:
+    """Runs the feature pipeline on a panel which does not fit in memory, one partition of whole
+    time series at a time.
+
+    Only the ts_id column is read in full. The memory needed per row is calibrated by running the
+    pipeline on the first few time series and measuring the input size and the peak memory of the
+    run, and the time series are then packed into partitions which fit in `memory_budget`. Every
+    partition is read with a filter on the ts_id, so that only the row groups which contain it are
+    decoded, and is written to `output_dir` as `part-{i}.{output_format}`.
+
+    The features are identical to running the pipeline on the whole dataframe in memory. The index
+    of every partition is the position of the row in the input file, so concatenating the
+    partitions and sorting by the index recovers the in-memory result. Feather does not store an
+    index, so for feather output it is written as an `index` column.
+
+    Args:
+        pipeline (FeaturePipeline): The pipeline with the features to be created. `ts_id` should be set
+        input_path (Union[str, Path]): Path to the parquet or feather file (or a directory of files) with the panel
+        output_dir (Union[str, Path]): Directory to which the partitions with the features are written
+        memory_budget (int): The memory budget in bytes for a partition along with its features. The
+            ts_id column and the partition bookkeeping, which are held for the whole run, are on top of this.
+        file_format (str, optional): Format of the input. One of "parquet" or "feather". If None, inferred
+            from the extension of `input_path`. Defaults to None.
+        output_format (str, optional): Format of the output partitions. One of "parquet" or "feather".
+            Defaults to "parquet".
+        n_calibration_rows (int, optional): Minimum number of rows used to calibrate the memory needed
+            per row. Defaults to 10000.
+
+    Returns:
+        Tuple[List[Path], List]: Returns a tuple of the paths of the written partitions and a list of
+            features which were added
+    """
+    import pyarrow.dataset as ds
+
+    assert (
+        pipeline.ts_id is not None
+    ), "`ts_id` of the pipeline should be set to partition the data by time series"
+    if file_format is None:
+        file_format = _infer_format(input_path)
+    assert (
+        file_format in ALLOWED_FORMATS and output_format in ALLOWED_FORMATS
+    ), f"`file_format` and `output_format` should be one of {ALLOWED_FORMATS}"
+    ts_id = pipeline.ts_id
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    dataset = ds.dataset(input_path, format=file_format)
+    # The index stored by pandas is replaced by the row positions
+    columns = [c for c in dataset.schema.names if not c.startswith("__index_level_")]
+    assert ts_id in columns, "`ts_id` should be a valid column in the provided dataset"
+
+    id_column = dataset.to_table(columns=[ts_id]).column(ts_id).to_pandas()
+    codes, uniques = pd.factorize(id_column, sort=False)
+    del id_column
+    assert not (codes < 0).any(), "`ts_id` should not have missing values"
+    n_rows_per_series = np.bincount(codes, minlength=len(uniques))
+    # Row positions of every time series, in the order of first appearance
+    row_positions = np.argsort(codes, kind="stable")
+    series_offsets = np.concatenate([[0], np.cumsum(n_rows_per_series)])
+    del codes
+
+    # Calibrating the bytes needed per row on the first time series
+    n_calibration_series = (
+        np.searchsorted(series_offsets[1:], min(n_calibration_rows, len(row_positions)))
+        + 1
+    )
+    calibration_df = _read_partition(
+        dataset, ts_id, uniques[:n_calibration_series], columns
+    )
+    verbose, pipeline.verbose = pipeline.verbose, False
+    try:
+        pipeline.run(calibration_df)
+        bytes_per_row = (
+            calibration_df.memory_usage(deep=True).sum() + pipeline.peak_memory
+        ) / len(calibration_df)
+        del calibration_df
+        max_rows = max(int(memory_budget // bytes_per_row), 1)
+        partitions = _get_partitions(n_rows_per_series, max_rows)
+        if n_rows_per_series.max() > max_rows:
+            warnings.warn(
+                f"Some time series have more than {max_rows} rows, which is the most that fits in the memory budget. They are processed one at a time and may exceed the budget."
+            )
+        if verbose:
+            print(
+                f"Estimated {humanize.naturalsize(bytes_per_row)} per row. Processing {len(row_positions)} rows in {len(partitions)} partitions of at most {max_rows} rows"
+            )
+        paths, added_features, peak_memory = [], [], 0
+        for i, partition in enumerate(tqdm(partitions, disable=not verbose)):
+            df = _read_partition(dataset, ts_id, uniques[partition], columns)
+            positions = np.sort(
+                np.concatenate(
+                    [
+                        row_positions[series_offsets[s] : series_offsets[s + 1]]
+                        for s in partition
+                    ]
+                )
+            )
+            assert len(positions) == len(
+                df
+            ), "Number of rows read does not match the number of rows of the time series in the partition"
+            df.index = pd.Index(positions)
+            df, added_features = pipeline.run(df)
+            peak_memory = max(peak_memory, pipeline.peak_memory)
+            path = output_dir / f"part-{i:05d}.{output_format}"
+            if output_format == "parquet":
+                df.to_parquet(path)
+            else:
+                df.reset_index().to_feather(path)
+            paths.append(path)
+            del df
+    finally:
+        pipeline.verbose = verbose
+    pipeline.peak_memory = peak_memory
+    if verbose:
+        print(f"Peak Memory Used by a partition: {humanize.naturalsize(peak_memory)}")
+    return paths, added_features
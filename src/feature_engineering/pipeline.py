@@ -0,0 +1,564 @@
+import tracemalloc
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import humanize
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_list_like, is_numeric_dtype, is_object_dtype
+
+from src.feature_engineering._kernels import (
+    ROLLING_AGG_CODES,
+    _attach_blocks,
+    _ewma_kernel,
+    _get_ewma_alphas,
+    _get_group_offsets,
+    _get_sorted_values,
+    _lag_kernel,
+    _restore_order,
+    _rolling_kernel,
+    _seasonal_rolling_kernel,
+)
+from src.feature_engineering._parallel import _run_kernels
+from src.feature_engineering.memory_planner import (
+    MemoryPlan,
+    get_memory_report,
+    print_memory_report,
+)
+from src.feature_engineering.autoregressive_features import (
+    ALLOWED_AGG_FUNCS,
+    SEASONAL_ROLLING_MAP,
+)
+from src.feature_engineering.temporal_features import (
+    CalendarFeatureCache,
+    FourierEncoder,
+    add_temporal_features,
+)
+
+
+class FeaturePipeline:
+    def __init__(
+        self,
+        ts_id: str = None,
+        use_32_bit: bool = False,
+        verbose: bool = True,
+        n_jobs: int = 1,
+        memory_plan: Optional[MemoryPlan] = None,
+    ) -> None:
+        """Declarative specification of the features to be created, executed as a single plan.
+
+        The features are collected with the `add_*` methods, which take the same arguments as the
+        functions in `autoregressive_features` and `temporal_features`. `run` then sorts the
+        dataframe by ts_id once, shares the sorted series between all the features of the same
+        column, merges requests that can be computed in the same pass (for eg. all the lags of a
+        column), and writes all the numeric features into a single preallocated block per dtype,
+        which is attached to the dataframe at the end.
+
+        Args:
+            ts_id (str, optional): Unique ID of a time series. If None assumes dataframe only has
+                a single timeseries. Defaults to None.
+            use_32_bit (bool, optional): Flag to use float32 or int32 to reduce memory. Defaults to False.
+            verbose (bool, optional): Flag to print the peak memory used by `run`. See `run` for what it covers.
+                Defaults to True.
+            n_jobs (int, optional): Number of processes across which the time series are sharded for the
+                autoregressive features. -1 uses all the cores. Defaults to 1.
+            memory_plan (MemoryPlan, optional): The dtype of every feature family, which the features are
+                allocated in. It takes precedence over `use_32_bit` and a per feature memory report is kept
+                in `memory_report` (and printed if verbose). If None, all the features use the dtype from
+                `use_32_bit`. Defaults to None.
+        """
+        self.ts_id = ts_id
+        self.use_32_bit = use_32_bit
+        self.verbose = verbose
+        self.n_jobs = n_jobs
+        self.memory_plan = memory_plan
+        self._steps = []
+        self.peak_memory = None
+        self.memory_report = None
+        self._is_warmed_up = False
+        # Calendar features of the unique timestamps are reused across runs, for eg. train and test
+        self.calendar_cache = CalendarFeatureCache()
+
+    def add_lags(self, column: str, lags: List[int]):
+        """Adds lags of the column. See `autoregressive_features.add_lags`"""
+        assert is_list_like(lags), "`lags` should be a list of all required lags"
+        self._steps.append(("lags", column, {"lags": list(lags)}))
+        return self
+
+    def add_rolling_features(
+        self,
+        column: str,
+        rolls: List[int],
+        agg_funcs: List[str] = ["mean", "std"],
+        n_shift: int = 1,
+    ):
+        """Adds rolling statistics of the column. See `autoregressive_features.add_rolling_features`"""
+        assert is_list_like(
+            rolls
+        ), "`rolls` should be a list of all required rolling windows"
+        assert (
+            len(set(agg_funcs) - set(ALLOWED_AGG_FUNCS)) == 0
+        ), f"`agg_funcs` should be one of {ALLOWED_AGG_FUNCS}"
+        self._steps.append(
+            (
+                "rolling",
+                column,
+                {
+                    "rolls": list(rolls),
+                    "agg_funcs": list(dict.fromkeys(agg_funcs)),
+                    "n_shift": n_shift,
+                },
+            )
+        )
+        return self
+
+    def add_seasonal_rolling_features(
+        self,
+        column: str,
+        seasonal_periods: List[int],
+        rolls: List[int],
+        agg_funcs: List[str] = ["mean", "std"],
+        n_shift: int = 1,
+    ):
+        """Adds seasonal rolling statistics of the column. See `autoregressive_features.add_seasonal_rolling_features`"""
+        assert is_list_like(
+            rolls
+        ), "`rolls` should be a list of all required rolling windows"
+        assert isinstance(
+            seasonal_periods, list
+        ), "`seasonal_periods` should be a list of all required seasonal cycles over which rolling statistics to be created"
+        assert (
+            len(set(agg_funcs) - set(ALLOWED_AGG_FUNCS)) == 0
+        ), f"`agg_funcs` should be one of {ALLOWED_AGG_FUNCS}"
+        self._steps.append(
+            (
+                "seasonal_rolling",
+                column,
+                {
+                    "seasonal_periods": seasonal_periods,
+                    "rolls": list(rolls),
+                    "agg_funcs": list(dict.fromkeys(agg_funcs)),
+                    "n_shift": n_shift,
+                },
+            )
+        )
+        return self
+
+    def add_ewma(
+        self,
+        column: str,
+        alphas: List[float] = [0.5],
+        spans: List[float] = None,
+        n_shift: int = 1,
+    ):
+        """Adds exponentially weighted averages of the column. See `autoregressive_features.add_ewma`"""
+        if spans is None and alphas is None:
+            raise ValueError(
+                "Either `alpha` or `spans` should be provided for the function to"
+            )
+        use_spans = spans is not None
+        params = spans if use_spans else alphas
+        assert isinstance(
+            params, list
+        ), "`spans` or `alphas` should be a list of all required parameters"
+        self._steps.append(
+            (
+                "ewma",
+                column,
+                {"params": params, "use_spans": use_spans, "n_shift": n_shift},
+            )
+        )
+        return self
+
+    def add_temporal_features(
+        self,
+        field_name: str,
+        frequency: str,
+        add_elapsed: bool = True,
+        prefix: str = None,
+        drop: bool = True,
+    ):
+        """Adds temporal features of the date column. See `temporal_features.add_temporal_features`"""
+        self._steps.append(
+            (
+                "temporal",
+                field_name,
+                {
+                    "frequency": frequency,
+                    "add_elapsed": add_elapsed,
+                    "prefix": prefix,
+                    "drop": drop,
+                },
+            )
+        )
+        return self
+
+    def add_fourier_features(
+        self,
+        columns_to_encode: List[str],
+        max_values: List[int],
+        n_fourier_terms: int = 1,
+    ):
+        """Adds fourier terms of the seasonal cycle columns. See `temporal_features.bulk_add_fourier_features`"""
+        assert len(columns_to_encode) == len(
+            max_values
+        ), "`columns_to_encode` and `max_values` should be of same length."
+        for column, max_value in zip(columns_to_encode, max_values):
+            assert max_value is not None, "`max_values` should be provided"
+            self._steps.append(
+                (
+                    "fourier",
+                    column,
+                    {"max_value": max_value, "n_fourier_terms": n_fourier_terms},
+                )
+            )
+        return self
+
+    def _compile(self) -> List[Tuple[str, str, Dict, List[str]]]:
+        """Merges the steps that share an intermediate and drops duplicate features.
+
+        Returns:
+            List[Tuple[str, str, Dict, List[str]]]: The plan as a list of (kind, column, params, feature names)
+        """
+        plan, merged, planned_features = [], {}, set()
+
+        def _new_features(features):
+            new = [f for f in features if f not in planned_features]
+            planned_features.update(new)
+            return new
+
+        for kind, column, params in self._steps:
+            if kind == "lags":
+                # All lags of a column are filled in the same pass
+                key = (kind, column)
+                lags = [
+                    l for l in params["lags"] if _new_features([f"{column}_lag_{l}"])
+                ]
+                if key in merged:
+                    merged[key]["lags"] += lags
+                    continue
+                params = {"lags": lags}
+            elif kind == "rolling":
+                # Windows with the same shift and aggregations share a single kernel call
+                key = (kind, column, params["n_shift"], tuple(params["agg_funcs"]))
+                rolls = [
+                    l
+                    for l in params["rolls"]
+                    if _new_features(
+                        [f"{column}_rolling_{l}_{agg}" for agg in params["agg_funcs"]]
+                    )
+                ]
+                if key in merged:
+                    merged[key]["rolls"] += rolls
+                    continue
+                params = {**params, "rolls": rolls}
+            elif kind == "seasonal_rolling":
+                # A step per seasonal period, so that its windows are merged like the rolling windows
+                for sp in params["seasonal_periods"]:
+                    key = (
+                        kind,
+                        column,
+                        params["n_shift"],
+                        tuple(params["agg_funcs"]),
+                        sp,
+                    )
+                    rolls = [
+                        l
+                        for l in params["rolls"]
+                        if _new_features(
+                            [
+                                f"{column}_{sp}_seasonal_rolling_{l}_{agg}"
+                                for agg in params["agg_funcs"]
+                            ]
+                        )
+                    ]
+                    if key in merged:
+                        merged[key]["rolls"] += rolls
+                        continue
+                    merged[key] = {**params, "seasonal_periods": [sp], "rolls": rolls}
+                    plan.append((kind, column, merged[key]))
+                continue
+            elif kind == "ewma":
+                key = (kind, column, params["n_shift"], params["use_spans"])
+                name = "span" if params["use_spans"] else "alpha"
+                ewma_params = [
+                    p
+                    for p in params["params"]
+                    if _new_features([f"{column}_ewma_{name}_{p}"])
+                ]
+                if key in merged:
+                    merged[key]["params"] += ewma_params
+                    continue
+                params = {**params, "params": ewma_params}
+            elif kind == "fourier":
+                # The terms of a column are encoded once, with the `max_value` it was first added with
+                key = (kind, column)
+                if key in merged:
+                    merged[key]["n_fourier_terms"] = max(
+                        merged[key]["n_fourier_terms"], params["n_fourier_terms"]
+                    )
+                    continue
+                params = {**params}
+            else:
+                key = None
+            if key is not None:
+                merged[key] = params
+            plan.append((kind, column, params))
+        plan = [
+            (kind, column, params, self._feature_names(kind, column, params))
+            for kind, column, params in plan
+        ]
+        # Steps left with only duplicate features are dropped
+        return [step for step in plan if step[0] == "temporal" or len(step[3]) > 0]
+
+    def _get_dtype(self, kind: str) -> np.dtype:
+        if self.memory_plan is not None:
+            return self.memory_plan.get_dtype(kind)
+        return np.dtype(np.float32 if self.use_32_bit else np.float64)
+
+    def _feature_names(self, kind: str, column: str, params: Dict) -> List[str]:
+        if kind == "lags":
+            return [f"{column}_lag_{l}" for l in params["lags"]]
+        elif kind == "rolling":
+            return [
+                f"{column}_rolling_{l}_{agg}"
+                for l in params["rolls"]
+                for agg in params["agg_funcs"]
+            ]
+        elif kind == "seasonal_rolling":
+            return [
+                f"{column}_{sp}_seasonal_rolling_{l}_{name}"
+                for sp in params["seasonal_periods"]
+                for name in params["agg_funcs"]
+                for l in params["rolls"]
+            ]
+        elif kind == "ewma":
+            name = "span" if params["use_spans"] else "alpha"
+            return [f"{column}_ewma_{name}_{p}" for p in params["params"]]
+        elif kind == "fourier":
+            n = params["n_fourier_terms"]
+            return [f"{column}_sin_{i}" for i in range(1, n + 1)] + [
+                f"{column}_cos_{i}" for i in range(1, n + 1)
+            ]
+        # Temporal feature names depend on the data and are known only after running
+        return []
+
+    def run(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, List]:
+        """Executes the plan on the dataframe
+
+        The peak memory of the run is kept in `peak_memory`. It is the peak of the allocations of this process
+        traced by tracemalloc (which include the NumPy arrays) plus, when n_jobs > 1, the shared memory segments
+        the workers read from and write into. Since the two peaks need not be at the same time, it is an upper
+        bound. The memory of the worker processes themselves (the interpreter and the scratch buffers of the
+        kernels, of the size of the longest time series) is not covered. On the first run the plan is run once
+        on the first row before measuring, so that the compilation of the kernels is not counted either.
+
+        Args:
+            df (pd.DataFrame): The dataframe in which features needed to be created
+
+        Returns:
+            Tuple[pd.DataFrame, List]: Returns a tuple of the new dataframe and a list of features which were added
+        """
+        if not self._is_warmed_up:
+            self._warm_up(df)
+        is_tracing = tracemalloc.is_tracing()
+        if not is_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        start_memory, _ = tracemalloc.get_traced_memory()
+        try:
+            df, added_features, shared_memory = self._run(df)
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            if not is_tracing:
+                tracemalloc.stop()
+        self.peak_memory = peak - start_memory + shared_memory
+        if self.verbose:
+            print(f"Peak Memory Used: {humanize.naturalsize(self.peak_memory)}")
+        return df, added_features
+
+    def _warm_up(self, df: pd.DataFrame) -> None:
+        """Runs the plan on the first row, which compiles the kernels for the dtypes of the dataframe"""
+        if len(df) == 0:
+            return
+        verbose, memory_report = self.verbose, self.memory_report
+        self.verbose = False
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self._run(df.iloc[:1])
+        finally:
+            self.verbose, self.memory_report = verbose, memory_report
+        self._is_warmed_up = True
+
+    def _run(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, List, int]:
+        plan = self._compile()
+        if self.ts_id is None:
+            # The temporal and fourier features are computed within a row and do not need the ts_id
+            if any(kind not in ["temporal", "fourier"] for kind, *_ in plan):
+                warnings.warn(
+                    "Assuming just one unique time series in dataset. If there are multiple, provide `ts_id` argument"
+                )
+        else:
+            assert (
+                self.ts_id in df.columns
+            ), "`ts_id` should be a valid column in the provided dataframe"
+        # The new columns are added to a shallow copy so that the input dataframe is not modified
+        df = df.copy(deep=False)
+        added_features = []
+        # Temporal features run first since the fourier features may encode them
+        for kind, column, params, _ in plan:
+            if kind == "temporal":
+                df, features = add_temporal_features(
+                    df,
+                    column,
+                    use_32_bit=self.use_32_bit,
+                    calendar_cache=self.calendar_cache,
+                    narrow_dtypes=self.memory_plan is not None
+                    and self.memory_plan.narrow_calendar,
+                    **params,
+                )
+                added_features += features
+        block_plan = [step for step in plan if step[0] != "temporal"]
+        for kind, column, _, _ in block_plan:
+            assert (
+                column in df.columns
+            ), f"`{column}` should be a valid column in the provided dataframe"
+        block_features = [f for *_, features in block_plan for f in features]
+        if (
+            self.memory_plan is not None
+            and self.memory_plan.categorical_ids
+            and self.ts_id is not None
+            and is_object_dtype(df[self.ts_id])
+        ):
+            df[self.ts_id] = df[self.ts_id].astype("category")
+        # Single sort and a single allocation of the output block per dtype
+        sort_order, offsets, null_mask = _get_group_offsets(df, self.ts_id)
+        step_dtypes = [self._get_dtype(kind) for kind, *_ in block_plan]
+        blocks = {}
+        for dtype in dict.fromkeys(step_dtypes):
+            n_features = sum(
+                len(features)
+                for (*_, features), step_dtype in zip(block_plan, step_dtypes)
+                if step_dtype == dtype
+            )
+            blocks[dtype] = np.empty((n_features, len(df)), dtype=dtype)
+        sorted_values = {}
+        # The kernels are collected and run together, in a single pool of processes if n_jobs > 1
+        tasks = {dtype: [] for dtype in blocks}
+        rows = {dtype: 0 for dtype in blocks}
+        step_rows = []
+        for (kind, column, params, features), dtype in zip(block_plan, step_dtypes):
+            block, row = blocks[dtype], rows[dtype]
+            step_rows.append(row)
+            if column not in sorted_values:
+                sorted_values[column] = _get_sorted_values(df, column, sort_order)
+            values = sorted_values[column]
+            if kind == "lags":
+                tasks[dtype].append(
+                    (
+                        _lag_kernel,
+                        values,
+                        (np.asarray(params["lags"], dtype=np.int64),),
+                        row,
+                        row + len(features),
+                    )
+                )
+            elif kind == "rolling":
+                tasks[dtype].append(
+                    (
+                        _rolling_kernel,
+                        values,
+                        (
+                            params["n_shift"],
+                            np.asarray(params["rolls"], dtype=np.int64),
+                            np.asarray(
+                                [ROLLING_AGG_CODES[agg] for agg in params["agg_funcs"]],
+                                dtype=np.int64,
+                            ),
+                        ),
+                        row,
+                        row + len(features),
+                    )
+                )
+            elif kind == "seasonal_rolling":
+                windows = np.asarray(params["rolls"], dtype=np.int64)
+                i = row
+                for sp in params["seasonal_periods"]:
+                    for agg in params["agg_funcs"]:
+                        tasks[dtype].append(
+                            (
+                                _seasonal_rolling_kernel,
+                                values,
+                                (
+                                    params["n_shift"],
+                                    sp,
+                                    windows,
+                                    SEASONAL_ROLLING_MAP[agg],
+                                ),
+                                i,
+                                i + len(windows),
+                            )
+                        )
+                        i += len(windows)
+            elif kind == "ewma":
+                tasks[dtype].append(
+                    (
+                        _ewma_kernel,
+                        values,
+                        (
+                            params["n_shift"],
+                            _get_ewma_alphas(params["params"], params["use_spans"]),
+                        ),
+                        row,
+                        row + len(features),
+                    )
+                )
+            elif kind == "fourier":
+                assert is_numeric_dtype(
+                    df[column]
+                ), "`column_to_encode` should have numeric values."
+                if not np.isfinite(values).all():
+                    # Cast to int, NaN would become INT_MIN and be encoded as a valid cycle
+                    raise ValueError(
+                        f"`{column}` has missing or infinite values, which cannot be encoded as fourier terms"
+                    )
+                # Gathered from the lookup table straight into the block
+                FourierEncoder(
+                    params["max_value"],
+                    params["n_fourier_terms"],
+                    dtype=block.dtype,
+                ).transform(values.astype(int), out=block[row : row + len(features)].T)
+            rows[dtype] += len(features)
+        shared_memory = 0
+        for dtype, block in blocks.items():
+            shared_memory = max(
+                shared_memory, _run_kernels(tasks[dtype], offsets, block, self.n_jobs)
+            )
+            blocks[dtype] = _restore_order(block, sort_order)
+        del sorted_values
+        if null_mask is not None:
+            # Only the features computed per time series are undefined for a missing ts_id
+            for (kind, _, _, features), dtype, row in zip(
+                block_plan, step_dtypes, step_rows
+            ):
+                if kind != "fourier":
+                    blocks[dtype][row : row + len(features), null_mask] = np.nan
+        df = _attach_blocks(
+            df,
+            [
+                (blocks[dtype][row : row + len(features)], features)
+                for (*_, features), dtype, row in zip(block_plan, step_dtypes, step_rows)
+            ],
+        )
+        if self.memory_plan is not None:
+            families = {
+                f: kind for kind, _, _, features in block_plan for f in features
+            }
+            families.update({f: "temporal" for f in added_features})
+            self.memory_report = get_memory_report(
+                df, added_features + block_features, families
+            )
+            if self.verbose:
+                print_memory_report(self.memory_report)
+        return df, added_features + block_features, shared_memory
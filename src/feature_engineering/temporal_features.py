@@ -4,10 +4,12 @@ from typing import List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-from pandas.api.types import is_numeric_dtype
+from pandas.api.types import is_bool_dtype, is_integer_dtype, is_numeric_dtype
 from pandas.tseries import offsets
 from pandas.tseries.frequencies import to_offset
 
+from src.utils.data_utils import _get_narrowest_int_dtype
+
 
 # adapted from gluonts
 def time_features_from_frequency_str(freq_str: str) -> List[str]:
@@ -140,6 +142,182 @@ def make_date(df: pd.DataFrame, date_field: str):
     return df
 
 
+class FourierEncoder:
+    def __init__(
+        self, max_cycle: int, n_fourier_terms: int = 1, dtype: str = "float64"
+    ) -> None:
+        """Encodes a seasonal cycle like hour, dayofweek, month, etc. into fourier terms.
+
+        Since the seasonal cycle is a small integer, the fourier terms of every value of the
+        cycle are calculated once into a (max_cycle x 2*n_fourier_terms) lookup table and the
+        rows are gathered by the cycle value. Non integer or negative cycles fall back to
+        calculating the terms directly.
+
+        Args:
+            max_cycle (int): The maximum value the seasonal cycle can attain. for eg. for month, max_cycle is 12.
+            n_fourier_terms (int, optional): Number of fourier terms. Defaults to 1.
+            dtype (str, optional): The dtype of the fourier terms. Defaults to "float64".
+        """
+        self.max_cycle = max_cycle
+        self.n_fourier_terms = n_fourier_terms
+        self.dtype = np.dtype(dtype)
+        self._table = self._calculate_terms(np.arange(int(max_cycle) + 1))
+
+    def _calculate_terms(self, seasonal_cycle: np.ndarray) -> np.ndarray:
+        """Calculates Fourier Terms given the seasonal cycle and max_cycle"""
+        terms = np.empty(
+            (len(seasonal_cycle), 2 * self.n_fourier_terms), dtype="float64"
+        )
+        for i in range(1, self.n_fourier_terms + 1):
+            terms[:, i - 1] = np.sin((2 * np.pi * seasonal_cycle * i) / self.max_cycle)
+            terms[:, self.n_fourier_terms + i - 1] = np.cos(
+                (2 * np.pi * seasonal_cycle * i) / self.max_cycle
+            )
+        return terms.astype(self.dtype, copy=False)
+
+    def transform(
+        self, seasonal_cycle: np.ndarray, out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Returns the fourier terms (sin terms followed by cos terms) for the seasonal cycle
+
+        Args:
+            seasonal_cycle (np.ndarray): The seasonal cycle values
+            out (np.ndarray, optional): Array of shape (len(seasonal_cycle), 2*n_fourier_terms) to write
+                the terms into. Defaults to None.
+
+        Returns:
+            np.ndarray: The fourier terms of shape (len(seasonal_cycle), 2*n_fourier_terms)
+        """
+        seasonal_cycle = np.asarray(seasonal_cycle)
+        if out is None:
+            out = np.empty(
+                (len(seasonal_cycle), 2 * self.n_fourier_terms), dtype=self.dtype
+            )
+        if len(seasonal_cycle) == 0:
+            return out
+        if not np.issubdtype(seasonal_cycle.dtype, np.integer) or seasonal_cycle.min() < 0:
+            out[:] = self._calculate_terms(seasonal_cycle)
+            return out
+        max_value = seasonal_cycle.max()
+        if max_value >= len(self._table):
+            # Values beyond max_cycle are rare, extending the table once is cheaper than a fallback
+            self._table = np.vstack(
+                [
+                    self._table,
+                    self._calculate_terms(np.arange(len(self._table), max_value + 1)),
+                ]
+            )
+        # Indices are validated above, so the gather can write straight into `out`
+        return np.take(self._table, seasonal_cycle, axis=0, out=out, mode="clip")
+
+
+class CalendarFeatureCache:
+    def __init__(self) -> None:
+        """Cache of calendar features computed on unique timestamps.
+
+        In a long format dataframe, the same timestamp is repeated for every time series. Passing
+        an instance of this to `add_temporal_features` computes the calendar features only once
+        per unique timestamp and broadcasts them to the rows with an integer take. The same
+        instance can be reused across train, validation and test, where only the timestamps not
+        seen before are computed, and across `add_fourier_features` and `bulk_add_fourier_features`,
+        where the lookup tables of the fourier terms are cached.
+        """
+        self._calendar_tables = {}
+        self._fourier_encoders = {}
+
+    def get_calendar_features(
+        self, timestamps: pd.Index, attr: List[str]
+    ) -> pd.DataFrame:
+        """Returns the calendar features for the unique timestamps, computing only the ones not in the cache
+
+        Args:
+            timestamps (pd.Index): Unique timestamps
+            attr (List[str]): The calendar attributes, like Month, Hour, etc.
+
+        Returns:
+            pd.DataFrame: The calendar features with one row per timestamp in the same order
+        """
+        key = tuple(attr)
+        table = self._calendar_tables.get(key)
+        if table is None:
+            table = _calculate_calendar_features(timestamps, attr)
+        else:
+            new_timestamps = timestamps[table.index.get_indexer(timestamps) < 0]
+            if len(new_timestamps) > 0:
+                table = pd.concat(
+                    [table, _calculate_calendar_features(new_timestamps, attr)]
+                )
+        self._calendar_tables[key] = table
+        return table.take(table.index.get_indexer(timestamps))
+
+    def get_fourier_terms(
+        self,
+        seasonal_cycle: np.ndarray,
+        max_cycle: int,
+        n_fourier_terms: int,
+        dtype: str = "float64",
+    ) -> np.ndarray:
+        """Returns the fourier terms for the seasonal cycle using a cached lookup table
+
+        Args:
+            seasonal_cycle (np.ndarray): The seasonal cycle values of each row
+            max_cycle (int): The maximum value the seasonal cycle can attain
+            n_fourier_terms (int): Number of fourier terms
+            dtype (str, optional): The dtype of the fourier terms. Defaults to "float64".
+
+        Returns:
+            np.ndarray: The fourier terms of shape (len(seasonal_cycle), 2*n_fourier_terms)
+        """
+        key = (max_cycle, n_fourier_terms, np.dtype(dtype).name)
+        if key not in self._fourier_encoders:
+            self._fourier_encoders[key] = FourierEncoder(
+                max_cycle, n_fourier_terms, dtype=dtype
+            )
+        return self._fourier_encoders[key].transform(seasonal_cycle)
+
+
+def _calculate_calendar_features(timestamps: pd.Index, attr: List[str]) -> pd.DataFrame:
+    """Calculates the calendar attributes for the timestamps, indexed by the timestamps"""
+    field = pd.Series(timestamps)
+    features = {n: getattr(field.dt, n.lower()) for n in attr if n != "Week"}
+    # Pandas removed `dt.week` in v1.1.10
+    if "Week" in attr:
+        features["Week"] = (
+            field.dt.isocalendar().week
+            if hasattr(field.dt, "isocalendar")
+            else field.dt.week
+        )
+    return pd.DataFrame(features).set_axis(timestamps, axis=0)
+
+
+# Range of the calendar features, so that the narrowed dtype does not depend on the timestamps in the data
+CALENDAR_FEATURE_RANGES = {
+    "Month": (1, 12),
+    "Quarter": (1, 4),
+    "Week": (1, 53),
+    "Day": (1, 31),
+    "Dayofweek": (0, 6),
+    "Dayofyear": (1, 366),
+    "Hour": (0, 23),
+    "Minute": (0, 59),
+}
+
+
+def _narrow_int_column(column: pd.Series) -> pd.Series:
+    """Casts an integer column without missing values to the smallest integer dtype which holds its range"""
+    if (
+        is_integer_dtype(column)
+        and not is_bool_dtype(column)
+        and len(column) > 0
+        and not column.hasnans
+    ):
+        min_value, max_value = CALENDAR_FEATURE_RANGES.get(
+            column.name, (column.min(), column.max())
+        )
+        return column.astype(_get_narrowest_int_dtype(min_value, max_value))
+    return column
+
+
 # adapted from fastai
 def add_temporal_features(
     df: pd.DataFrame,
@@ -149,6 +327,8 @@ def add_temporal_features(
     prefix: str = None,
     drop: bool = True,
     use_32_bit: bool = False,
+    calendar_cache: Optional[CalendarFeatureCache] = None,
+    narrow_dtypes: bool = False,
 ) -> Tuple[pd.DataFrame, List]:
     """Adds columns relevant to a date in the column `field_name` of `df`.
 
@@ -161,6 +341,11 @@ def add_temporal_features(
         prefix (str, optional): Prefix to the newly created columns. If left None, will use the field name. Defaults to None.
         drop (bool, optional): Flag to drop the data column after feature creation. Defaults to True.
         use_32_bit (bool, optional): Flag to use float32 or int32 to reduce memory. Defaults to False.
+        calendar_cache (CalendarFeatureCache, optional): Cache of calendar features by unique timestamps, which can
+            be shared between calls. If None, a new one is used for this call. Defaults to None.
+        narrow_dtypes (bool, optional): Flag to store every integer feature in the smallest integer dtype which holds
+            its range, for eg. int8 for Month and int16 for Dayofyear. The dtype is picked on the unique timestamps,
+            before the features are broadcasted to the rows. Takes precedence over `use_32_bit`. Defaults to False.
 
     Returns:
         Tuple[pd.DataFrame, List]: Returns a tuple of the new dataframe and a list of features which were added
@@ -170,31 +355,42 @@ def add_temporal_features(
     attr = time_features_from_frequency_str(frequency)
     _32_bit_dtype = "int32"
     added_features = []
+    if calendar_cache is None:
+        calendar_cache = CalendarFeatureCache()
+    # The calendar features are computed once per unique timestamp and broadcasted to the rows
+    codes, uniques = pd.factorize(field)
+    calendar_df = calendar_cache.get_calendar_features(uniques, attr)
+    if np.any(codes < 0):
+        # Missing timestamps get the same values as the pandas datetime accessor gives for NaT
+        nat_df = _calculate_calendar_features(uniques[:0].insert(0, pd.NaT), attr)
+        calendar_df = pd.concat([calendar_df, nat_df])
+        codes = np.where(codes < 0, len(calendar_df) - 1, codes)
+    if narrow_dtypes:
+        calendar_df = calendar_df.apply(_narrow_int_column)
+        use_32_bit = False
     for n in attr:
         if n == "Week":
             continue
-        df[prefix + n] = (
-            getattr(field.dt, n.lower()).astype(_32_bit_dtype)
-            if use_32_bit
-            else getattr(field.dt, n.lower())
-        )
+        feature = pd.Series(calendar_df[n].values.take(codes), index=df.index)
+        df[prefix + n] = feature.astype(_32_bit_dtype) if use_32_bit else feature
         added_features.append(prefix + n)
-    # Pandas removed `dt.week` in v1.1.10
     if "Week" in attr:
-        week = (
-            field.dt.isocalendar().week
-            if hasattr(field.dt, "isocalendar")
-            else field.dt.week
-        )
+        week = pd.Series(calendar_df["Week"].values.take(codes), index=df.index)
         df.insert(
             3, prefix + "Week", week.astype(_32_bit_dtype) if use_32_bit else week
         )
         added_features.append(prefix + "Week")
     if add_elapsed:
         mask = ~field.isna()
-        df[prefix + "Elapsed"] = np.where(
-            mask, field.values.astype(np.int64) // 10**9, None
-        )
+        if narrow_dtypes and mask.all():
+            elapsed = field.values.astype(np.int64) // 10**9
+            df[prefix + "Elapsed"] = elapsed.astype(
+                _get_narrowest_int_dtype(elapsed.min(), elapsed.max()), copy=False
+            )
+        else:
+            df[prefix + "Elapsed"] = np.where(
+                mask, field.values.astype(np.int64) // 10**9, None
+            )
         if use_32_bit:
             if df[prefix + "Elapsed"].isnull().sum() == 0:
                 df[prefix + "Elapsed"] = df[prefix + "Elapsed"].astype("int32")
@@ -206,24 +402,13 @@ def add_temporal_features(
     return df, added_features
 
 
-def _calculate_fourier_terms(
-    seasonal_cycle: np.ndarray, max_cycle: int, n_fourier_terms: int
-):
-    """Calculates Fourier Terms given the seasonal cycle and max_cycle"""
-    sin_X = np.empty((len(seasonal_cycle), n_fourier_terms), dtype="float64")
-    cos_X = np.empty((len(seasonal_cycle), n_fourier_terms), dtype="float64")
-    for i in range(1, n_fourier_terms + 1):
-        sin_X[:, i - 1] = np.sin((2 * np.pi * seasonal_cycle * i) / max_cycle)
-        cos_X[:, i - 1] = np.cos((2 * np.pi * seasonal_cycle * i) / max_cycle)
-    return np.hstack([sin_X, cos_X])
-
-
 def add_fourier_features(
     df: pd.DataFrame,
     column_to_encode: str,
     max_value: Optional[int] = None,
     n_fourier_terms: int = 1,
     use_32_bit: bool = False,
+    calendar_cache: Optional[CalendarFeatureCache] = None,
 ) -> Tuple[pd.DataFrame, List]:
     """Adds Fourier Terms for the specified seasonal cycle column, like month, week, hour, etc.
 
@@ -235,6 +420,8 @@ def add_fourier_features(
             single full cycle, the inferred max value will not be appropriate. Defaults to None
         n_fourier_terms (int): Number of fourier terms to be added. Defaults to 1
         use_32_bit (bool, optional): Flag to use float32 or int32 to reduce memory. Defaults to False.
+        calendar_cache (CalendarFeatureCache, optional): Cache of the fourier lookup tables, which can be
+            shared between calls. If None, a new one is used for this call. Defaults to None.
     Raises:
         warnings.warn: Raises a warning if max_value is None
 
@@ -252,17 +439,19 @@ def add_fourier_features(
         raise warnings.warn(
             "Inferring max cycle as {} from the data. This may not be accuracte if data is less than a single seasonal cycle."
         )
-    fourier_features = _calculate_fourier_terms(
+    if calendar_cache is None:
+        calendar_cache = CalendarFeatureCache()
+    # Written as float32 directly instead of casting a float64 block afterwards
+    fourier_features = calendar_cache.get_fourier_terms(
         df[column_to_encode].astype(int).values,
         max_cycle=max_value,
         n_fourier_terms=n_fourier_terms,
+        dtype="float32" if use_32_bit else "float64",
     )
     feature_names = [
         f"{column_to_encode}_sin_{i}" for i in range(1, n_fourier_terms + 1)
     ] + [f"{column_to_encode}_cos_{i}" for i in range(1, n_fourier_terms + 1)]
     df[feature_names] = fourier_features
-    if use_32_bit:
-        df[feature_names] = df[feature_names].astype("float32")
     return df, feature_names
 
 
@@ -272,6 +461,7 @@ def bulk_add_fourier_features(
     max_values: List[int],
     n_fourier_terms: int = 1,
     use_32_bit: bool = False,
+    calendar_cache: Optional[CalendarFeatureCache] = None,
 ) -> Tuple[pd.DataFrame, List]:
     """Adds Fourier Terms for all the specified seasonal cycle columns, like month, week, hour, etc.
 
@@ -284,6 +474,8 @@ def bulk_add_fourier_features(
             single full cycle, the inferred max value will not be appropriate. Defaults to None
         n_fourier_terms (int): Number of fourier terms to be added. Defaults to 1
         use_32_bit (bool, optional): Flag to use float32 or int32 to reduce memory. Defaults to False.
+        calendar_cache (CalendarFeatureCache, optional): Cache of the fourier lookup tables, which can be
+            shared between calls. If None, a new one is used for this call. Defaults to None.
     Raises:
         warnings.warn: Raises a warning if max_value is None
 
@@ -294,6 +486,8 @@ def bulk_add_fourier_features(
         max_values
     ), "`columns_to_encode` and `max_values` should be of same length."
     added_features = []
+    if calendar_cache is None:
+        calendar_cache = CalendarFeatureCache()
     for column_to_encode, max_value in zip(columns_to_encode, max_values):
         df, features = add_fourier_features(
             df,
@@ -301,6 +495,7 @@ def bulk_add_fourier_features(
             max_value,
             n_fourier_terms=n_fourier_terms,
             use_32_bit=use_32_bit,
+            calendar_cache=calendar_cache,
         )
         added_features += features
     return df, added_features
@@ -1,20 +1,210 @@
 import copy
+import inspect
+import time
+import traceback
 import warnings
-from dataclasses import MISSING, dataclass, field
-from typing import Dict, List, Union
+from dataclasses import MISSING, dataclass, field, replace
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 
 import numpy as np
 import pandas as pd
-from darts.metrics import mae, mase, mse
+from joblib import Parallel, delayed
 from sklearn.base import BaseEstimator, clone
 from sklearn.preprocessing import StandardScaler
+from tqdm.autonotebook import tqdm
 
 from src.utils.general import difference_list, intersect_list
-from src.utils.ts_utils import darts_metrics_adapter, forecast_bias
 
 # from category_encoders import OneHotEncoder
 
 
+def _ffill_indices(mask: np.ndarray) -> np.ndarray:
+    """Indices of the last non missing value at or before every position (0 before the first one)"""
+    indices = np.where(mask, 0, np.arange(len(mask)))
+    np.maximum.accumulate(indices, out=indices)
+    return indices
+
+
+def _fill_array(values: np.ndarray, mask: np.ndarray, strategy: str) -> np.ndarray:
+    """Returns the values with the missing values filled forward or backward"""
+    if strategy == "ffill":
+        return values[_ffill_indices(mask)]
+    return values[::-1][_ffill_indices(mask[::-1])][::-1]
+
+
+def _get_group_keys(df: pd.DataFrame, ts_id: str) -> np.ndarray:
+    """The id of the time series of every row, from a column or an index level"""
+    if ts_id in df.index.names:
+        return df.index.get_level_values(ts_id).values
+    return df[ts_id].values
+
+
+@dataclass
+class ImputationPlan:
+
+    strategies: Dict[str, str] = field(
+        default_factory=dict,
+        metadata={
+            "help": "The fill strategy of the columns, one of `bfill`, `ffill` or `zero`"
+        },
+    )
+    fill_values: Dict[str, object] = field(
+        default_factory=dict,
+        metadata={
+            "help": "The values with which the missing values left after the strategy are filled. The mean at fit time for numeric columns and `NA` for object columns"
+        },
+    )
+    ts_id: str = field(
+        default=None,
+        metadata={
+            "help": "Column or index level with the unique id of a time series. If set, bfill and ffill are done within every time series and the numeric columns are filled with the mean of the time series"
+        },
+    )
+    group_fill_values: pd.DataFrame = field(
+        default=None,
+        metadata={
+            "help": "The mean of every numeric column (columns) for every time series (index) at fit time. Time series not seen at fit time are filled with `fill_values`"
+        },
+    )
+    counts: Dict[str, int] = field(
+        default_factory=dict,
+        metadata={
+            "help": "The number of non missing values behind the means in `fill_values`, used to update them as running means"
+        },
+    )
+    group_counts: pd.DataFrame = field(
+        default=None,
+        metadata={
+            "help": "The number of non missing values behind the means in `group_fill_values`"
+        },
+    )
+
+    def update(self, df: pd.DataFrame) -> "ImputationPlan":
+        """Updates the recorded means with the rows of a new batch, as running means weighted by the number of
+        non missing values, so that the plan is the same as one fit on all the data seen so far without going
+        over the old rows again. bfill and ffill are applied within the new batch before taking the means.
+
+        Args:
+            df (pd.DataFrame): The new rows, with the same columns as the dataframe the plan was fit on
+
+        Returns:
+            ImputationPlan: The plan itself, updated
+        """
+        columns = [c for c in self.counts if c in df.columns]
+        if self.ts_id is not None:
+            keys = _get_group_keys(df, self.ts_id)
+            # Time series seen for the first time get a row of their own
+            index = self.group_fill_values.index.union(
+                pd.Index(pd.unique(keys)), sort=False
+            )
+            self.group_fill_values = self.group_fill_values.reindex(index)
+            self.group_counts = self.group_counts.reindex(index, fill_value=0)
+        for col in columns:
+            x = df[col]
+            strategy = self.strategies.get(col)
+            if strategy in ["bfill", "ffill"] and x.isnull().any():
+                x = (
+                    x.fillna(method=strategy)
+                    if self.ts_id is None
+                    else x.groupby(keys, sort=False).transform(strategy)
+                )
+            n, count = x.count(), self.counts[col]
+            if n > 0:
+                mean = self.fill_values[col] if count > 0 else 0
+                self.fill_values[col] = mean + (x.sum() - n * mean) / (count + n)
+                self.counts[col] = count + n
+            if self.ts_id is not None:
+                grouped = x.groupby(keys, sort=False).agg(["sum", "count"])
+                grouped = grouped.reindex(index, fill_value=0)
+                group_count = self.group_counts[col]
+                total = group_count + grouped["count"]
+                mean = self.group_fill_values[col].where(group_count > 0, 0)
+                # NaN for the time series which are still all missing
+                self.group_fill_values[col] = (
+                    mean + (grouped["sum"] - grouped["count"] * mean) / total
+                ).where(total > 0)
+                self.group_counts[col] = total
+        return self
+
+    def transform(self, df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+        """Fills the missing values with the strategies and the values recorded at fit time
+
+        Only the columns which have missing values are touched. The float columns are filled with vectorized
+        NumPy operations on the arrays of the columns and the rest of the columns with `fillna`.
+
+        Args:
+            df (pd.DataFrame): The dataframe to be imputed
+            inplace (bool, optional): Fill the missing values in the arrays of `df` itself, without copying
+                anything. If False, `df` is not modified and only the columns with missing values are copied.
+                Defaults to False.
+
+        Returns:
+            pd.DataFrame: The imputed dataframe
+        """
+        if not inplace:
+            df = df.copy(deep=False)
+        columns = [
+            c for c in df.columns if c in self.strategies or c in self.fill_values
+        ]
+        if self.ts_id is not None:
+            codes, ids = pd.factorize(_get_group_keys(df, self.ts_id))
+        for col in columns:
+            strategy = self.strategies.get(col)
+            fill_value = self.fill_values.get(col, 0 if strategy == "zero" else None)
+            values = df[col].values
+            if isinstance(values, np.ndarray) and values.dtype.kind == "f":
+                mask = np.isnan(values)
+                if not mask.any():
+                    continue
+                if (
+                    self.ts_id is not None
+                    and fill_value is not None
+                    and col in self.group_fill_values.columns
+                ):
+                    # The mean of the time series of every row, and the overall mean for new time series
+                    group_values = self.group_fill_values[col].reindex(ids).values
+                    fill_value = np.where(
+                        np.isnan(group_values), fill_value, group_values
+                    )[codes]
+                if strategy in ["bfill", "ffill"]:
+                    filled = (
+                        _fill_array(values, mask, strategy)
+                        if self.ts_id is None
+                        else pd.Series(values)
+                        .groupby(codes, sort=False)
+                        .transform(strategy)
+                        .values
+                    )
+                    # The leading (bfill) or trailing (ffill) missing values of every time series are left
+                    if fill_value is not None:
+                        np.copyto(filled, fill_value, where=np.isnan(filled))
+                else:
+                    filled = (
+                        values if inplace and values.flags.writeable else values.copy()
+                    )
+                    if fill_value is not None:
+                        np.copyto(filled, fill_value, where=mask)
+                if inplace and values.flags.writeable:
+                    # `values` is a view into the block of the dataframe
+                    values[...] = filled
+                else:
+                    df[col] = filled
+            else:
+                x = df[col]
+                if not x.isnull().any():
+                    continue
+                if strategy in ["bfill", "ffill"]:
+                    x = (
+                        x.fillna(method=strategy)
+                        if self.ts_id is None
+                        else x.groupby(codes, sort=False).transform(strategy)
+                    )
+                if fill_value is not None:
+                    x = x.fillna(fill_value)
+                df[col] = x
+        return df
+
+
 @dataclass
 class MissingValueConfig:
 
@@ -32,12 +222,97 @@ class MissingValueConfig:
         metadata={"help": "Column names which should be filled using 0"},
     )
 
-    def impute_missing_values(self, df: pd.DataFrame):
+    def fit(self, df: pd.DataFrame, ts_id: str = None) -> ImputationPlan:
+        """Records the fill strategy of every column and the values with which the missing values left after the
+        strategies are filled (the mean for numeric columns and "NA" for object columns). Applying the plan with
+        `transform` gives the same result as `impute_missing_values` on the same dataframe, and reuses the fit time
+        means on new data instead of the means of the new data
+
+        Args:
+            df (pd.DataFrame): The dataframe the plan is fit on
+            ts_id (str, optional): Column or index level with the unique id of a time series. If given, the plan
+                fills within every time series and records the mean of every time series, as
+                `impute_missing_values` does with `ts_id`. Defaults to None.
+
+        Returns:
+            ImputationPlan: The fitted plan
+        """
+        strategies = {}
+        for strategy, columns in [
+            ("bfill", self.bfill_columns),
+            ("ffill", self.ffill_columns),
+            ("zero", self.zero_fill_columns),
+        ]:
+            strategies.update({c: strategy for c in columns if c in df.columns})
+        if ts_id is not None:
+            keys = _get_group_keys(df, ts_id)
+        fill_values, group_fill_values = {}, {}
+        counts, group_counts = {}, {}
+        for col in df.select_dtypes([np.number]).columns:
+            if strategies.get(col) == "zero":
+                continue
+            x = df[col]
+            if strategies.get(col) in ["bfill", "ffill"] and x.isnull().any():
+                # The mean used to fill what is left after the strategy is the mean after the strategy
+                x = (
+                    x.fillna(method=strategies[col])
+                    if ts_id is None
+                    else x.groupby(keys, sort=False).transform(strategies[col])
+                )
+            fill_values[col] = x.mean()
+            counts[col] = x.count()
+            if ts_id is not None:
+                grouped = x.groupby(keys, sort=False)
+                group_fill_values[col] = grouped.mean()
+                group_counts[col] = grouped.count()
+        for col in df.select_dtypes(["object"]).columns:
+            if strategies.get(col) != "zero":
+                fill_values[col] = "NA"
+        return ImputationPlan(
+            strategies=strategies,
+            fill_values=fill_values,
+            ts_id=ts_id,
+            group_fill_values=(
+                pd.DataFrame(group_fill_values) if ts_id is not None else None
+            ),
+            counts=counts,
+            group_counts=pd.DataFrame(group_counts) if ts_id is not None else None,
+        )
+
+    def impute_missing_values(self, df: pd.DataFrame, ts_id: str = None):
+        """Fills the missing values using the strategies of the config. The columns which are not in any of
+        the strategies are filled with the mean (numeric) or "NA" (object)
+
+        Args:
+            df (pd.DataFrame): The dataframe to be imputed
+            ts_id (str, optional): Column or index level with the unique id of a time series. If given, the
+                bfill, ffill and mean are done within every time series, in a single grouped operation, so that
+                values do not leak across time series in a panel. Series which are all missing in a column are
+                filled with the mean of the whole column. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The imputed dataframe
+        """
         df = df.copy()
+        if ts_id is not None:
+            group_keys = (
+                df.index.get_level_values(ts_id)
+                if ts_id in df.index.names
+                else df[ts_id]
+            )
+            grouped = df.groupby(group_keys.values, sort=False)
         bfill_columns = intersect_list(df.columns, self.bfill_columns)
-        df[bfill_columns] = df[bfill_columns].fillna(method="bfill")
+        df[bfill_columns] = (
+            df[bfill_columns].fillna(method="bfill")
+            if ts_id is None
+            else grouped[bfill_columns].bfill()
+        )
         ffill_columns = intersect_list(df.columns, self.ffill_columns)
-        df[ffill_columns] = df[ffill_columns].fillna(method="ffill")
+        df[ffill_columns] = (
+            df[ffill_columns].fillna(method="ffill")
+            if ts_id is None
+            else grouped[ffill_columns].ffill()
+        )
         zero_fill_columns = intersect_list(df.columns, self.zero_fill_columns)
         df[zero_fill_columns] = df[zero_fill_columns].fillna(0)
         check = df.isnull().any()
@@ -49,9 +324,13 @@ class MissingValueConfig:
             missing_cols, df.select_dtypes(["object"]).columns.tolist()
         )
         # Filling with mean and NA as default fillna strategy
-        df[missing_numeric_cols] = df[missing_numeric_cols].fillna(
-            df[missing_numeric_cols].mean()
-        )
+        # The mean of the whole column is taken before filling with the means of the time series
+        column_means = df[missing_numeric_cols].mean()
+        if ts_id is not None:
+            df[missing_numeric_cols] = df[missing_numeric_cols].fillna(
+                grouped[missing_numeric_cols].transform("mean")
+            )
+        df[missing_numeric_cols] = df[missing_numeric_cols].fillna(column_means)
         df[missing_object_cols] = df[missing_object_cols].fillna("NA")
         return df
 
@@ -139,33 +418,147 @@ class FeatureConfig:
         if self.original_target is None:
             self.original_target = self.target
 
-    def get_X_y(
-        self, df: pd.DataFrame, categorical: bool = False, exogenous: bool = False
-    ):
+    def get_feature_columns(
+        self, categorical: bool = False, exogenous: bool = False
+    ) -> List[str]:
+        """Returns the columns of X in a stable order: continuous, categorical and boolean features in the order
+        they are defined, followed by the index columns which are also features"""
         feature_list = copy.deepcopy(self.continuous_features)
         if categorical:
             feature_list += self.categorical_features + self.boolean_features
         if not exogenous:
-            feature_list = list(set(feature_list) - set(self.exogenous_features))
-        feature_list = list(set(feature_list))
-        delete_index_cols = list(set(self.index_cols) - set(self.feature_list))
-        (X, y, y_orig) = (
-            df.loc[:, set(feature_list + self.index_cols)]
-            .set_index(self.index_cols, drop=False)
-            .drop(columns=delete_index_cols),
-            df.loc[:, [self.target] + self.index_cols].set_index(
-                self.index_cols, drop=True
-            )
-            if self.target in df.columns
-            else None,
-            df.loc[:, [self.original_target] + self.index_cols].set_index(
-                self.index_cols, drop=True
+            feature_list = [f for f in feature_list if f not in self.exogenous_features]
+        feature_list += [c for c in self.index_cols if c in self.feature_list]
+        return list(dict.fromkeys(feature_list))
+
+    def _get_index(self, df: pd.DataFrame) -> pd.Index:
+        """Builds the index from the `index_cols` once, to be shared by X, y and y_orig"""
+        if len(self.index_cols) == 0:
+            return df.index
+        if len(self.index_cols) == 1:
+            return pd.Index(df[self.index_cols[0]])
+        return pd.MultiIndex.from_arrays([df[c] for c in self.index_cols])
+
+    def get_X_y(
+        self, df: pd.DataFrame, categorical: bool = False, exogenous: bool = False
+    ):
+        """Splits the dataframe into the features, the target and the original target, indexed by the `index_cols`
+
+        Args:
+            df (pd.DataFrame): The dataframe with the features and targets
+            categorical (bool, optional): Include the categorical and boolean features. Defaults to False.
+            exogenous (bool, optional): Include the exogenous features. Defaults to False.
+
+        Returns:
+            Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: X with the features in the order of
+                `get_feature_columns`, and y and y_orig (None if not present in `df`)
+        """
+        index = self._get_index(df)
+        X = df[self.get_feature_columns(categorical, exogenous)]
+        X.index = index
+        y, y_orig = [
+            (
+                pd.DataFrame({col: df[col].values}, index=index)
+                if col in df.columns
+                else None
             )
-            if self.original_target in df.columns
-            else None,
-        )
+            for col in [self.target, self.original_target]
+        ]
         return X, y, y_orig
 
+    def compile(
+        self, categorical: bool = False, exogenous: bool = False
+    ) -> "CompiledFeatureSelector":
+        """Returns a selector which builds X as a contiguous float32 matrix. See `CompiledFeatureSelector`"""
+        return CompiledFeatureSelector(
+            self, categorical=categorical, exogenous=exogenous
+        )
+
+
+class CompiledFeatureSelector:
+    def __init__(
+        self,
+        feature_config: FeatureConfig,
+        categorical: bool = False,
+        exogenous: bool = False,
+        dtype: np.dtype = np.float32,
+    ) -> None:
+        """Builds the feature matrix for the models from dataframes with the same columns, for eg. the daily
+        batches of the same pipeline
+
+        The feature columns are resolved to positions in the columns of the dataframe once and reused as long as
+        the columns do not change. X is written column by column into a single C-contiguous matrix, which is the
+        layout the models copy their input to anyway. Categorical features are written as their codes (missing
+        values as NaN) and boolean features as 0/1. The index is built once and shared by X, y and y_orig.
+
+        Args:
+            feature_config (FeatureConfig): Instance of the FeatureConfig object defining the features
+            categorical (bool, optional): Include the categorical and boolean features. Defaults to False.
+            exogenous (bool, optional): Include the exogenous features. Defaults to False.
+            dtype (np.dtype, optional): The dtype of the matrix. Defaults to np.float32.
+        """
+        self.feature_config = feature_config
+        self.feature_names = feature_config.get_feature_columns(categorical, exogenous)
+        self.dtype = np.dtype(dtype)
+        self._columns = None
+        self._positions = None
+
+    def _resolve(self, columns: pd.Index) -> np.ndarray:
+        if self._columns is None or not (
+            columns is self._columns or columns.equals(self._columns)
+        ):
+            missing = [f for f in self.feature_names if f not in columns]
+            assert (
+                len(missing) == 0
+            ), f"These features are not present in the dataframe: {missing}"
+            assert columns.is_unique, "The columns of the dataframe should be unique"
+            self._positions = columns.get_indexer(self.feature_names)
+            self._columns = columns
+        return self._positions
+
+    def __call__(self, df: pd.DataFrame, as_frame: bool = False):
+        """Builds X, y and y_orig from the dataframe
+
+        Args:
+            df (pd.DataFrame): The dataframe with the features and targets
+            as_frame (bool, optional): Also wrap the outputs in pandas objects with the `index_cols` as the index.
+                X is a dataframe view over the same matrix. Defaults to False.
+
+        Returns:
+            Tuple: X (n_rows x n_features matrix, or a dataframe view over it), y and y_orig (arrays, or Series if
+                `as_frame`. None if not present in `df`)
+        """
+        positions = self._resolve(df.columns)
+        X = np.empty((len(df), len(positions)), dtype=self.dtype)
+        for j, position in enumerate(positions):
+            x = df.iloc[:, position]
+            if isinstance(x.dtype, pd.CategoricalDtype):
+                values = x.cat.codes.values.astype(self.dtype)
+                values[x.cat.codes.values < 0] = np.nan
+            else:
+                values = x.values
+            X[:, j] = values
+        y, y_orig = [
+            df[col].values if col in df.columns else None
+            for col in [self.feature_config.target, self.feature_config.original_target]
+        ]
+        if not as_frame:
+            return X, y, y_orig
+        index = self.feature_config._get_index(df)
+        return (
+            pd.DataFrame(X, index=index, columns=self.feature_names, copy=False),
+            (
+                pd.Series(y, index=index, name=self.feature_config.target)
+                if y is not None
+                else None
+            ),
+            (
+                pd.Series(y_orig, index=index, name=self.feature_config.original_target)
+                if y_orig is not None
+                else None
+            ),
+        )
+
 
 @dataclass
 class ModelConfig:
@@ -208,6 +601,17 @@ class ModelConfig:
         return self
 
 
+def _get_warm_start_kwargs(model: BaseEstimator) -> Dict:
+    """The keyword args with which `fit` continues training from the fitted model, or None if it cannot"""
+    fit_params = inspect.signature(model.fit).parameters
+    if "init_model" in fit_params:
+        # LightGBM takes the booster and CatBoost the model itself
+        return {"init_model": getattr(model, "booster_", model)}
+    if "xgb_model" in fit_params:
+        return {"xgb_model": model.get_booster()}
+    return None
+
+
 class MLForecast:
     def __init__(
         self,
@@ -273,7 +677,8 @@ class MLForecast:
             self.feature_config.boolean_features, X.columns
         )
         if self.model_config.fill_missing:
-            X = self.missing_config.impute_missing_values(X)
+            self._imputation_plan = self.missing_config.fit(X)
+            X = self._imputation_plan.transform(X)
         if self.model_config.encode_categorical:
             missing_cat_cols = difference_list(
                 self._categorical_feats,
@@ -309,11 +714,86 @@ class MLForecast:
         self._model.fit(X, y, **fit_kwargs)
         return self
 
-    def predict(self, X: pd.DataFrame) -> pd.Series:
+    def update(
+        self,
+        X: pd.DataFrame,
+        y: Union[pd.Series, np.ndarray],
+        is_transformed: bool = False,
+        update_statistics: bool = None,
+        fit_kwargs: Dict = {},
+    ):
+        """Continues training the fitted model on new rows only, for eg. the latest day in a daily refit, instead
+        of refitting from scratch on all the data
+
+        The model is updated with `partial_fit` if it has one (SGDRegressor, MLPRegressor etc.), and otherwise by
+        boosting more trees on top of the fitted ones (`init_model` of LightGBM and CatBoost, `xgb_model` of
+        XGBoost). For models with a `partial_fit`, the imputation means and the scaler are updated with running
+        moments over the new rows, which gives the same statistics as fitting them on all the data seen so far.
+        For the boosted trees, they are kept as they were at fit time. The categorical encoder is updated only if
+        it has a `partial_fit`, and is reused as it is otherwise.
+
+        Args:
+            X (pd.DataFrame): The dataframe with the new rows, with the features the model was trained on
+            y (Union[pd.Series, np.ndarray]): Dataframe, Series, or np.ndarray with the targets of the new rows
+            is_transformed (bool, optional): Whether the target is already transformed. If `False`, the target
+                is transformed with `transform` of the fitted target_transformer. Differencing transformers need
+                the previous values as well, so transform those targets beforehand. Defaults to False.
+            update_statistics (bool, optional): Update the imputation means and the scaler with the new rows. The
+                trees boosted so far are not retrained and have learnt their splits on the old statistics, so
+                updating the statistics would shift the inputs of the old trees. If None, the statistics are
+                updated for models with a `partial_fit`, whose weights all keep learning, and kept fixed for the
+                boosted trees. Defaults to None.
+            fit_kwargs (Dict, optional): The dictionary with keyword args to be passed to the
+                partial_fit or fit function of the model. Defaults to {}.
+        """
+        assert hasattr(
+            self, "_train_features"
+        ), "`update` continues training a fitted model. Call `fit` first"
+        warm_start_kwargs = (
+            {}
+            if hasattr(self._model, "partial_fit")
+            else _get_warm_start_kwargs(self._model)
+        )
+        assert (
+            warm_start_kwargs is not None
+        ), f"{type(self._model).__name__} does not support incremental training. It should have a `partial_fit` or be a LightGBM, XGBoost or CatBoost model"
+        if update_statistics is None:
+            update_statistics = hasattr(self._model, "partial_fit")
+        if self.model_config.fill_missing:
+            if update_statistics:
+                self._imputation_plan.update(X)
+            X = self._imputation_plan.transform(X)
+        else:
+            X = X.copy(deep=False)
+        if self.model_config.encode_categorical:
+            if update_statistics and hasattr(self._cat_encoder, "partial_fit"):
+                self._cat_encoder.partial_fit(X, y)
+            X = self._cat_encoder.transform(X)
+        if self.model_config.normalize:
+            scaled_feats = self._continuous_feats + self._encoded_categorical_features
+            if update_statistics:
+                # StandardScaler keeps the running mean and variance over all the samples seen
+                self._scaler.partial_fit(X[scaled_feats])
+            X[scaled_feats] = self._scaler.transform(X[scaled_feats])
+        assert len(intersect_list(self._train_features, X.columns)) == len(
+            self._train_features
+        ), f"All the features during training is not available while updating: {difference_list(self._train_features, X.columns)}"
+        X = X[self._train_features]
+        if not is_transformed and self.target_transformer is not None:
+            y = self.target_transformer.transform(y)
+        if hasattr(self._model, "partial_fit"):
+            self._model.partial_fit(X, y, **fit_kwargs)
+        else:
+            self._model.fit(X, y, **warm_start_kwargs, **fit_kwargs)
+        return self
+
+    def predict(self, X: pd.DataFrame, inplace: bool = False) -> pd.Series:
         """Predicts on the given dataframe using the trained model
 
         Args:
             X (pd.DataFrame): The dataframe with the features as columns. The index is passed on to the prediction series
+            inplace (bool, optional): Fill the missing values and normalize in the arrays of `X` itself, which avoids
+                copying the columns with missing values. `X` is modified. Defaults to False.
 
         Returns:
             pd.Series: predictions using the model as a pandas Series with datetime index
@@ -322,7 +802,10 @@ class MLForecast:
             self._train_features
         ), f"All the features during training is not available while predicting: {difference_list(self._train_features, X.columns)}"
         if self.model_config.fill_missing:
-            X = self.missing_config.impute_missing_values(X)
+            # The missing values are filled with the means recorded while fitting
+            X = self._imputation_plan.transform(X, inplace=inplace)
+        elif not inplace:
+            X = X.copy(deep=False)
         if self.model_config.encode_categorical:
             X = self._cat_encoder.transform(X)
         if self.model_config.normalize:
@@ -369,6 +852,466 @@ class MLForecast:
         return feat_df
 
 
+@dataclass
+class ForecastJob:
+
+    key: object = field(
+        default=MISSING,
+        metadata={
+            "help": "Identifier of the job, for eg. the LCLid of the time series"
+        },
+    )
+    model_config: ModelConfig = field(
+        default=MISSING,
+        metadata={"help": "Instance of the ModelConfig object defining the model"},
+    )
+    feature_config: FeatureConfig = field(
+        default=MISSING,
+        metadata={"help": "Instance of the FeatureConfig object defining the features"},
+    )
+    X: pd.DataFrame = field(
+        default=MISSING, metadata={"help": "The dataframe with the training features"}
+    )
+    y: Union[pd.Series, np.ndarray] = field(
+        default=MISSING, metadata={"help": "The training targets"}
+    )
+    missing_config: MissingValueConfig = field(
+        default=None,
+        metadata={
+            "help": "Instance of the MissingValueConfig object. Defaults to None"
+        },
+    )
+    target_transformer: object = field(
+        default=None,
+        metadata={"help": "Target transformer from src.transforms. Defaults to None"},
+    )
+    X_test: pd.DataFrame = field(
+        default=None,
+        metadata={
+            "help": "If given, the trained model also predicts on these features in the same job. Defaults to None"
+        },
+    )
+    fit_kwargs: Dict = field(
+        default_factory=dict,
+        metadata={"help": "Keyword args to be passed to the fit function of the model"},
+    )
+
+
+@dataclass
+class JobResult:
+
+    key: object = field(metadata={"help": "Identifier of the job"})
+    forecaster: MLForecast = field(
+        default=None,
+        metadata={"help": "The trained MLForecast. None if the job failed"},
+    )
+    y_pred: pd.Series = field(
+        default=None, metadata={"help": "The predictions, if the job predicted"}
+    )
+    error: str = field(
+        default=None, metadata={"help": "The traceback if the job failed, else None"}
+    )
+    fit_time: float = field(
+        default=None, metadata={"help": "Seconds taken to train the model"}
+    )
+    predict_time: float = field(
+        default=None, metadata={"help": "Seconds taken to predict"}
+    )
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+
+def _run_fit_job(job: ForecastJob) -> JobResult:
+    """Trains (and predicts) a job, capturing any exception so that one failing time series does not stop the rest"""
+    result = JobResult(key=job.key)
+    try:
+        start = time.perf_counter()
+        forecaster = MLForecast(
+            job.model_config,
+            job.feature_config,
+            job.missing_config,
+            job.target_transformer,
+        ).fit(job.X, job.y, fit_kwargs=job.fit_kwargs)
+        result.fit_time = time.perf_counter() - start
+        if job.X_test is not None:
+            start = time.perf_counter()
+            result.y_pred = forecaster.predict(job.X_test)
+            result.predict_time = time.perf_counter() - start
+        result.forecaster = forecaster
+    except Exception:
+        result.error = traceback.format_exc()
+    return result
+
+
+def _run_predict_job(key, forecaster: MLForecast, X: pd.DataFrame) -> JobResult:
+    result = JobResult(key=key, forecaster=forecaster)
+    try:
+        start = time.perf_counter()
+        result.y_pred = forecaster.predict(X)
+        result.predict_time = time.perf_counter() - start
+    except Exception:
+        result.error = traceback.format_exc()
+    return result
+
+
+def _run_task(position: int, func, args) -> Tuple[int, JobResult]:
+    return position, func(*args)
+
+
+def _run_jobs(
+    tasks, n_jobs: int, max_nbytes: str, total: int, desc: str, ordered: bool
+) -> Iterator[JobResult]:
+    tasks = ((position, func, args) for position, (func, args) in enumerate(tasks))
+    if n_jobs == 1:
+        results = (_run_task(*task) for task in tasks)
+    else:
+        # joblib memory maps the arrays larger than max_nbytes (including the blocks of the dataframes) to a
+        # temporary folder, which the workers read instead of receiving a pickled copy. The results come back
+        # as they finish (joblib>=1.4)
+        results = Parallel(
+            n_jobs=n_jobs, max_nbytes=max_nbytes, return_as="generator_unordered"
+        )(delayed(_run_task)(*task) for task in tasks)
+    # The results which finished before the ones of the jobs before them, by the position of their job
+    pending = {}
+    next_position = 0
+    for position, result in tqdm(results, total=total, desc=desc):
+        if result.failed:
+            warnings.warn(f"Job {result.key} failed:\n{result.error}")
+        if not ordered:
+            yield result
+            continue
+        pending[position] = result
+        while next_position in pending:
+            yield pending.pop(next_position)
+            next_position += 1
+
+
+def fit_many(
+    jobs: Iterable[ForecastJob],
+    n_jobs: int = -1,
+    max_nbytes: str = "1M",
+    ordered: bool = True,
+) -> Iterator[JobResult]:
+    """Trains independent `MLForecast` models, for eg. a local model per time series, across a process pool
+
+    The results are streamed back: every result is yielded as soon as its job and the jobs before it have
+    finished, in the order of `jobs`, or as soon as its job has finished if not `ordered`. A job which raises an
+    exception does not stop the others and is returned with the traceback in `error`.
+
+    Args:
+        jobs (Iterable[ForecastJob]): The jobs with the configs and the data of every model
+        n_jobs (int, optional): Number of processes. -1 uses all the cores. Defaults to -1.
+        max_nbytes (str, optional): Arrays larger than this are shared with the workers through memory mapped
+            files instead of being pickled. Defaults to "1M".
+        ordered (bool, optional): Yield the results in the order of `jobs`. If False, they are yielded in the
+            order the jobs finish, which does not hold back the results behind a slow job. Defaults to True.
+
+    Returns:
+        Iterator[JobResult]: The results with the trained model, the predictions if `X_test` was given, the error
+            if the job failed and the time taken to fit and predict
+    """
+    total = len(jobs) if hasattr(jobs, "__len__") else None
+    tasks = ((_run_fit_job, (job,)) for job in jobs)
+    return _run_jobs(tasks, n_jobs, max_nbytes, total, "Training models...", ordered)
+
+
+def predict_many(
+    forecasters: Dict[object, MLForecast],
+    X: Dict[object, pd.DataFrame],
+    n_jobs: int = -1,
+    max_nbytes: str = "1M",
+    ordered: bool = True,
+) -> Iterator[JobResult]:
+    """Predicts with independent trained `MLForecast` models across a process pool, streaming the results back
+    as in `fit_many`
+
+    Args:
+        forecasters (Dict[object, MLForecast]): The trained models by the key of the job
+        X (Dict[object, pd.DataFrame]): The features to predict on by the key of the job
+        n_jobs (int, optional): Number of processes. -1 uses all the cores. Defaults to -1.
+        max_nbytes (str, optional): Arrays larger than this are shared with the workers through memory mapped
+            files instead of being pickled. Defaults to "1M".
+        ordered (bool, optional): Yield the results in the order of `X`. If False, they are yielded in the order
+            the jobs finish. Defaults to True.
+
+    Returns:
+        Iterator[JobResult]: The results with the predictions
+    """
+    missing_keys = set(X.keys()) - set(forecasters.keys())
+    assert (
+        len(missing_keys) == 0
+    ), f"These keys do not have a trained model: {missing_keys}"
+    tasks = ((_run_predict_job, (key, forecasters[key], x)) for key, x in X.items())
+    return _run_jobs(tasks, n_jobs, max_nbytes, len(X), "Predicting...", ordered)
+
+
+ALLOWED_BATCH_MODES = ["global", "local"]
+
+
+class BatchMLForecast:
+    def __init__(
+        self,
+        model_config: ModelConfig,
+        feature_config: FeatureConfig,
+        ts_id: str,
+        missing_config: MissingValueConfig = None,
+        target_transformer: object = None,
+        mode: str = "global",
+        categorical: bool = False,
+        exogenous: bool = False,
+    ) -> None:
+        """Trains and predicts `MLForecast` models on a panel of time series in the long format at once
+
+        In the "global" mode, a single model is trained on all the time series. In the "local" mode, a model
+        is trained for every time series on its slice of the panel. The panel is split into the features and
+        targets with `feature_config.get_X_y` and preprocessed only once: the missing values are imputed within
+        every time series with an `ImputationPlan` holding the fit time means of every time series, and in the "local" mode the categorical encoder is fit once on
+        the panel and the continuous features are standardized with the mean and standard deviation of every
+        time series (what a `StandardScaler` per time series would do) in a vectorized way. The local models are
+        then trained on views of the sorted panel, without any further preprocessing.
+
+        Args:
+            model_config (ModelConfig): Instance of the ModelConfig object defining the model
+            feature_config (FeatureConfig): Instance of the FeatureConfig object defining the features.
+                `ts_id` should be one of the `index_cols`
+            ts_id (str): The column with the unique id of a time series
+            missing_config (MissingValueConfig, optional): Instance of the MissingValueConfig object
+                defining how to fill missing values. Defaults to None.
+            target_transformer (object, optional): Instance of target transformers from src.transforms. In the
+                "local" mode, a copy is fit for every time series. Defaults to None.
+            mode (str, optional): "global" trains one model on all the time series and "local" trains a model
+                per time series. Defaults to "global".
+            categorical (bool, optional): Include the categorical and boolean features, as in `get_X_y`. Defaults to False.
+            exogenous (bool, optional): Include the exogenous features, as in `get_X_y`. Defaults to False.
+        """
+        assert (
+            mode in ALLOWED_BATCH_MODES
+        ), f"`mode` should be one of {ALLOWED_BATCH_MODES}"
+        assert (
+            ts_id in feature_config.index_cols
+        ), "`ts_id` should be one of the `index_cols` of the feature_config"
+        assert not (
+            model_config.fill_missing and missing_config is None
+        ), "`missing_config` cannot be None if `fill_missing` is True"
+        self.model_config = model_config
+        self.feature_config = feature_config
+        self.ts_id = ts_id
+        self.missing_config = missing_config
+        self.target_transformer = target_transformer
+        self.mode = mode
+        self.categorical = categorical
+        self.exogenous = exogenous
+        # The missing values (and in the local mode the encoding and scaling) are handled once for the panel
+        self._model_config = replace(
+            model_config,
+            fill_missing=False,
+            normalize=model_config.normalize and mode == "global",
+            encode_categorical=model_config.encode_categorical and mode == "global",
+        )
+        self.models = {}
+
+    def _get_X_y(self, df: pd.DataFrame, fit: bool = False):
+        X, y, y_orig = self.feature_config.get_X_y(
+            df, categorical=self.categorical, exogenous=self.exogenous
+        )
+        if self.model_config.fill_missing:
+            if fit:
+                self._imputation_plan = self.missing_config.fit(X, ts_id=self.ts_id)
+            X = self._imputation_plan.transform(X)
+        y = y[self.feature_config.target] if y is not None else None
+        y_orig = (
+            y_orig[self.feature_config.original_target] if y_orig is not None else None
+        )
+        return X, y, y_orig
+
+    def _get_groups(self, X: pd.DataFrame):
+        """Returns the ids, the order which sorts the rows by the id and the offsets of every id in the sorted order"""
+        codes, ids = pd.factorize(X.index.get_level_values(self.ts_id), sort=False)
+        order = np.argsort(codes, kind="stable")
+        offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(codes, minlength=len(ids)))]
+        )
+        return ids, order, offsets
+
+    def _encode_and_scale(
+        self, X: pd.DataFrame, y: pd.Series, ids, order, offsets, fit: bool
+    ):
+        """Encodes the categorical features with a single encoder and standardizes the continuous features of every
+        time series with its own mean and standard deviation (sorted order)"""
+        if self.model_config.encode_categorical:
+            encoder = self.model_config.categorical_encoder
+            X = encoder.fit_transform(X, y) if fit else encoder.transform(X)
+        if self.model_config.normalize:
+            cols = [
+                c for c in self.feature_config.continuous_features if c in X.columns
+            ]
+            if self.model_config.encode_categorical:
+                # The columns created by the encoder, as in MLForecast
+                cols += [
+                    c
+                    for c in X.columns
+                    if c
+                    not in self.feature_config.continuous_features
+                    + self.feature_config.boolean_features
+                ]
+            values = X[cols].values.astype("float64")[order]
+            codes = np.repeat(np.arange(len(ids)), np.diff(offsets))
+            if fit:
+                counts = np.diff(offsets)[:, None]
+                mean = np.add.reduceat(values, offsets[:-1], axis=0) / counts
+                # Centered before squaring, as the mean of the squares minus the squared mean cancels out for
+                # features which are large compared to their spread
+                var = (
+                    np.add.reduceat((values - mean[codes]) ** 2, offsets[:-1], axis=0)
+                    / counts
+                )
+                # Constant features are left as they are, like StandardScaler does. The variance of a constant
+                # feature is only as small as the rounding error of its mean, which is allowed for as well
+                eps = np.finfo(np.float64).eps
+                is_constant = var <= counts * eps * var + (counts * mean * eps) ** 2
+                scale = np.sqrt(var)
+                scale[is_constant] = 1
+                self._scale_cols = cols
+                self._scale_stats = (
+                    pd.DataFrame(mean, index=ids, columns=cols),
+                    pd.DataFrame(scale, index=ids, columns=cols),
+                )
+            mean = self._scale_stats[0].reindex(ids).values
+            scale = self._scale_stats[1].reindex(ids).values
+            scaled = (values - mean[codes]) / scale[codes]
+            unsorted = np.empty_like(scaled)
+            unsorted[order] = scaled
+            X = X.copy()
+            X[cols] = unsorted
+        return X
+
+    def fit(self, df: pd.DataFrame, fit_kwargs: Dict = {}):
+        """Preprocesses the panel once and trains the global model or a model per time series
+
+        Args:
+            df (pd.DataFrame): The panel in the long format with the features and the target
+            fit_kwargs (Dict, optional): The dictionary with keyword args to be passed to the
+                fit funciton of the model. Defaults to {}.
+        """
+        X, y, _ = self._get_X_y(df, fit=True)
+        assert (
+            y is not None
+        ), f"`{self.feature_config.target}` should be present in the dataframe"
+        if self.mode == "global":
+            self.models = {
+                None: MLForecast(
+                    self._model_config,
+                    self.feature_config,
+                    target_transformer=self.target_transformer,
+                ).fit(X, y, fit_kwargs=fit_kwargs)
+            }
+            return self
+        ids, order, offsets = self._get_groups(X)
+        X = self._encode_and_scale(X, y, ids, order, offsets, fit=True)
+        X, y = X.iloc[order], y.iloc[order]
+        self.models = {}
+        for i, _id in enumerate(tqdm(ids, desc="Training local models...")):
+            rows = slice(offsets[i], offsets[i + 1])
+            self.models[_id] = MLForecast(
+                self._model_config,
+                self.feature_config,
+                target_transformer=copy.deepcopy(self.target_transformer),
+            ).fit(X.iloc[rows], y.iloc[rows], fit_kwargs=fit_kwargs)
+        return self
+
+    def predict(self, df: pd.DataFrame) -> pd.Series:
+        """Predicts all the time series of the panel
+
+        Args:
+            df (pd.DataFrame): The panel in the long format with the features
+
+        Returns:
+            pd.Series: predictions indexed by the `index_cols`, in the order of `df`. Time series without a
+                trained local model are predicted as NaN
+        """
+        X, _, _ = self._get_X_y(df)
+        return self._predict(X)
+
+    def _predict(self, X: pd.DataFrame) -> pd.Series:
+        name = f"{self.model_config.name}"
+        if self.mode == "global":
+            y_pred = self.models[None].predict(X)
+            y_pred.name = name
+            return y_pred
+        ids, order, offsets = self._get_groups(X)
+        X = self._encode_and_scale(X, None, ids, order, offsets, fit=False).iloc[order]
+        sorted_pred = np.full(len(X), np.nan)
+        missing_ids = []
+        for i, _id in enumerate(ids):
+            if _id not in self.models:
+                missing_ids.append(_id)
+                continue
+            rows = slice(offsets[i], offsets[i + 1])
+            sorted_pred[rows] = self.models[_id].predict(X.iloc[rows]).values
+        if len(missing_ids) > 0:
+            warnings.warn(
+                f"These time series do not have a trained model and are predicted as NaN: {missing_ids}"
+            )
+        y_pred = np.empty_like(sorted_pred)
+        y_pred[order] = sorted_pred
+        return pd.Series(
+            y_pred, index=X.index[np.argsort(order, kind="stable")], name=name
+        )
+
+    def evaluate(self, df: pd.DataFrame, train_df: pd.DataFrame = None):
+        """Predicts all the time series of the panel and calculates the metrics of every time series
+
+        Args:
+            df (pd.DataFrame): The panel in the long format with the features and the original target
+            train_df (pd.DataFrame, optional): The training panel, whose original target is used to calculate
+                MASE. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The actuals and predictions of all the time series indexed by the `index_cols`, with the
+                metrics of the time series of every row alongside. `groupby(level=ts_id).first()` gives the
+                metrics one row per time series
+        """
+        X, _, y_orig = self._get_X_y(df)
+        assert (
+            y_orig is not None
+        ), f"`{self.feature_config.original_target}` should be present in the dataframe"
+        y_pred = self._predict(X)
+        pred_df = pd.DataFrame({"actual": y_orig, y_pred.name: y_pred})
+        y_train = (
+            None
+            if train_df is None
+            else self.feature_config.get_X_y(train_df)[2][
+                self.feature_config.original_target
+            ]
+        )
+        metrics = []
+        for _id, rows in tqdm(
+            pred_df.groupby(level=self.ts_id, sort=False), desc="Calculating metrics..."
+        ):
+            rows = rows.droplevel(self.ts_id)
+            history = (
+                None
+                if y_train is None
+                or _id not in y_train.index.get_level_values(self.ts_id)
+                else y_train.xs(_id, level=self.ts_id)
+            )
+            metrics.append(
+                {
+                    self.ts_id: _id,
+                    **calculate_metrics(
+                        rows["actual"],
+                        rows[y_pred.name],
+                        name=y_pred.name,
+                        y_train=history,
+                    ),
+                }
+            )
+        metrics = pd.DataFrame(metrics).set_index(self.ts_id)
+        return pred_df.join(metrics, on=self.ts_id)
+
+
 def calculate_metrics(
     y: pd.Series, y_pred: pd.Series, name: str, y_train: pd.Series = None
 ):
@@ -383,6 +1326,11 @@ def calculate_metrics(
     Returns:
         Dict: Dictionary with MAE, MSE, MASE, and Forecast Bias
     """
+    # darts is imported only here, so that the rest of the module does not need it
+    from darts.metrics import mae, mase, mse
+
+    from src.utils.ts_utils import darts_metrics_adapter, forecast_bias
+
     return {
         "Algorithm": name,
         "MAE": darts_metrics_adapter(mae, actual_series=y, pred_series=y_pred),
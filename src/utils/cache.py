@@ -0,0 +1,421 @@
+"""Content addressed on-disk cache for the expensive preprocessing steps
+
+A cached function is keyed by the hash of its name, its code and its arguments. The code is the source of the
+module the function is defined in and of the modules of its package it imports, directly or through the other
+modules, so that a change to a helper or a compiled kernel invalidates the entries as well. Paths to files are
+hashed by their size and modification time, and arrays and dataframes by their contents, so that the
+cache is invalidated when the inputs or the code change. The outputs are stored in the cache directory,
+dataframes as parquet, arrays as npz and anything else as a pickle, and the least recently used entries
+are evicted when the cache grows over its size limit.
+
+    cache = DiskCache("cache", max_size=10 * 2**30)
+    compact_to_expanded = cache(compact_to_expanded)
+    # or
+    @cache(ignore=["verbose"])
+    def preprocess(df, ...):
+        ...
+    cache.report()
+
+The preprocessing entry points of `src.utils.data_utils` and `src.feature_engineering` (the .ts and .tsf readers,
+`compact_to_expanded`, `add_lags`, `add_rolling_features` etc.) are decorated with `cache_preprocessing` and
+are cached in the cache set with `set_preprocessing_cache`. Until one is set, they are called as they are.
+
+    set_preprocessing_cache(DiskCache("cache"))
+
+A cache hit returns the stored output without calling the function, so any change the function makes to its
+arguments in place does not happen. Only functions which leave their arguments as they are should be cached,
+and functions with an `inplace` argument are refused. For that reason, `add_temporal_features` and
+`add_fourier_features`, which add the features to the dataframe passed in, are not cached.
+"""
+
+import dataclasses
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+import types
+import uuid
+import warnings
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+import humanize
+import numpy as np
+import pandas as pd
+
+
+def _update_hash(hasher, obj) -> None:
+    """Updates the hash with the contents of the object"""
+    if obj is None or isinstance(obj, (bool, int, float, complex, bytes)):
+        hasher.update(repr(obj).encode())
+    elif isinstance(obj, (str, Path)):
+        hasher.update(str(obj).encode())
+        if os.path.isfile(obj):
+            # Files are hashed by their metadata instead of their contents
+            stat = os.stat(obj)
+            hasher.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        elif os.path.isdir(obj):
+            for path in sorted(Path(obj).rglob("*")):
+                if path.is_file():
+                    stat = path.stat()
+                    hasher.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    elif isinstance(obj, np.ndarray):
+        hasher.update(f"ndarray:{obj.dtype.str}:{obj.shape}".encode())
+        if obj.dtype == object:
+            for x in obj.ravel():
+                _update_hash(hasher, x)
+        else:
+            hasher.update(np.ascontiguousarray(obj).view(np.uint8).data)
+    elif isinstance(obj, pd.DataFrame):
+        hasher.update(b"DataFrame")
+        _update_hash(hasher, obj.index)
+        for col in obj.columns:
+            _update_hash(hasher, col)
+            _update_hash(hasher, obj[col])
+    elif isinstance(obj, (pd.Series, pd.Index)):
+        hasher.update(f"{type(obj).__name__}:{obj.dtype}:{obj.name}".encode())
+        try:
+            hashed = pd.util.hash_pandas_object(obj, index=False)
+            hasher.update(np.ascontiguousarray(hashed.values).view(np.uint8).data)
+        except TypeError:
+            # Unhashable values, like the arrays of a dataframe in the compact form
+            _update_hash(hasher, np.asarray(obj, dtype=object))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        hasher.update(f"{type(obj).__name__}:{len(obj)}".encode())
+        for x in sorted(obj, key=repr) if isinstance(obj, (set, frozenset)) else obj:
+            _update_hash(hasher, x)
+    elif isinstance(obj, dict):
+        hasher.update(f"dict:{len(obj)}".encode())
+        for key in sorted(obj, key=repr):
+            _update_hash(hasher, key)
+            _update_hash(hasher, obj[key])
+    elif dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        hasher.update(type(obj).__qualname__.encode())
+        _update_hash(hasher, dataclasses.asdict(obj))
+    elif callable(obj) and hasattr(obj, "__qualname__"):
+        hasher.update(f"{obj.__module__}.{obj.__qualname__}".encode())
+    else:
+        try:
+            hasher.update(pickle.dumps(obj, protocol=4))
+        except Exception:
+            warnings.warn(
+                f"Could not hash an argument of type {type(obj)}. Using its repr, which may not capture its contents"
+            )
+            hasher.update(repr(obj).encode())
+
+
+def _get_source(func: Callable) -> str:
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return ""
+
+
+def _get_module_dependencies(module: types.ModuleType) -> List[types.ModuleType]:
+    """The module and the modules of the same top level package it imports, directly or through the others"""
+    package = module.__name__.split(".")[0]
+    seen, stack = {module.__name__: module}, [module]
+    while len(stack) > 0:
+        for obj in vars(stack.pop()).values():
+            name = (
+                obj.__name__
+                if isinstance(obj, types.ModuleType)
+                else getattr(obj, "__module__", None)
+            )
+            if (
+                isinstance(name, str)
+                and name.split(".")[0] == package
+                and name not in seen
+                and name in sys.modules
+            ):
+                seen[name] = sys.modules[name]
+                stack.append(sys.modules[name])
+    return [seen[name] for name in sorted(seen)]
+
+
+def _get_code_fingerprint(func: Callable) -> str:
+    """Hashes the source of the function and of the modules it depends on. See `_get_module_dependencies`"""
+    hasher = hashlib.blake2b(digest_size=16)
+    _update_hash(hasher, _get_source(func))
+    module = sys.modules.get(func.__module__)
+    if module is not None:
+        for dependency in _get_module_dependencies(module):
+            path = getattr(dependency, "__file__", None)
+            hasher.update(dependency.__name__.encode())
+            if path is not None and path.endswith(".py") and os.path.isfile(path):
+                # The file itself rather than `inspect.getsource`, whose line cache can be out of date
+                with open(path, "rb") as f:
+                    hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def _save_part(obj, path: Path) -> str:
+    """Saves a part of the output and returns the format it was saved in"""
+    if isinstance(obj, pd.DataFrame):
+        try:
+            obj.to_parquet(path.with_suffix(".parquet"))
+            return "parquet"
+        except Exception:
+            # Column names which are not strings or values parquet cannot store
+            path.with_suffix(".parquet").unlink(missing_ok=True)
+    elif isinstance(obj, np.ndarray) and obj.dtype != object:
+        np.savez(path.with_suffix(".npz"), values=obj)
+        return "npz"
+    with open(path.with_suffix(".pkl"), "wb") as f:
+        pickle.dump(obj, f, protocol=4)
+    return "pickle"
+
+
+def _load_part(path: Path, part_format: str):
+    if part_format == "parquet":
+        return pd.read_parquet(path.with_suffix(".parquet"))
+    if part_format == "npz":
+        with np.load(path.with_suffix(".npz"), allow_pickle=False) as f:
+            return f["values"]
+    with open(path.with_suffix(".pkl"), "rb") as f:
+        return pickle.load(f)
+
+
+def _get_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+class DiskCache:
+    def __init__(
+        self, cache_dir: Union[str, Path] = ".cache", max_size: int = 10 * 2**30
+    ) -> None:
+        """An on-disk cache for the outputs of functions, keyed by the contents of their inputs
+
+        Args:
+            cache_dir (Union[str, Path], optional): The directory in which the outputs are stored. Defaults to ".cache".
+            max_size (int, optional): The maximum size of the cache in bytes. The least recently used entries are
+                evicted when it is exceeded. Defaults to 10 GB.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        # The bytes stored in the cache, scanned once and then kept up to date with the entries saved and evicted
+        self._stored_bytes = None
+
+    def __call__(self, func: Callable = None, *, ignore: List[str] = None):
+        """Wraps the function so that its outputs are cached. Can be used as `cache(func)`, `@cache` or
+        `@cache(ignore=[...])`
+
+        Args:
+            func (Callable, optional): The function to be cached
+            ignore (List[str], optional): Arguments which do not change the output and are left out of the key,
+                for eg. `verbose` or `n_jobs`. Defaults to None.
+
+        Returns:
+            Callable: The cached function
+        """
+        if func is None:
+            return functools.partial(self.__call__, ignore=ignore)
+        ignore = [] if ignore is None else ignore
+        name = f"{func.__module__}.{func.__qualname__}"
+        fingerprint = _get_code_fingerprint(func)
+        signature = inspect.signature(func)
+        assert (
+            "inplace" not in signature.parameters
+        ), f"{name} can modify its arguments in place, which a cache hit would skip. It cannot be cached"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            hasher = hashlib.blake2b(digest_size=16)
+            _update_hash(hasher, name)
+            _update_hash(hasher, fingerprint)
+            _update_hash(
+                hasher,
+                {k: v for k, v in bound.arguments.items() if k not in ignore},
+            )
+            key = hasher.hexdigest()
+            entry = self.cache_dir / key
+            if (entry / "meta.json").exists():
+                try:
+                    output = self._load(entry)
+                    self.hits[name] += 1
+                    return output
+                except Exception as e:
+                    warnings.warn(f"Could not read the cache entry {key}: {e}. Recomputing")
+                    shutil.rmtree(entry, ignore_errors=True)
+                    self._stored_bytes = None
+            self.misses[name] += 1
+            output = func(*args, **kwargs)
+            self._save(entry, name, output)
+            self._evict(_get_size(entry))
+            return output
+
+        wrapper.cache = self
+        return wrapper
+
+    def _save(self, entry: Path, name: str, output) -> None:
+        # Writing to a temporary directory and renaming it, so that a failed write never leaves a partial entry
+        tmp_entry = self.cache_dir / f".tmp-{uuid.uuid4().hex}"
+        tmp_entry.mkdir()
+        try:
+            is_tuple = isinstance(output, tuple)
+            parts = output if is_tuple else (output,)
+            meta = {
+                "function": name,
+                "is_tuple": is_tuple,
+                "formats": [
+                    _save_part(part, tmp_entry / f"part-{i}") for i, part in enumerate(parts)
+                ],
+            }
+            with open(tmp_entry / "meta.json", "w") as f:
+                json.dump(meta, f)
+            if entry.exists():
+                shutil.rmtree(entry)
+            os.replace(tmp_entry, entry)
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def _load(self, entry: Path):
+        with open(entry / "meta.json", "r") as f:
+            meta = json.load(f)
+        parts = tuple(
+            _load_part(entry / f"part-{i}", part_format)
+            for i, part_format in enumerate(meta["formats"])
+        )
+        # The modification time of meta.json is the last access time used for eviction
+        os.utime(entry / "meta.json")
+        return parts if meta["is_tuple"] else parts[0]
+
+    def _get_entries(self) -> pd.DataFrame:
+        entries = [p for p in self.cache_dir.iterdir() if (p / "meta.json").exists()]
+        functions = []
+        for entry in entries:
+            with open(entry / "meta.json", "r") as f:
+                functions.append(json.load(f)["function"])
+        return pd.DataFrame(
+            {
+                "entry": entries,
+                "function": functions,
+                "last_access": [(p / "meta.json").stat().st_mtime for p in entries],
+                "bytes": [_get_size(p) for p in entries],
+            },
+            columns=["entry", "function", "last_access", "bytes"],
+        )
+
+    def _evict(self, added_bytes: int) -> None:
+        """Deletes the least recently used entries till the cache fits in `max_size`. The entries are scanned only
+        when the bytes stored go over `max_size`, and not on every save
+
+        Args:
+            added_bytes (int): The size of the entry which was just saved
+        """
+        if self.max_size is None:
+            return
+        if self._stored_bytes is None:
+            # The first scan counts the entry which was just saved as well
+            self._stored_bytes = self.size
+        else:
+            self._stored_bytes += added_bytes
+        if self._stored_bytes <= self.max_size:
+            return
+        # Scanning all the entries, which also counts the ones other processes have saved
+        entries = self._get_entries().sort_values("last_access", ascending=False)
+        if len(entries) == 0:
+            self._stored_bytes = 0
+            return
+        total = entries["bytes"].cumsum()
+        evict = (total > self.max_size).values
+        # Always keeping the most recent entry, even if it is larger than max_size
+        evict[0] = False
+        for entry in entries["entry"][evict]:
+            shutil.rmtree(entry, ignore_errors=True)
+        self._stored_bytes = int(entries["bytes"][~evict].sum())
+        if total.iloc[0] > self.max_size:
+            warnings.warn(
+                f"The output of {entries['function'].iloc[0]} is larger than the cache size ({humanize.naturalsize(self.max_size)})"
+            )
+
+    @property
+    def size(self) -> int:
+        """The total size of the cache in bytes"""
+        return int(self._get_entries()["bytes"].sum())
+
+    def report(self) -> pd.DataFrame:
+        """Returns the hits, misses and the size on disk of every cached function"""
+        entries = self._get_entries()
+        functions = sorted(
+            set(self.hits) | set(self.misses) | set(entries["function"])
+        )
+        sizes = entries.groupby("function")["bytes"].sum()
+        return pd.DataFrame(
+            {
+                "function": functions,
+                "hits": [self.hits[f] for f in functions],
+                "misses": [self.misses[f] for f in functions],
+                "entries": [int((entries["function"] == f).sum()) for f in functions],
+                "size": [humanize.naturalsize(sizes.get(f, 0)) for f in functions],
+            },
+            columns=["function", "hits", "misses", "entries", "size"],
+        )
+
+    def clear(self) -> None:
+        """Deletes all the entries in the cache"""
+        for entry in self._get_entries()["entry"]:
+            shutil.rmtree(entry, ignore_errors=True)
+        self._stored_bytes = 0
+        self.hits.clear()
+        self.misses.clear()
+
+
+# The cache of the preprocessing entry points. None disables the caching
+_preprocessing_cache = None
+
+
+def set_preprocessing_cache(cache: Optional[DiskCache]) -> None:
+    """Sets the cache of the preprocessing functions decorated with `cache_preprocessing`
+
+    Args:
+        cache (Optional[DiskCache]): The cache to be used. None disables the caching
+    """
+    global _preprocessing_cache
+    _preprocessing_cache = cache
+
+
+def get_preprocessing_cache() -> Optional[DiskCache]:
+    """Returns the cache of the preprocessing functions, None if the caching is disabled"""
+    return _preprocessing_cache
+
+
+def cache_preprocessing(func: Callable = None, *, ignore: List[str] = None):
+    """Caches the preprocessing function in the cache set with `set_preprocessing_cache`. While no cache is set, the
+    function is called as it is, without hashing its inputs. Used as `@cache_preprocessing` or
+    `@cache_preprocessing(ignore=[...])`
+
+    Args:
+        func (Callable, optional): The function to be cached
+        ignore (List[str], optional): Arguments which do not change the output. See `DiskCache.__call__`.
+            Defaults to None.
+
+    Returns:
+        Callable: The function which is cached once a cache is set
+    """
+    if func is None:
+        return functools.partial(cache_preprocessing, ignore=ignore)
+    # The function wrapped by the current cache, wrapped again only when the cache is changed
+    wrapped = {}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = _preprocessing_cache
+        if cache is None:
+            return func(*args, **kwargs)
+        if cache not in wrapped:
+            wrapped.clear()
+            wrapped[cache] = cache(func, ignore=ignore)
+        return wrapped[cache](*args, **kwargs)
+
+    return wrapper
@@ -1,164 +1,240 @@
+import json
+import sys
 import warnings
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
 import distutils
+import humanize
 import pandas as pd
 from tqdm.autonotebook import tqdm
 import numpy as np
 from pandas.api.types import is_datetime64_any_dtype as is_datetime
+from pandas.api.types import is_list_like, is_numeric_dtype
 
-# https://github.com/rakshitha123/TSForecasting/blob/master/utils/data_loader.py
-# Converts the contents in a .tsf file into a dataframe and returns it along with other meta-data of the dataset: frequency, horizon, whether the dataset contains missing values and whether the series have equal lengths
-#
-# Parameters
-# full_file_path_and_name - complete .tsf file path
-# replace_missing_vals_with - a term to indicate the missing values in series in the returning dataframe
-# value_column_name - Any name that is preferred to have as the name of the column containing series values in the returning dataframe
-def convert_monash_tsf_to_dataframe(
-    full_file_path_and_name,
-    replace_missing_vals_with="NaN",
-    value_column_name="series_value",
-):
-    col_names = []
-    col_types = []
-    all_data = {}
-    line_count = 0
-    frequency = None
-    forecast_horizon = None
-    contain_missing_values = None
-    contain_equal_length = None
-    found_data_tag = False
-    found_data_section = False
-    started_reading_data_section = False
+from src.utils.cache import cache_preprocessing
+from src.utils.general import _get_n_jobs
 
-    with open(full_file_path_and_name, "r", encoding="cp1252") as file:
-        for line in file:
-            # Strip white space from start/end of line
-            line = line.strip()
 
-            if line:
-                if line.startswith("@"):  # Read meta-data
-                    if not line.startswith("@data"):
-                        line_content = line.split(" ")
-                        if line.startswith("@attribute"):
-                            if (
-                                len(line_content) != 3
-                            ):  # Attributes have both name and type
-                                raise Exception("Invalid meta-data specification.")
+class MonashTsfReader:
+    def __init__(
+        self,
+        full_file_path_and_name: str,
+        value_column_name: str = "series_value",
+        encoding: str = "cp1252",
+    ) -> None:
+        """Streaming reader for the .tsf files of the Monash Forecasting Repository.
 
-                            col_names.append(line_content[1])
-                            col_types.append(line_content[2])
-                        else:
-                            if (
-                                len(line_content) != 2
-                            ):  # Other meta-data have only values
-                                raise Exception("Invalid meta-data specification.")
-
-                            if line.startswith("@frequency"):
-                                frequency = line_content[1]
-                            elif line.startswith("@horizon"):
-                                forecast_horizon = int(line_content[1])
-                            elif line.startswith("@missing"):
-                                contain_missing_values = bool(
-                                    distutils.util.strtobool(line_content[1])
-                                )
-                            elif line.startswith("@equallength"):
-                                contain_equal_length = bool(
-                                    distutils.util.strtobool(line_content[1])
-                                )
+        The meta-data (attributes, frequency, horizon, etc.) is read on initialization. The series are
+        read one line at a time when iterating, so the memory used does not grow with the size of the
+        file. Each series is parsed in a single vectorized call on its comma separated payload.
 
-                    else:
-                        if len(col_names) == 0:
-                            raise Exception(
-                                "Missing attribute section. Attribute section must come before data."
-                            )
+        Args:
+            full_file_path_and_name (str): complete .tsf file path
+            value_column_name (str, optional): Any name that is preferred to have as the name of the column
+                containing series values. Defaults to "series_value".
+            encoding (str, optional): encoding of the text file. Defaults to "cp1252".
+        """
+        self.full_file_path_and_name = full_file_path_and_name
+        self.value_column_name = value_column_name
+        self.encoding = encoding
+        self.frequency = None
+        self.forecast_horizon = None
+        self.contain_missing_values = None
+        self.contain_equal_length = None
+        with open(full_file_path_and_name, "r", encoding=encoding) as file:
+            self._read_header(file)
 
-                        found_data_tag = True
-                elif not line.startswith("#"):
-                    if len(col_names) == 0:
+    def _read_header(self, file) -> None:
+        """Reads the meta-data and leaves the file at the line after the @data tag"""
+        self.col_names = []
+        self.col_types = []
+        line_count = 0
+        for line in file:
+            # Strip white space from start/end of line
+            line = line.strip()
+            if not line:
+                continue
+            line_count = line_count + 1
+            if line.startswith("@"):  # Read meta-data
+                if line.startswith("@data"):
+                    if len(self.col_names) == 0:
                         raise Exception(
                             "Missing attribute section. Attribute section must come before data."
                         )
-                    elif not found_data_tag:
-                        raise Exception("Missing @data tag.")
-                    else:
-                        if not started_reading_data_section:
-                            started_reading_data_section = True
-                            found_data_section = True
-                            all_series = []
-
-                            for col in col_names:
-                                all_data[col] = []
+                    return
+                line_content = line.split(" ")
+                if line.startswith("@attribute"):
+                    if len(line_content) != 3:  # Attributes have both name and type
+                        raise Exception("Invalid meta-data specification.")
+                    self.col_names.append(line_content[1])
+                    self.col_types.append(line_content[2])
+                else:
+                    if len(line_content) != 2:  # Other meta-data have only values
+                        raise Exception("Invalid meta-data specification.")
+                    if line.startswith("@frequency"):
+                        self.frequency = line_content[1]
+                    elif line.startswith("@horizon"):
+                        self.forecast_horizon = int(line_content[1])
+                    elif line.startswith("@missing"):
+                        self.contain_missing_values = bool(
+                            distutils.util.strtobool(line_content[1])
+                        )
+                    elif line.startswith("@equallength"):
+                        self.contain_equal_length = bool(
+                            distutils.util.strtobool(line_content[1])
+                        )
+            elif not line.startswith("#"):
+                if len(self.col_names) == 0:
+                    raise Exception(
+                        "Missing attribute section. Attribute section must come before data."
+                    )
+                raise Exception("Missing @data tag.")
+        if line_count == 0:
+            raise Exception("Empty file.")
+        if len(self.col_names) == 0:
+            raise Exception("Missing attribute section.")
+        raise Exception("Missing series information under data section.")
 
-                        full_info = line.split(":")
+    def _parse_attribute(self, value: str, col_type: str):
+        if col_type == "numeric":
+            return int(value)
+        elif col_type == "string":
+            return str(value)
+        elif col_type == "date":
+            return datetime.strptime(value, "%Y-%m-%d %H-%M-%S")
+        # Currently, the code supports only numeric, string and date types. Extend this as required.
+        raise Exception("Invalid attribute type.")
 
-                        if len(full_info) != (len(col_names) + 1):
-                            raise Exception("Missing attributes/values in series.")
+    def _parse_series(self, payload: str) -> np.ndarray:
+        """Parses the comma separated values in one call. Missing values (?) are returned as NaN"""
+        n_values = payload.count(",") + 1
+        values = np.fromstring(payload.replace("?", "nan"), sep=",", dtype=np.float64)
+        if len(values) != n_values:
+            raise Exception(
+                "A given series should contains a set of comma separated numeric values. At least one numeric value should be there in a series. Missing values should be indicated with ? symbol"
+            )
+        if np.isnan(values).all():
+            raise Exception(
+                "All series values are missing. A given series should contains a set of comma separated numeric values. At least one numeric value should be there in a series."
+            )
+        return values
 
-                        series = full_info[len(full_info) - 1]
-                        series = series.split(",")
+    def __iter__(self) -> Iterator[Tuple[Dict, np.ndarray]]:
+        """Yields the attributes of every series as a dict along with its values as a float64 array"""
+        found_data_section = False
+        n_cols = len(self.col_names)
+        with open(self.full_file_path_and_name, "r", encoding=self.encoding) as file:
+            self._read_header(file)
+            for line in file:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                found_data_section = True
+                # The attributes are before the first n_cols `:` and the values after them
+                full_info = line.split(":", n_cols)
+                if len(full_info) != n_cols + 1 or ":" in full_info[-1]:
+                    raise Exception("Missing attributes/values in series.")
+                attributes = {
+                    col: self._parse_attribute(value, col_type)
+                    for col, col_type, value in zip(
+                        self.col_names, self.col_types, full_info[:-1]
+                    )
+                }
+                yield attributes, self._parse_series(full_info[-1])
+        if not found_data_section:
+            raise Exception("Missing series information under data section.")
 
-                        if len(series) == 0:
-                            raise Exception(
-                                "A given series should contains a set of comma separated numeric values. At least one numeric value should be there in a series. Missing values should be indicated with ? symbol"
-                            )
+    def iter_batches(self, batch_size: int = 1000) -> Iterator[pd.DataFrame]:
+        """Yields the series in batches of dataframes, with a row per series and the values as arrays in
+        `value_column_name`
 
-                        numeric_series = []
+        Args:
+            batch_size (int, optional): Number of series in a batch. Defaults to 1000.
+        """
+        batch = defaultdict(list)
+        for attributes, values in self:
+            for col, value in attributes.items():
+                batch[col].append(value)
+            batch[self.value_column_name].append(values)
+            if len(batch[self.value_column_name]) == batch_size:
+                yield pd.DataFrame(batch)
+                batch = defaultdict(list)
+        if len(batch) > 0:
+            yield pd.DataFrame(batch)
 
-                        for val in series:
-                            if val == "?":
-                                numeric_series.append(replace_missing_vals_with)
-                            else:
-                                numeric_series.append(float(val))
+    def to_parquet(self, path: str, batch_size: int = 1000) -> None:
+        """Writes the series straight to a parquet file, one row group per batch, without loading the
+        whole file. The values are stored as a list<double> column and the attributes as columns.
 
-                        if numeric_series.count(replace_missing_vals_with) == len(
-                            numeric_series
-                        ):
-                            raise Exception(
-                                "All series values are missing. A given series should contains a set of comma separated numeric values. At least one numeric value should be there in a series."
-                            )
+        Args:
+            path (str): The path of the parquet file
+            batch_size (int, optional): Number of series in a row group. Defaults to 1000.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
 
-                        all_series.append(pd.Series(numeric_series).array)
-
-                        for i in range(len(col_names)):
-                            att_val = None
-                            if col_types[i] == "numeric":
-                                att_val = int(full_info[i])
-                            elif col_types[i] == "string":
-                                att_val = str(full_info[i])
-                            elif col_types[i] == "date":
-                                att_val = datetime.strptime(
-                                    full_info[i], "%Y-%m-%d %H-%M-%S"
-                                )
-                            else:
-                                raise Exception(
-                                    "Invalid attribute type."
-                                )  # Currently, the code supports only numeric, string and date types. Extend this as required.
-
-                            if att_val == None:
-                                raise Exception("Invalid attribute value.")
-                            else:
-                                all_data[col_names[i]].append(att_val)
-
-                line_count = line_count + 1
+        arrow_types = {"numeric": pa.int64(), "string": pa.string(), "date": pa.timestamp("us")}
+        schema = pa.schema(
+            [
+                (col, arrow_types[col_type])
+                for col, col_type in zip(self.col_names, self.col_types)
+            ]
+            + [(self.value_column_name, pa.list_(pa.float64()))]
+        )
+        with pq.ParquetWriter(path, schema) as writer:
+            for batch in self.iter_batches(batch_size):
+                values = batch[self.value_column_name]
+                offsets = np.concatenate([[0], np.cumsum(values.apply(len))])
+                arrays = [
+                    pa.array(batch[col], type=schema.field(col).type)
+                    for col in self.col_names
+                ]
+                # One concatenated buffer with the offsets instead of a list per series
+                arrays.append(
+                    pa.ListArray.from_arrays(
+                        pa.array(offsets, type=pa.int32()),
+                        pa.array(np.concatenate(values.tolist())),
+                    )
+                )
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
 
-        if line_count == 0:
-            raise Exception("Empty file.")
-        if len(col_names) == 0:
-            raise Exception("Missing attribute section.")
-        if not found_data_section:
-            raise Exception("Missing series information under data section.")
 
-        all_data[value_column_name] = all_series
-        loaded_data = pd.DataFrame(all_data)
+# https://github.com/rakshitha123/TSForecasting/blob/master/utils/data_loader.py
+# Converts the contents in a .tsf file into a dataframe and returns it along with other meta-data of the dataset: frequency, horizon, whether the dataset contains missing values and whether the series have equal lengths
+#
+# Parameters
+# full_file_path_and_name - complete .tsf file path
+# replace_missing_vals_with - a term to indicate the missing values in series in the returning dataframe
+# value_column_name - Any name that is preferred to have as the name of the column containing series values in the returning dataframe
+@cache_preprocessing
+def convert_monash_tsf_to_dataframe(
+    full_file_path_and_name,
+    replace_missing_vals_with="NaN",
+    value_column_name="series_value",
+):
+    # For large files, use `MonashTsfReader` to iterate over the series or write them to parquet
+    reader = MonashTsfReader(full_file_path_and_name, value_column_name)
+    all_data = defaultdict(list)
+    for attributes, values in reader:
+        for col, value in attributes.items():
+            all_data[col].append(value)
+        missing = np.isnan(values)
+        if missing.any():
+            values = values.astype(object)
+            values[missing] = replace_missing_vals_with
+        all_data[value_column_name].append(pd.Series(values).array)
+    loaded_data = pd.DataFrame(all_data)
 
-        return (
-            loaded_data,
-            frequency,
-            forecast_horizon,
-            contain_missing_values,
-            contain_equal_length,
-        )
+    return (
+        loaded_data,
+        reader.frequency,
+        reader.forecast_horizon,
+        reader.contain_missing_values,
+        reader.contain_equal_length,
+    )
 
 
 def tsf_row_to_df(row, frequency):
@@ -176,6 +252,58 @@ def tsf_row_to_df(row, frequency):
     return df
 
 
+ALLOWED_TS_COMPRESSIONS = [None, "gzip", "zstd"]
+
+
+def _open_ts_file(filename: str, mode: str, encoding: str, compression: str = None):
+    """Opens a .ts file in text mode, optionally compressed with gzip or zstd"""
+    assert (
+        compression in ALLOWED_TS_COMPRESSIONS
+    ), f"`compression` should be one of {ALLOWED_TS_COMPRESSIONS}"
+    if compression == "gzip":
+        import gzip
+
+        return gzip.open(filename, mode + "t", encoding=encoding)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "`zstandard` is needed for zstd compression. Install it with `pip install zstandard`"
+            )
+        return zstandard.open(filename, mode + "t", encoding=encoding)
+    return open(filename, mode, encoding=encoding)
+
+
+def _format_ts_column(column: pd.Series, date_format: str) -> list:
+    """Formats every cell of a column of the compact dataframe as it is written in the .ts file"""
+    if is_datetime(column):
+        # NaT is formatted as NaN, and written as "NaT" like `str` does
+        return column.dt.strftime(date_format).where(column.notna(), "NaT").tolist()
+    values = column.values
+    if len(values) > 0 and all(isinstance(x, np.ndarray) for x in values):
+        if len(set(x.dtype for x in values)) > 1:
+            return ["|".join(x.astype(str)) for x in values]
+        # Converting all the arrays of the chunk to strings in one go and joining the slices of every array
+        strings = np.concatenate(values).astype(str).tolist()
+        offsets = np.concatenate([[0], np.cumsum([len(x) for x in values])]).tolist()
+        return [
+            "|".join(strings[start:end]) for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+    return [
+        x.strftime(date_format)
+        if isinstance(x, pd.Timestamp)
+        else ("|".join(x.astype(str)) if isinstance(x, np.ndarray) else str(x))
+        for x in values
+    ]
+
+
+def _format_ts_chunk(chunk: pd.DataFrame, sep: str, date_format: str) -> str:
+    """Formats a chunk of the compact dataframe into the lines of the .ts file"""
+    columns = [_format_ts_column(chunk[c], date_format) for c in chunk.columns]
+    return "".join(sep.join(row) + sep + "\n" for row in zip(*columns))
+
+
 def write_compact_to_ts(
     df: pd.DataFrame,
     filename: str,
@@ -185,9 +313,15 @@ def write_compact_to_ts(
     encoding: str = "utf-8",
     date_format: str = "%Y-%m-%d %H-%M-%S",
     chunk_size: int = 50,
+    n_jobs: int = 1,
+    compression: str = None,
 ):
     """Writes a dataframe in the compact form to disk
 
+    The dataframe is formatted in chunks of `chunk_size` time series. The arrays of a column are converted to
+    strings together for the whole chunk, and the chunks are formatted in `n_jobs` worker processes and written
+    to the file in order.
+
     Args:
         df (pd.DataFrame): The dataframe in compact form
         filename (str): Filename to which the dataframe should be written to
@@ -197,6 +331,9 @@ def write_compact_to_ts(
         encoding (str, optional): encoding of the text file. Defaults to "utf-8".
         date_format (str, optional): Format in which datetime shud be written out in text file. Defaults to "%Y-%m-%d %H-%M-%S".
         chunk_size (int, optional): Chunk size while writing files to disk. Defaults to 50.
+        n_jobs (int, optional): Number of processes which format the chunks. -1 uses all the cores. Defaults to 1.
+        compression (str, optional): Compress the file with "gzip" or "zstd". zstd needs the `zstandard` package.
+            Defaults to None.
 
     Returns:
         None
@@ -205,7 +342,12 @@ def write_compact_to_ts(
         warnings.warn(
             "Using `:` as separator will not work well if `:` is present in the string representation of date time."
         )
-    with open(filename, "w", encoding=encoding) as f:
+    n_jobs = _get_n_jobs(n_jobs)
+    chunks = (
+        df.iloc[start : start + chunk_size] for start in range(0, len(df), chunk_size)
+    )
+    n_chunks = -(-len(df) // chunk_size)
+    with _open_ts_file(filename, "w", encoding, compression) as f:
         for c, dtype in df.dtypes.items():
             if c in static_columns:
                 typ = "static"
@@ -215,36 +357,50 @@ def write_compact_to_ts(
             f.write("\n")
         f.write(f"@data")
         f.write("\n")
+        if n_jobs == 1 or n_chunks < 2:
+            for chunk in tqdm(chunks, total=n_chunks, desc="Writing in Chunks..."):
+                f.write(_format_ts_chunk(chunk, sep, date_format))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                # Keeping at most 2 chunks per worker in flight, so that the formatted chunks
+                # waiting to be written do not pile up in memory
+                pending = deque()
+                for chunk in tqdm(chunks, total=n_chunks, desc="Writing in Chunks..."):
+                    pending.append(
+                        executor.submit(_format_ts_chunk, chunk, sep, date_format)
+                    )
+                    if len(pending) >= 2 * n_jobs:
+                        f.write(pending.popleft().result())
+                while pending:
+                    f.write(pending.popleft().result())
 
-        def write_ts(x):
-            l = ""
-            for c in x.index:
-                if isinstance(x[c], np.ndarray):
-                    l += "|".join(x[c].astype(str))
-                    l += sep
-                elif isinstance(x[c], pd.Timestamp):
-                    l += x[c].strftime(date_format)
-                    l += sep
-                else:
-                    l += str(x[c])
-                    l += sep
-            l += "\n"
-            return l
-
-        [
-            f.writelines([write_ts(x.loc[i]) for i in tqdm(x.index)])
-            for x in tqdm(
-                np.split(df, np.arange(chunk_size, len(df), chunk_size)),
-                desc="Writing in Chunks...",
-            )
-        ]
 
+def _read_ts_header(file) -> Tuple[list, list, list]:
+    """Reads the @column lines of a .ts file up to the @data tag, leaving the file at the first data line
+
+    Returns:
+        Tuple[list, list, list]: The names, dtypes and meta types (static or time_varying) of the columns
+    """
+    col_names, col_types, col_meta_types = [], [], []
+    for line in file:
+        line = line.strip()
+        if line.startswith("@data"):
+            break
+        if line.startswith("@column"):
+            _, col, typ, meta_typ = line.split(" ")
+            col_names.append(col)
+            col_types.append(typ)
+            col_meta_types.append(meta_typ)
+    return col_names, col_types, col_meta_types
 
+
+@cache_preprocessing
 def read_ts_to_compact(
     filename: str,
     sep: str = ";",
     encoding: str = "utf-8",
     date_format: str = "%Y-%m-%d %H-%M-%S",
+    compression: str = None,
 ) -> pd.DataFrame:
     """Reads a .ts file from disk to a dataframe in the compact form
 
@@ -253,6 +409,7 @@ def read_ts_to_compact(
         sep (str, optional): Separator which is used in the .ts file. Defaults to ";".
         encoding (str, optional): encoding of the text file. Defaults to "utf-8".
         date_format (str, optional): Format in which datetime shud be written out in text file. Defaults to "%Y-%m-%d %H-%M-%S".
+        compression (str, optional): "gzip" or "zstd" if the file was written compressed. Defaults to None.
 
     Returns:
         pd.DataFrame: The dataframe in the compact form
@@ -265,7 +422,7 @@ def read_ts_to_compact(
     found_data_section = False
     started_reading_data_section = False
 
-    with open(filename, "r", encoding=encoding) as file:
+    with _open_ts_file(filename, "r", encoding, compression) as file:
         for line in tqdm(file):
             # Strip white space from start/end of line
             line = line.strip()
@@ -346,29 +503,581 @@ def read_ts_to_compact(
     return df
 
 
+def _get_time_varying_buffer(arrays: list) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenates the arrays of a time varying column into a single buffer along with the offsets"""
+    lengths = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=len(arrays))
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    values = (
+        np.concatenate([np.asarray(a) for a in arrays])
+        if len(arrays) > 0
+        else np.empty(0)
+    )
+    return values, offsets
+
+
+def _load_static_column(path: Path, i: int, column: Dict) -> pd.Series:
+    """Loads a static column written by `write_compact_to_binary`, with its missing values"""
+    values = np.load(path / f"{i}_static.npy", allow_pickle=False)
+    if column.get("has_missing", False):
+        values = values.astype(object)
+        values[np.load(path / f"{i}_missing.npy", allow_pickle=False)] = None
+    return pd.Series(values).astype(column["dtype"])
+
+
+def write_compact_to_binary(
+    df: pd.DataFrame,
+    path: str,
+    static_columns: list,
+    time_varying_columns: list,
+):
+    """Writes a dataframe in the compact form to disk in a binary columnar layout
+
+    `path` is a directory with a `schema.json` and a .npy file per array. A static column is stored as a
+    single array with a value per time series. A time varying column is stored as one buffer with the arrays
+    of all the time series concatenated, along with an `offsets` array where the array of the i-th time series is
+    `values[offsets[i]:offsets[i+1]]`. Time varying columns with strings are dictionary encoded into integer codes
+    and the unique strings. Static columns with strings are stored as strings, and their missing values as a
+    separate mask.
+
+    Args:
+        df (pd.DataFrame): The dataframe in compact form
+        path (str): The directory to which the dataframe should be written to
+        static_columns (list): List of column names of static features
+        time_varying_columns (list): List of column names of time varying columns
+
+    Returns:
+        None
+    """
+    columns = [c for c in df.columns if c in static_columns + time_varying_columns]
+    missing_columns = set(static_columns + time_varying_columns) - set(columns)
+    assert (
+        len(missing_columns) == 0
+    ), f"These columns are not present in the dataframe: {missing_columns}"
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    schema = {"version": 1, "n_rows": len(df), "columns": []}
+    for i, c in enumerate(columns):
+        column = {"name": c, "dtype": df[c].dtype.name}
+        if c in static_columns:
+            column["meta_type"] = "static"
+            values = df[c].values
+            if not (is_datetime(df[c]) or is_numeric_dtype(df[c])):
+                # `astype(str)` would store the missing values as "None" or "nan"
+                missing = df[c].isnull().values
+                values = df[c].astype(str).values.astype(str)
+                if missing.any():
+                    np.save(path / f"{i}_missing.npy", missing, allow_pickle=False)
+                    column["has_missing"] = True
+            np.save(path / f"{i}_static.npy", np.asarray(values), allow_pickle=False)
+        else:
+            column["meta_type"] = "time_varying"
+            values, offsets = _get_time_varying_buffer(df[c].tolist())
+            if values.dtype.kind in "OUS":
+                # Dictionary encoding the strings, which repeat a lot across time
+                categories, values = np.unique(values.astype(str), return_inverse=True)
+                values = values.astype(_get_narrowest_int_dtype(0, len(categories)))
+                np.save(path / f"{i}_categories.npy", categories, allow_pickle=False)
+                column["encoding"] = "dictionary"
+            else:
+                column["encoding"] = "raw"
+            np.save(path / f"{i}_values.npy", values, allow_pickle=False)
+            np.save(path / f"{i}_offsets.npy", offsets, allow_pickle=False)
+        schema["columns"].append(column)
+    with open(path / "schema.json", "w") as f:
+        json.dump(schema, f, indent=4)
+
+
+def read_binary_to_compact(path: str, mmap_mode: str = None) -> pd.DataFrame:
+    """Reads a directory written by `write_compact_to_binary` to a dataframe in the compact form
+
+    The arrays of a time varying column are views into the single buffer of the column, so reading does not
+    copy the values once per time series.
+
+    Args:
+        path (str): The directory to be read
+        mmap_mode (str, optional): If not None, the buffers of the time varying columns are memory mapped with this
+            mode (see `np.load`) instead of being read, and the arrays are views into the memory map. Use
+            `CompactStore` to access single series without building the dataframe. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The dataframe in the compact form
+    """
+    path = Path(path)
+    with open(path / "schema.json", "r") as f:
+        schema = json.load(f)
+    all_data = {}
+    for i, column in enumerate(schema["columns"]):
+        if column["meta_type"] == "static":
+            all_data[column["name"]] = _load_static_column(path, i, column)
+        else:
+            values = np.load(
+                path / f"{i}_values.npy", mmap_mode=mmap_mode, allow_pickle=False
+            )
+            offsets = np.load(path / f"{i}_offsets.npy", allow_pickle=False)
+            if column["encoding"] == "dictionary":
+                categories = np.load(path / f"{i}_categories.npy", allow_pickle=False)
+                values = categories[values]
+            arrays = np.empty(schema["n_rows"], dtype=object)
+            for j, array in enumerate(np.split(values, offsets[1:-1])):
+                arrays[j] = array
+            all_data[column["name"]] = arrays
+    return pd.DataFrame(all_data)
+
+
+class CompactStore:
+    def __init__(self, path: str, id_column: str = None) -> None:
+        """Memory mapped access to the time series of a directory written by `write_compact_to_binary`
+
+        The buffers of the time varying columns are opened with `np.memmap`, so nothing is read until a series
+        is accessed and the pages are shared through the OS page cache by all the processes which open the same
+        store. The array of a series is a zero-copy view into the buffer. Dictionary encoded (string) columns
+        are decoded on access, which is a copy. The static columns are small and are loaded in `static`.
+
+        Pickling the store only pickles the path, so it can be sent to worker processes, which open their own
+        memory map of the same files.
+
+        Args:
+            path (str): The directory written by `write_compact_to_binary`
+            id_column (str, optional): The static column with the unique id of the time series, which is used
+                to select the series. If None, the series are selected by their position. Defaults to None.
+        """
+        self.path = Path(path)
+        self.id_column = id_column
+        with open(self.path / "schema.json", "r") as f:
+            self.schema = json.load(f)
+        static_data = {}
+        self._values, self._offsets, self._categories = {}, {}, {}
+        for i, column in enumerate(self.schema["columns"]):
+            name = column["name"]
+            if column["meta_type"] == "static":
+                static_data[name] = _load_static_column(self.path, i, column)
+            else:
+                self._values[name] = np.load(
+                    self.path / f"{i}_values.npy", mmap_mode="r", allow_pickle=False
+                )
+                # The offsets are small and are read on every access, so they are kept in memory
+                self._offsets[name] = np.load(
+                    self.path / f"{i}_offsets.npy", allow_pickle=False
+                )
+                if column["encoding"] == "dictionary":
+                    self._categories[name] = np.load(
+                        self.path / f"{i}_categories.npy", allow_pickle=False
+                    )
+        # A row per series even if there are no static columns
+        self.static = pd.DataFrame(
+            static_data, index=pd.RangeIndex(self.schema["n_rows"])
+        )
+        self.time_varying_columns = list(self._values.keys())
+        if id_column is not None:
+            assert (
+                id_column in self.static.columns
+            ), "`id_column` should be one of the static columns"
+            self._index = pd.Index(self.static[id_column])
+            assert self._index.is_unique, "`id_column` should be unique for every series"
+        else:
+            self._index = None
+
+    def __len__(self) -> int:
+        return self.schema["n_rows"]
+
+    def __reduce__(self):
+        return (self.__class__, (str(self.path), self.id_column))
+
+    def _get_position(self, ts_id) -> int:
+        if self._index is not None:
+            return self._index.get_loc(ts_id)
+        # Negative positions count from the end, like a list
+        n_rows = len(self)
+        if not -n_rows <= ts_id < n_rows:
+            raise IndexError(
+                f"Position {ts_id} is out of range for a store of {n_rows} series"
+            )
+        return ts_id % n_rows
+
+    def _get_series_at(self, i: int, column: str) -> np.ndarray:
+        offsets = self._offsets[column]
+        values = self._values[column][offsets[i] : offsets[i + 1]]
+        if column in self._categories:
+            return self._categories[column][values]
+        return values
+
+    def get_series(self, ts_id, column: str) -> np.ndarray:
+        """Returns the array of a time varying column for a time series
+
+        Args:
+            ts_id: The id of the time series in `id_column`, or the position if `id_column` is None. Negative
+                positions count from the end
+            column (str): The time varying column
+
+        Returns:
+            np.ndarray: A read only view into the memory mapped buffer (a decoded copy for string columns)
+        """
+        return self._get_series_at(self._get_position(ts_id), column)
+
+    def __getitem__(self, ts_id) -> Dict:
+        """Returns the static values and the arrays of all the time varying columns of a time series"""
+        i = self._get_position(ts_id)
+        series = self.static.iloc[i].to_dict()
+        for column in self.time_varying_columns:
+            series[column] = self._get_series_at(i, column)
+        return series
+
+    def to_compact(self) -> pd.DataFrame:
+        """Returns the dataframe in the compact form with the arrays as views into the memory mapped buffers"""
+        all_data = self.static.to_dict("series")
+        for column in self.time_varying_columns:
+            arrays = np.empty(len(self), dtype=object)
+            for i in range(len(self)):
+                arrays[i] = self._get_series_at(i, column)
+            all_data[column] = arrays
+        # Keeping the column order of the file
+        return pd.DataFrame(all_data)[[c["name"] for c in self.schema["columns"]]]
+
+
+def _get_ts_compression(path: Path) -> str:
+    return {".gz": "gzip", ".zst": "zstd"}.get(path.suffix)
+
+
+def _is_compact_block(path: Path) -> bool:
+    """A block is a .ts file (optionally compressed) or a directory written by `write_compact_to_binary`"""
+    if path.is_dir():
+        return (path / "schema.json").exists()
+    return path.name.endswith((".ts", ".ts.gz", ".ts.zst"))
+
+
+class CompactDataset:
+    def __init__(
+        self,
+        path: str,
+        id_column: str,
+        max_cached_blocks: int = 4,
+        sep: str = ";",
+        encoding: str = "utf-8",
+        date_format: str = "%Y-%m-%d %H-%M-%S",
+    ) -> None:
+        """Lazy access to the time series in a directory of compact blocks, like the merged blocks of the
+        London Smart Meters dataset
+
+        A block is either a .ts file written by `write_compact_to_ts` (.ts.gz and .ts.zst are read compressed) or
+        a directory written by `write_compact_to_binary`. On creation, only the static columns of every block are
+        read, which builds the index of `id_column` to the block and the offset of the series within the block
+        (`index`). The time varying arrays of a block are decoded when one of its series is first accessed, and
+        the last `max_cached_blocks` decoded blocks are kept in memory.
+
+        Filters on the static columns are applied to the index before any block is read, so only the blocks
+        with at least one selected series are decoded.
+
+        Args:
+            path (str): The directory with the blocks
+            id_column (str): The static column with the unique id of the time series, for eg. LCLid
+            max_cached_blocks (int, optional): Number of decoded blocks which are kept in memory. Defaults to 4.
+            sep (str, optional): Separator which is used in the .ts files. Defaults to ";".
+            encoding (str, optional): encoding of the .ts files. Defaults to "utf-8".
+            date_format (str, optional): Format in which datetime is written in the .ts files. Defaults to "%Y-%m-%d %H-%M-%S".
+        """
+        assert max_cached_blocks >= 1, "`max_cached_blocks` should be at least 1"
+        self.path = Path(path)
+        self.id_column = id_column
+        self.max_cached_blocks = max_cached_blocks
+        self.sep = sep
+        self.encoding = encoding
+        self.date_format = date_format
+        self.blocks = sorted(p for p in self.path.iterdir() if _is_compact_block(p))
+        assert len(self.blocks) > 0, f"No .ts files or binary blocks found in {path}"
+        index = []
+        for i, block in enumerate(tqdm(self.blocks, desc="Indexing blocks...")):
+            static = self._read_static(block)
+            static["block"] = i
+            static["offset"] = np.arange(len(static))
+            index.append(static)
+        index = pd.concat(index, ignore_index=True)
+        assert (
+            id_column in index.columns
+        ), "`id_column` should be one of the static columns"
+        self.index = index.set_index(id_column)
+        assert self.index.index.is_unique, "`id_column` should be unique for every series"
+        self.static_columns = [
+            c for c in self.index.columns if c not in ["block", "offset"]
+        ]
+        self._cache = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, ts_id) -> bool:
+        return ts_id in self.index.index
+
+    def _read_static(self, block: Path) -> pd.DataFrame:
+        """Reads only the static columns of a block"""
+        if block.is_dir():
+            return CompactStore(block).static
+        with _open_ts_file(
+            block, "r", self.encoding, _get_ts_compression(block)
+        ) as file:
+            col_names, col_types, col_meta_types = _read_ts_header(file)
+            static_positions = [
+                i for i, meta_typ in enumerate(col_meta_types) if meta_typ == "static"
+            ]
+            all_data = defaultdict(list)
+            n_rows = 0
+            for line in file:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                n_rows += 1
+                if len(static_positions) == 0:
+                    continue
+                # Not splitting the arrays of the time varying columns after the last static column
+                full_info = line.split(self.sep, static_positions[-1] + 1)
+                for i in static_positions:
+                    all_data[col_names[i]].append(full_info[i])
+        static = pd.DataFrame(
+            all_data,
+            columns=[col_names[i] for i in static_positions],
+            index=pd.RangeIndex(n_rows),
+        )
+        for i in static_positions:
+            col, typ = col_names[i], col_types[i]
+            if np.issubdtype(typ, np.datetime64):
+                static[col] = pd.to_datetime(static[col], format=self.date_format)
+            static[col] = static[col].astype(typ)
+        return static
+
+    def _get_block(self, i: int) -> pd.DataFrame:
+        """Returns the decoded block from the cache, reading it if it is not cached"""
+        if i in self._cache:
+            self._cache.move_to_end(i)
+            return self._cache[i]
+        block = self.blocks[i]
+        if block.is_dir():
+            df = read_binary_to_compact(block, mmap_mode="r")
+        else:
+            df = read_ts_to_compact(
+                block,
+                sep=self.sep,
+                encoding=self.encoding,
+                date_format=self.date_format,
+                compression=_get_ts_compression(block),
+            )
+        self._cache[i] = df
+        if len(self._cache) > self.max_cached_blocks:
+            self._cache.popitem(last=False)
+        return df
+
+    def select(self, filters: Dict = None) -> pd.Index:
+        """Returns the ids of the time series which match the filters on the static columns
+
+        Args:
+            filters (Dict, optional): Mapping of a static column to the value, or a list of values, to be selected,
+                for eg. {"Acorn_grouped": ["Affluent", "Comfortable"], "stdorToU": "Std"}. All the filters
+                should match. If None, all the series are selected. Defaults to None.
+
+        Returns:
+            pd.Index: The ids of the selected time series
+        """
+        if filters is None:
+            return self.index.index
+        mask = np.ones(len(self.index), dtype=bool)
+        for col, value in filters.items():
+            assert (
+                col in self.static_columns
+            ), f"Filters can only be applied to the static columns: {self.static_columns}"
+            values = value if is_list_like(value) else [value]
+            mask &= self.index[col].isin(values).values
+        return self.index.index[mask]
+
+    def iter_blocks(self, ts_ids: list = None, filters: Dict = None) -> Iterator[pd.DataFrame]:
+        """Yields the selected time series in the compact form, a block at a time, in the order of the blocks
+
+        Args:
+            ts_ids (list, optional): The ids of the time series to be loaded. If None, all the series which match
+                `filters` are loaded. Defaults to None.
+            filters (Dict, optional): Filters on the static columns, as in `select`. Defaults to None.
+        """
+        selected = self.index.loc[self.select(filters)]
+        if ts_ids is not None:
+            missing = pd.Index(ts_ids).difference(self.index.index)
+            assert len(missing) == 0, f"These ids are not present in the dataset: {list(missing)}"
+            selected = selected.loc[selected.index.isin(ts_ids)]
+        for i, rows in selected.groupby("block", sort=True):
+            df = self._get_block(i)
+            yield df.iloc[rows["offset"].values].reset_index(drop=True)
+
+    def load(self, ts_ids: list = None, filters: Dict = None) -> pd.DataFrame:
+        """Loads the selected time series in the compact form
+
+        Args:
+            ts_ids (list, optional): The ids of the time series to be loaded. If None, all the series which match
+                `filters` are loaded. Defaults to None.
+            filters (Dict, optional): Filters on the static columns, as in `select`. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The dataframe in the compact form, in the order of the blocks
+        """
+        blocks = list(self.iter_blocks(ts_ids, filters))
+        if len(blocks) == 0:
+            return self._get_block(0).iloc[:0]
+        return pd.concat(blocks, ignore_index=True)
+
+    def get_series(self, ts_id) -> pd.Series:
+        """Returns the static values and the time varying arrays of a time series
+
+        Args:
+            ts_id: The id of the time series in `id_column`
+
+        Returns:
+            pd.Series: The row of the time series in the compact form
+        """
+        block, offset = self.index.loc[ts_id, ["block", "offset"]]
+        return self._get_block(int(block)).iloc[offset]
+
+    def __getitem__(self, ts_id) -> pd.Series:
+        return self.get_series(ts_id)
+
+
+def convert_ts_to_binary(
+    filename: str,
+    path: str,
+    sep: str = ";",
+    encoding: str = "utf-8",
+    date_format: str = "%Y-%m-%d %H-%M-%S",
+):
+    """Converts a .ts file written by `write_compact_to_ts` to the binary layout of `write_compact_to_binary`
+
+    Args:
+        filename (str): The .ts file to be converted
+        path (str): The directory to which the binary layout should be written to
+        sep (str, optional): Separator which is used in the .ts file. Defaults to ";".
+        encoding (str, optional): encoding of the text file. Defaults to "utf-8".
+        date_format (str, optional): Format in which datetime is written in the .ts file. Defaults to "%Y-%m-%d %H-%M-%S".
+    """
+    with open(filename, "r", encoding=encoding) as file:
+        col_names, _, col_meta_types = _read_ts_header(file)
+    static_columns = [
+        c for c, meta_typ in zip(col_names, col_meta_types) if meta_typ == "static"
+    ]
+    time_varying_columns = [
+        c for c, meta_typ in zip(col_names, col_meta_types) if meta_typ != "static"
+    ]
+    df = read_ts_to_compact(filename, sep=sep, encoding=encoding, date_format=date_format)
+    write_compact_to_binary(df, path, static_columns, time_varying_columns)
+
+
+def convert_binary_to_ts(
+    path: str,
+    filename: str,
+    sep: str = ";",
+    encoding: str = "utf-8",
+    date_format: str = "%Y-%m-%d %H-%M-%S",
+    chunk_size: int = 50,
+):
+    """Converts a directory written by `write_compact_to_binary` to a .ts file
+
+    Args:
+        path (str): The directory with the binary layout
+        filename (str): Filename to which the .ts file should be written to
+        sep (str, optional): Separator with which the arrays are stored in the text file. Defaults to ";".
+        encoding (str, optional): encoding of the text file. Defaults to "utf-8".
+        date_format (str, optional): Format in which datetime shud be written out in text file. Defaults to "%Y-%m-%d %H-%M-%S".
+        chunk_size (int, optional): Chunk size while writing files to disk. Defaults to 50.
+    """
+    with open(Path(path) / "schema.json", "r") as f:
+        schema = json.load(f)
+    static_columns = [
+        c["name"] for c in schema["columns"] if c["meta_type"] == "static"
+    ]
+    time_varying_columns = [
+        c["name"] for c in schema["columns"] if c["meta_type"] == "time_varying"
+    ]
+    write_compact_to_ts(
+        read_binary_to_compact(path),
+        filename,
+        static_columns=static_columns,
+        time_varying_columns=time_varying_columns,
+        sep=sep,
+        encoding=encoding,
+        date_format=date_format,
+        chunk_size=chunk_size,
+    )
+
+
+def _get_expanded_timestamps(
+    start_timestamps: pd.Series, frequencies: pd.Series, lengths: np.ndarray
+) -> pd.Series:
+    """Creates the timestamps of all the series, one after the other, without a date_range per series
+    for fixed frequencies (30min, H, D, etc.)"""
+    n_rows = lengths.sum()
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    position = np.arange(n_rows, dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+    series_idx = np.repeat(np.arange(len(lengths)), lengths)
+    timestamps = np.empty(n_rows, dtype="datetime64[ns]")
+    start_values = pd.to_datetime(start_timestamps).values.astype("datetime64[ns]")
+    frequencies = frequencies.values
+    for freq in pd.unique(frequencies):
+        series_mask = frequencies == freq
+        row_mask = series_mask[series_idx]
+        offset = pd.tseries.frequencies.to_offset(freq)
+        if isinstance(offset, pd.tseries.offsets.Tick):
+            timestamps[row_mask] = start_values[series_idx[row_mask]] + position[
+                row_mask
+            ] * np.timedelta64(pd.Timedelta(offset).value, "ns")
+        else:
+            # Calendar frequencies like month start do not have a fixed step
+            timestamps[row_mask] = np.concatenate(
+                [
+                    pd.date_range(start=start, periods=length, freq=offset).values
+                    for start, length in zip(
+                        start_values[series_mask], lengths[series_mask]
+                    )
+                ]
+            )
+    return timestamps
+
+
+@cache_preprocessing
 def compact_to_expanded(
     df, timeseries_col, static_cols, time_varying_cols, ts_identifier
 ):
-    def preprocess_expanded(x):
-        ### Fill missing dates with NaN ###
-        # Create a date range from  start
-        dr = pd.date_range(
-            start=x["start_timestamp"],
-            periods=len(x["energy_consumption"]),
-            freq=x["frequency"],
-        )
-        df_columns = defaultdict(list)
-        df_columns["timestamp"] = dr
-        for col in [ts_identifier, timeseries_col] + static_cols + time_varying_cols:
-            df_columns[col] = x[col]
-        return pd.DataFrame(df_columns)
-
-    all_series = []
-    for i in tqdm(range(len(df))):
-        all_series.append(preprocess_expanded(df.iloc[i]))
-    df = pd.concat(all_series)
-    del all_series
-    return df
+    """Converts a dataframe in the compact form (a row per time series with the time varying columns as arrays)
+    to the expanded form (a row per time step)
+
+    The lengths are taken from `timeseries_col` and the timestamps are created from the `start_timestamp` and
+    `frequency` columns. The static columns are repeated and the arrays of the time varying columns are
+    concatenated once for all the series, and `ts_identifier` is returned as a categorical. The index is the
+    position of the row within its time series.
+
+    Args:
+        df (pd.DataFrame): The dataframe in the compact form
+        timeseries_col (str): The time varying column with the target
+        static_cols (List[str]): The static columns
+        time_varying_cols (List[str]): The other time varying columns
+        ts_identifier (str): The column with the unique id of a time series
+
+    Returns:
+        pd.DataFrame: The dataframe in the expanded form
+    """
+    lengths = np.fromiter(
+        (len(x) for x in df[timeseries_col]), dtype=np.int64, count=len(df)
+    )
+    df_columns = {}
+    df_columns["timestamp"] = _get_expanded_timestamps(
+        df["start_timestamp"], df["frequency"], lengths
+    )
+    ids = pd.Categorical(df[ts_identifier])
+    df_columns[ts_identifier] = pd.Categorical.from_codes(
+        np.repeat(ids.codes, lengths), categories=ids.categories
+    )
+    for col in [timeseries_col] + static_cols + time_varying_cols:
+        if col in static_cols:
+            df_columns[col] = np.repeat(df[col].values, lengths)
+        else:
+            df_columns[col] = (
+                np.concatenate(df[col].tolist()) if len(df) > 0 else np.empty(0)
+            )
+    position = np.arange(lengths.sum(), dtype=np.int64) - np.repeat(
+        np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths
+    )
+    return pd.DataFrame(df_columns, index=position)
 
 
 def add_freq(idx, freq=None):
@@ -395,14 +1104,197 @@ def add_freq(idx, freq=None):
 # block_df = read_ts_to_compact("D:\Playground\AdvancedTimeSeriesForecastingBook\Code Dev\data\london_smart_meters\preprocessed\london_smart_meters_merged_block_0-36.ts")
 
 
-def reduce_memory_footprint(df):
-    dtypes = df.dtypes
-    object_cols = dtypes[dtypes == "object"].index.tolist()
-    float_cols = dtypes[dtypes == "float64"].index.tolist()
-    int_cols = dtypes[dtypes == "int64"].index.tolist()
-    df[int_cols] = df[int_cols].astype("int32")
-    df[object_cols] = df[object_cols].astype("category")
-    df[float_cols] = df[float_cols].astype("float32")
+def _is_float_cast_within_tolerance(
+    values: np.ndarray, dtype: np.dtype, tolerance: float, chunk_size: int = 2**20
+) -> bool:
+    """Checks if casting the float values to dtype keeps every value within a relative tolerance.
+    Checked in chunks, so that the temporary arrays are small. Values which overflow to inf fail the check"""
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start : start + chunk_size]
+        with np.errstate(over="ignore", invalid="ignore"):
+            error = np.abs(chunk.astype(dtype).astype(chunk.dtype) - chunk)
+        # NaN compares as False, so NaN and inf which are kept as they are do not fail the check
+        if np.any(error > tolerance * np.abs(chunk)):
+            return False
+    return True
+
+
+def _get_object_memory_usage(x: pd.Series) -> Tuple[int, int]:
+    """Returns the number of unique values and the deep memory usage of an object column. The size of every unique
+    value is counted once per occurrence (as `memory_usage(deep=True)` does), which only measures the unique values.
+    Returns None as the number of unique values if the values are not hashable"""
+    try:
+        codes, uniques = pd.factorize(x.values)
+    except TypeError:
+        # Unhashable values, like the arrays of a dataframe in the compact form
+        return None, x.memory_usage(index=False, deep=True)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    sizes = np.fromiter(
+        (sys.getsizeof(u) for u in uniques), dtype=np.int64, count=len(uniques)
+    )
+    n_bytes = x.memory_usage(index=False) + int(counts @ sizes)
+    missing = codes < 0
+    if missing.any():
+        n_bytes += x[missing].memory_usage(index=False, deep=True) - x[
+            missing
+        ].memory_usage(index=False)
+    return len(uniques), n_bytes
+
+
+NULLABLE_NUMERIC_DTYPES = [
+    "Int8",
+    "Int16",
+    "Int32",
+    "Int64",
+    "UInt8",
+    "UInt16",
+    "UInt32",
+    "UInt64",
+    "Float32",
+    "Float64",
+]
+
+
+def _get_reduced_nullable_dtype(x: pd.Series, float_tolerance: float):
+    """Returns the narrowest nullable dtype for a nullable integer or float column, or None if it should be left
+    as it is. The missing values are kept as NA"""
+    if x.isna().all():
+        return None
+    if x.dtype.kind in "iu":
+        try:
+            narrow_dtype = _get_narrowest_int_dtype(x.min(), x.max())
+        except ValueError:
+            return None
+        # The nullable counterpart of the numpy dtype, for eg. Int8 for int8
+        return pd.api.types.pandas_dtype(narrow_dtype.name.capitalize())
+    if x.dtype.itemsize > 4 and _is_float_cast_within_tolerance(
+        x.to_numpy(dtype=np.float64, na_value=np.nan),
+        np.dtype("float32"),
+        float_tolerance,
+    ):
+        return pd.Float32Dtype()
+    return None
+
+
+def _get_reduced_dtype(
+    x: pd.Series, float_tolerance: float, max_cardinality_ratio: float, n_unique: int = None
+):
+    """Returns the narrowest dtype the column can be stored in, or None if it should be left as it is"""
+    dtype = x.dtype
+    if len(x) == 0:
+        return None
+    if pd.api.types.is_extension_array_dtype(dtype):
+        # Categoricals, strings, sparse arrays etc. are left as they are
+        if dtype.name in NULLABLE_NUMERIC_DTYPES:
+            return _get_reduced_nullable_dtype(x, float_tolerance)
+        return None
+    if dtype.kind in "iu":
+        try:
+            return _get_narrowest_int_dtype(x.min(), x.max())
+        except ValueError:
+            # uint64 values larger than the largest int64
+            return None
+    if dtype.kind == "f":
+        for redn_dtype in ["float16", "float32"]:
+            if np.dtype(redn_dtype).itemsize >= dtype.itemsize:
+                return None
+            if _is_float_cast_within_tolerance(
+                x.values, np.dtype(redn_dtype), float_tolerance
+            ):
+                return np.dtype(redn_dtype)
+        return None
+    if (
+        dtype == "object"
+        and n_unique is not None
+        and n_unique <= max_cardinality_ratio * len(x)
+    ):
+        return "category"
+    return None
+
+
+def reduce_memory_footprint(
+    df: pd.DataFrame,
+    float_tolerance: float = 1e-6,
+    max_cardinality_ratio: float = 0.5,
+    verbose: bool = False,
+    return_report: bool = False,
+):
+    """Reduces the memory of the dataframe in place by storing every column in the narrowest dtype which
+    holds its values
+
+    Integer columns are stored in the smallest integer dtype which holds their min and max. Float columns are
+    stored in float16 or float32 only if every value stays within a relative error of `float_tolerance` (the
+    default keeps float32, which has a relative error of ~6e-8, and rejects float16, which has ~5e-4). Object
+    columns are converted to categoricals if the number of unique values is at most `max_cardinality_ratio`
+    times the number of rows. Nullable integer and float columns (Int64, Float64 etc.) are stored in the
+    narrowest nullable dtype, keeping the missing values. The other columns are left as they are.
+
+    The columns are converted one at a time and every converted column is inserted in place of the original one
+    without copying the rest of the dataframe. pandas stores the columns of the same dtype together in a block,
+    which is released only when all of its columns are replaced, so the peak memory is the size of the dataframe
+    plus the reduced size of its largest block.
+
+    Args:
+        df (pd.DataFrame): The dataframe to be reduced
+        float_tolerance (float, optional): The maximum relative error allowed for a value of a float column when it
+            is downcast. Defaults to 1e-6.
+        max_cardinality_ratio (float, optional): The maximum ratio of unique values to rows for an object column to
+            be converted to a categorical. Defaults to 0.5.
+        verbose (bool, optional): Print the memory saved. Defaults to False.
+        return_report (bool, optional): Also return a report with the dtype and the bytes of every column before
+            and after. Defaults to False.
+
+    Returns:
+        Union[pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]: The same dataframe, reduced in place, and the report
+            if `return_report` is True
+    """
+    assert df.columns.is_unique, "The columns of the dataframe should be unique"
+    report = []
+    for col in df.columns:
+        x = df[col]
+        original_dtype = str(x.dtype)
+        if x.dtype == "object":
+            n_unique, bytes_before = _get_object_memory_usage(x)
+        else:
+            n_unique, bytes_before = None, x.memory_usage(index=False, deep=True)
+        redn_dtype = _get_reduced_dtype(
+            x, float_tolerance, max_cardinality_ratio, n_unique
+        )
+        if redn_dtype is not None and x.dtype != redn_dtype:
+            reduced = x.astype(redn_dtype)
+            del x
+            # Deleting slices the block of the column without a copy, unlike assigning to the column
+            loc = df.columns.get_loc(col)
+            del df[col]
+            with warnings.catch_warnings():
+                # Every inserted column is a block of its own
+                warnings.simplefilter("ignore", pd.errors.PerformanceWarning)
+                df.insert(loc, col, reduced)
+            del reduced
+            bytes_after = df[col].memory_usage(index=False, deep=True)
+        else:
+            bytes_after = bytes_before
+            del x
+        report.append(
+            {
+                "column": col,
+                "original_dtype": original_dtype,
+                "dtype": str(df[col].dtype),
+                "bytes_before": bytes_before,
+                "bytes_after": bytes_after,
+            }
+        )
+    report = pd.DataFrame(
+        report,
+        columns=["column", "original_dtype", "dtype", "bytes_before", "bytes_after"],
+    )
+    if verbose:
+        saved = report["bytes_before"].sum() - report["bytes_after"].sum()
+        print(
+            f"Memory reduced from {humanize.naturalsize(report['bytes_before'].sum())} to {humanize.naturalsize(report['bytes_after'].sum())}, saving {humanize.naturalsize(saved)}"
+        )
+    if return_report:
+        return df, report
     return df
 
 
@@ -417,6 +1309,15 @@ def _get_32_bit_dtype(x):
     return redn_dtype
 
 
+def _get_narrowest_int_dtype(min_value, max_value):
+    """Returns the smallest signed integer dtype which can hold all values between min_value and max_value"""
+    for dtype in ["int8", "int16", "int32", "int64"]:
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return np.dtype(dtype)
+    raise ValueError(f"{min_value} and {max_value} do not fit in a 64 bit integer")
+
+
 def replace_array_in_dataframe(df, X, keep_columns=True, keep_index=True):
     return pd.DataFrame(
         X,
@@ -1,3 +1,4 @@
+import os
 import time
 import humanize
 
@@ -29,4 +30,11 @@ def difference_list(list1, list2):
     return list(set(list1)- set(list2))
 
 def union_list(list1, list2):
-    return list(set(list1).union(set(list2)))
\ No newline at end of file
+    return list(set(list1).union(set(list2)))
+
+def _get_n_jobs(n_jobs: int) -> int:
+    """Resolves negative n_jobs like joblib, -1 being all the cores"""
+    assert n_jobs != 0, "`n_jobs` should be a positive integer or a negative integer"
+    if n_jobs < 0:
+        n_jobs = max(os.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
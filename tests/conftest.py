@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules are imported as `src.<package>` from the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_panel(
+    n_series=20,
+    length=200,
+    nan_frac=0.05,
+    nan_id_frac=0.0,
+    equal_lengths=False,
+    seed=0,
+):
+    """A panel in the long format with `ts_id`, `time` and `y` columns. The time series have different lengths
+    (from `length // 2` to `length`) unless `equal_lengths`, `y` has `nan_frac` missing values and `ts_id` has
+    `nan_id_frac` of them. The rows of the time series are interleaved, with the time order kept within every
+    time series"""
+    rng = np.random.default_rng(seed)
+    lengths = (
+        np.full(n_series, length)
+        if equal_lengths
+        else rng.integers(length // 2, length + 1, n_series)
+    )
+    df = pd.DataFrame(
+        {
+            "ts_id": np.repeat([f"id_{i}" for i in range(n_series)], lengths).astype(
+                object
+            ),
+            "time": np.concatenate([np.arange(n) for n in lengths]),
+        }
+    )
+    df["y"] = rng.normal(10, 3, len(df))
+    df.loc[rng.random(len(df)) < nan_frac, "y"] = np.nan
+    df.loc[rng.random(len(df)) < nan_id_frac, "ts_id"] = None
+    return df.sample(frac=1, random_state=seed).sort_values("time", kind="stable")
+
+
+@pytest.fixture
+def panel(request):
+    """The panel of `make_panel`, with its keyword args given by indirect parametrization, for eg.
+    `@pytest.mark.parametrize("panel", [{"nan_frac": 0.1}], indirect=True)`"""
+    return make_panel(**getattr(request, "param", {}))
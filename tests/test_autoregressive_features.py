@@ -0,0 +1,148 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_engineering.autoregressive_features import (
+    SEASONAL_ROLLING_MAP,
+    add_ewma,
+    add_lags,
+    add_rolling_features,
+    add_seasonal_rolling_features,
+)
+
+
+# The rows of the time series are interleaved and some have a missing ts_id
+@pytest.mark.parametrize("panel", [{"nan_id_frac": 0.05}], indirect=True)
+@pytest.mark.parametrize("n_jobs", [1, 2])
+@pytest.mark.parametrize("use_32_bit", [False, True])
+def test_lags_match_groupby_shift(panel, use_32_bit, n_jobs):
+    df = panel
+    lags = [1, 3, 7]
+    lagged, features = add_lags(
+        df, lags, "y", ts_id="ts_id", use_32_bit=use_32_bit, n_jobs=n_jobs
+    )
+    assert features == [f"y_lag_{l}" for l in lags]
+    pd.testing.assert_frame_equal(lagged[df.columns], df)
+    for l in lags:
+        expected = df.groupby("ts_id")["y"].shift(l)
+        if use_32_bit:
+            expected = expected.astype(np.float32)
+        pd.testing.assert_series_equal(
+            lagged[f"y_lag_{l}"], expected.rename(f"y_lag_{l}")
+        )
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_rolling_features_match_pandas(panel, n_jobs):
+    df = panel
+    rolls, agg_funcs = [1, 3, 7], ["mean", "std", "min", "max"]
+    df, features = add_rolling_features(
+        df, rolls, "y", agg_funcs=agg_funcs, ts_id="ts_id", n_shift=2, n_jobs=n_jobs
+    )
+    shifted = df.groupby("ts_id")["y"].shift(2)
+    for l in rolls:
+        for agg in agg_funcs:
+            expected = (
+                shifted.groupby(df["ts_id"]).rolling(l).agg(agg).droplevel(0)
+            ).reindex(df.index)
+            np.testing.assert_allclose(
+                df[f"y_rolling_{l}_{agg}"].values, expected.values, rtol=1e-9, atol=1e-9
+            )
+
+
+def test_rolling_features_long_trending_series():
+    # Running sums over the whole series cancel catastrophically here, and so does the rolling
+    # variance of pandas<2. So the reference is the exact two pass computation on every window
+    n = 200_000
+    y = 1e6 + 1.24 * np.arange(n)
+    df, _ = add_rolling_features(
+        pd.DataFrame({"y": y}), [3, 30], "y", agg_funcs=["mean", "std"]
+    )
+    for l in [3, 30]:
+        windows = np.lib.stride_tricks.sliding_window_view(y[:-1], l)
+        np.testing.assert_allclose(
+            df[f"y_rolling_{l}_mean"].values[l:], windows.mean(axis=1), rtol=1e-12
+        )
+        np.testing.assert_allclose(
+            df[f"y_rolling_{l}_std"].values[l:], windows.std(axis=1, ddof=1), rtol=1e-6
+        )
+        assert np.isnan(df[f"y_rolling_{l}_std"].values[:l]).all()
+
+
+@pytest.mark.parametrize("panel", [{"nan_id_frac": 0.05}], indirect=True)
+def test_seasonal_rolling_features_match_baseline(panel):
+    df = panel
+    seasonal_periods, rolls = [7, 24], [2, 3]
+    agg_funcs = ["mean", "std", "min", "max"]
+    df, features = add_seasonal_rolling_features(
+        df, seasonal_periods, rolls, "y", agg_funcs=agg_funcs, ts_id="ts_id", n_shift=2
+    )
+    # The original implementation, a window_ops call per time series and feature
+    for sp in seasonal_periods:
+        for agg in agg_funcs:
+            for l in rolls:
+                expected = df.groupby("ts_id")["y"].transform(
+                    lambda x: SEASONAL_ROLLING_MAP[agg](
+                        x.shift(2 * sp).values, season_length=sp, window_size=l
+                    )
+                )
+                np.testing.assert_allclose(
+                    df[f"y_{sp}_seasonal_rolling_{l}_{agg}"].values,
+                    expected.values,
+                    rtol=1e-9,
+                    atol=1e-9,
+                )
+    assert len(features) == len(seasonal_periods) * len(rolls) * len(agg_funcs)
+
+
+def test_seasonal_rolling_features_warn_once():
+    df = pd.DataFrame({"y": np.arange(100.0)})
+    with warnings.catch_warnings(record=True) as record:
+        warnings.simplefilter("always")
+        add_seasonal_rolling_features(df, [7, 12, 24], [2], "y")
+    assert len(record) == 1
+
+
+@pytest.mark.parametrize("panel", [{"nan_frac": 0.1}], indirect=True)
+@pytest.mark.parametrize("n_jobs", [1, 2])
+@pytest.mark.parametrize("use_spans", [False, True])
+def test_ewma_matches_pandas(panel, use_spans, n_jobs):
+    df = panel
+    params = [2, 7.5, 30] if use_spans else [0.1, 0.5, 0.9]
+    df, features = add_ewma(
+        df,
+        "y",
+        alphas=None if use_spans else params,
+        spans=params if use_spans else None,
+        ts_id="ts_id",
+        n_shift=3,
+        n_jobs=n_jobs,
+    )
+    shifted = df.groupby("ts_id")["y"].shift(3)
+    for param, feature in zip(params, features):
+        expected = shifted.groupby(df["ts_id"]).transform(
+            lambda x: x.ewm(
+                **{"span" if use_spans else "alpha": param}, adjust=False
+            ).mean()
+        )
+        np.testing.assert_allclose(df[feature].values, expected.values, rtol=1e-12)
+
+
+@pytest.mark.parametrize("panel", [{"nan_frac": 0.1}], indirect=True)
+def test_ewma_float32(panel):
+    df = panel
+    df["y"] = df["y"].astype("float32")
+    df, features = add_ewma(
+        df, "y", alphas=[0.3], ts_id="ts_id", use_32_bit=True, n_jobs=2
+    )
+    assert df[features[0]].dtype == np.float32
+    expected = (
+        df.groupby("ts_id")["y"]
+        .shift(1)
+        .astype("float64")
+        .groupby(df["ts_id"])
+        .transform(lambda x: x.ewm(alpha=0.3, adjust=False).mean())
+    )
+    np.testing.assert_allclose(df[features[0]].values, expected.values, rtol=1e-6)
@@ -0,0 +1,142 @@
+import importlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_engineering.autoregressive_features import add_lags
+from src.utils.cache import DiskCache, set_preprocessing_cache
+from src.utils.data_utils import compact_to_expanded
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    set_preprocessing_cache(cache)
+    yield cache
+    set_preprocessing_cache(None)
+
+
+def _make_compact():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "series_name": ["a", "b"],
+            "start_timestamp": pd.to_datetime(["2020-01-01", "2020-02-01"]),
+            "frequency": ["D", "D"],
+            "region": ["x", "y"],
+            "y": [rng.normal(size=5), rng.normal(size=3)],
+        }
+    )
+
+
+def test_preprocessing_entry_points_are_cached(cache):
+    compact = _make_compact()
+    expanded = compact_to_expanded(compact, "y", ["region"], [], "series_name")
+    cached = compact_to_expanded(compact, "y", ["region"], [], "series_name")
+    pd.testing.assert_frame_equal(cached, expanded)
+
+    df = pd.DataFrame({"ts_id": np.repeat(["a", "b"], 10), "y": np.arange(20.0)})
+    lags, _ = add_lags(df, [1, 2], "y", ts_id="ts_id")
+    # n_jobs does not change the output, so it is left out of the key
+    cached, _ = add_lags(df, [1, 2], "y", ts_id="ts_id", n_jobs=2)
+    pd.testing.assert_frame_equal(cached, lags)
+    add_lags(df.assign(y=df["y"] + 1), [1, 2], "y", ts_id="ts_id")
+
+    report = cache.report().set_index("function")
+    assert report.loc["src.utils.data_utils.compact_to_expanded", "hits"] == 1
+    assert report.loc["src.utils.data_utils.compact_to_expanded", "misses"] == 1
+    assert (
+        report.loc["src.feature_engineering.autoregressive_features.add_lags", "hits"]
+        == 1
+    )
+    assert (
+        report.loc["src.feature_engineering.autoregressive_features.add_lags", "misses"]
+        == 2
+    )
+
+
+def test_preprocessing_cache_disabled(tmp_path):
+    df = pd.DataFrame({"ts_id": np.repeat(["a", "b"], 10), "y": np.arange(20.0)})
+    add_lags(df, [1], "y", ts_id="ts_id")
+    assert not (tmp_path / "cache").exists()
+
+
+def test_inplace_functions_are_refused(cache):
+    def fill(df, inplace=False):
+        return df.fillna(0, inplace=inplace)
+
+    with pytest.raises(AssertionError, match="in place"):
+        cache(fill)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DiskCache(tmp_path / "cache", max_size=None)
+
+    @cache
+    def make(seed):
+        return np.random.default_rng(seed).normal(size=10_000)
+
+    for seed in range(3):
+        make(seed)
+        time.sleep(0.01)
+    entry_size = cache.size // 3
+    # Reading the first entry makes the second and third ones the least recently used
+    make(0)
+    time.sleep(0.01)
+    cache.max_size = 2 * entry_size + entry_size // 2
+    make(3)
+    assert cache.size <= cache.max_size
+    make(0)
+    make(3)
+    assert cache.misses[f"{make.__module__}.{make.__qualname__}"] == 4
+    make(1)
+    assert cache.misses[f"{make.__module__}.{make.__qualname__}"] == 5
+
+
+def test_change_to_an_imported_module_invalidates_entries(tmp_path, monkeypatch):
+    # The cached function only calls into a kernel of another module of its package
+    package = tmp_path / "cached_package"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "kernels.py").write_text("def kernel(x):\n    return x * 2\n")
+    (package / "api.py").write_text(
+        "from cached_package.kernels import kernel\n\n\ndef compute(x):\n    return kernel(x)\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ["cached_package", "cached_package.kernels", "cached_package.api"]:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    api = importlib.import_module("cached_package.api")
+    cache = DiskCache(tmp_path / "cache")
+    x = np.arange(5)
+    np.testing.assert_array_equal(cache(api.compute)(x), x * 2)
+    np.testing.assert_array_equal(cache(api.compute)(x), x * 2)
+    assert cache.hits["cached_package.api.compute"] == 1
+
+    (package / "kernels.py").write_text("def kernel(x):\n    return x * 3\n")
+    importlib.reload(sys.modules["cached_package.kernels"])
+    api = importlib.reload(api)
+    np.testing.assert_array_equal(cache(api.compute)(x), x * 3)
+    assert cache.misses["cached_package.api.compute"] == 2
+
+
+def test_entries_are_scanned_only_over_the_size_limit(tmp_path, monkeypatch):
+    cache = DiskCache(tmp_path / "cache", max_size=2**30)
+    scans = []
+    get_entries = cache._get_entries
+    monkeypatch.setattr(cache, "_get_entries", lambda: scans.append(1) or get_entries())
+
+    @cache
+    def make(seed):
+        return np.random.default_rng(seed).normal(size=1000)
+
+    for seed in range(5):
+        make(seed)
+    # Only the first save counts the bytes already stored
+    assert len(scans) == 1
+    cache.max_size = cache.size * 3 // 5
+    make(5)
+    assert cache.size <= cache.max_size
+    assert cache.misses[f"{make.__module__}.{make.__qualname__}"] == 6
@@ -0,0 +1,357 @@
+import gzip
+import pickle
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.data_utils import (
+    CompactDataset,
+    CompactStore,
+    MonashTsfReader,
+    compact_to_expanded,
+    convert_monash_tsf_to_dataframe,
+    read_binary_to_compact,
+    read_ts_to_compact,
+    reduce_memory_footprint,
+    write_compact_to_binary,
+    write_compact_to_ts,
+)
+
+TSF = """# A small file in the format of the Monash Forecasting Repository
+@relation test
+@attribute series_name string
+@attribute start_timestamp date
+@frequency half_hourly
+@horizon 48
+@missing true
+@equallength false
+@data
+T1:2012-01-01 00-00-00:1.5,2,?,4
+T2:2012-01-02 00-30-00:3,0.25,5
+"""
+
+
+def test_tsf_reader(tmp_path):
+    path = tmp_path / "test.tsf"
+    path.write_text(TSF, encoding="cp1252")
+    df, frequency, horizon, missing, equal_length = convert_monash_tsf_to_dataframe(
+        path
+    )
+    assert (frequency, horizon, missing, equal_length) == (
+        "half_hourly",
+        48,
+        True,
+        False,
+    )
+    # As the original parser returned them, with the missing values replaced
+    assert df["series_name"].tolist() == ["T1", "T2"]
+    assert df["start_timestamp"].tolist() == [
+        pd.Timestamp("2012-01-01 00:00:00"),
+        pd.Timestamp("2012-01-02 00:30:00"),
+    ]
+    assert list(df["series_value"][0]) == [1.5, 2.0, "NaN", 4.0]
+    assert list(df["series_value"][1]) == [3.0, 0.25, 5.0]
+
+    reader = MonashTsfReader(path)
+    series = list(reader)
+    np.testing.assert_array_equal(series[0][1], [1.5, 2.0, np.nan, 4.0])
+    assert series[1][0] == {
+        "series_name": "T2",
+        "start_timestamp": pd.Timestamp("2012-01-02 00:30:00"),
+    }
+    batches = list(reader.iter_batches(batch_size=1))
+    assert [len(b) for b in batches] == [1, 1]
+
+
+def test_tsf_reader_to_parquet(tmp_path):
+    pytest.importorskip("pyarrow", exc_type=ImportError)
+    path = tmp_path / "test.tsf"
+    path.write_text(TSF, encoding="cp1252")
+    MonashTsfReader(path).to_parquet(tmp_path / "test.parquet", batch_size=1)
+    df = pd.read_parquet(tmp_path / "test.parquet")
+    assert df["series_name"].tolist() == ["T1", "T2"]
+    np.testing.assert_array_equal(df["series_value"][0], [1.5, 2.0, np.nan, 4.0])
+    np.testing.assert_array_equal(df["series_value"][1], [3.0, 0.25, 5.0])
+
+
+def _make_compact(n_series=7, seed=0, missing=True):
+    """A dataframe in the compact form, like the blocks of the London Smart Meters dataset"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 12, n_series)
+    df = pd.DataFrame(
+        {
+            "LCLid": [f"MAC{i:06d}" for i in range(n_series)],
+            "start_timestamp": pd.date_range(
+                "2012-01-01", periods=n_series, freq="17H"
+            ),
+            "frequency": ["30min", "MS"] * (n_series // 2) + ["30min"] * (n_series % 2),
+            "Acorn": rng.choice(["A", "B"], n_series).astype(object),
+            "n_households": rng.integers(1, 5, n_series),
+            # Positive values, as the .ts reader takes values starting with "-" for strings
+            "energy_consumption": [rng.uniform(0, 2, n) for n in lengths],
+            "holidays": [rng.choice(["NO_HOLIDAY", "XMAS"], n) for n in lengths],
+        }
+    )
+    if missing:
+        df.loc[1, "Acorn"] = None
+        df.loc[2, "start_timestamp"] = pd.NaT
+    return df
+
+
+STATIC_COLUMNS = ["LCLid", "start_timestamp", "frequency", "Acorn", "n_households"]
+TIME_VARYING_COLUMNS = ["energy_consumption", "holidays"]
+
+
+def _assert_compact_equal(df, expected):
+    assert list(df.columns) == list(expected.columns)
+    for col in expected.columns:
+        if col in TIME_VARYING_COLUMNS:
+            for array, expected_array in zip(df[col], expected[col]):
+                np.testing.assert_array_equal(array, expected_array)
+        else:
+            pd.testing.assert_series_equal(df[col], expected[col])
+
+
+def test_binary_round_trip(tmp_path):
+    df = _make_compact()
+    df["Acorn_category"] = df["Acorn"].astype("category")
+    write_compact_to_binary(
+        df,
+        tmp_path / "block",
+        STATIC_COLUMNS + ["Acorn_category"],
+        TIME_VARYING_COLUMNS,
+    )
+    read = read_binary_to_compact(tmp_path / "block")
+    # The missing values of the string columns are kept missing
+    assert read["Acorn"][1] is None
+    _assert_compact_equal(read, df)
+    _assert_compact_equal(read_binary_to_compact(tmp_path / "block", mmap_mode="r"), df)
+
+
+def test_compact_store(tmp_path):
+    df = _make_compact()
+    write_compact_to_binary(
+        df, tmp_path / "block", STATIC_COLUMNS, TIME_VARYING_COLUMNS
+    )
+    store = CompactStore(tmp_path / "block", id_column="LCLid")
+    assert len(store) == len(df)
+    np.testing.assert_array_equal(
+        store.get_series("MAC000003", "energy_consumption"),
+        df["energy_consumption"][3],
+    )
+    assert store["MAC000001"]["Acorn"] is None
+    _assert_compact_equal(store.to_compact(), df)
+    _assert_compact_equal(pickle.loads(pickle.dumps(store)).to_compact(), df)
+
+    store = CompactStore(tmp_path / "block")
+    np.testing.assert_array_equal(store[-1]["holidays"], df["holidays"].iloc[-1])
+    assert store[-len(df)]["LCLid"] == df["LCLid"][0]
+    for position in [len(df), -len(df) - 1]:
+        with pytest.raises(IndexError):
+            store.get_series(position, "energy_consumption")
+
+
+def test_compact_store_without_static_columns(tmp_path):
+    df = _make_compact()[TIME_VARYING_COLUMNS]
+    write_compact_to_binary(df, tmp_path / "block", [], TIME_VARYING_COLUMNS)
+    store = CompactStore(tmp_path / "block")
+    assert len(store.static) == len(df)
+    np.testing.assert_array_equal(store[2]["holidays"], df["holidays"][2])
+
+
+def _compact_to_expanded_baseline(
+    df, timeseries_col, static_cols, time_varying_cols, ts_identifier
+):
+    """The original compact_to_expanded, with a date range and a dataframe per time series"""
+    all_series = []
+    for i in range(len(df)):
+        x = df.iloc[i]
+        columns = {
+            "timestamp": pd.date_range(
+                start=x["start_timestamp"],
+                periods=len(x[timeseries_col]),
+                freq=x["frequency"],
+            )
+        }
+        for col in [ts_identifier, timeseries_col] + static_cols + time_varying_cols:
+            columns[col] = x[col]
+        all_series.append(pd.DataFrame(columns))
+    return pd.concat(all_series)
+
+
+def test_compact_to_expanded_matches_baseline():
+    df = _make_compact(missing=False)
+    args = ("energy_consumption", ["Acorn", "n_households"], ["holidays"], "LCLid")
+    expanded = compact_to_expanded(df, *args)
+    assert expanded["LCLid"].dtype == "category"
+    pd.testing.assert_frame_equal(
+        expanded.astype({"LCLid": object}), _compact_to_expanded_baseline(df, *args)
+    )
+
+
+def _write_ts_baseline(df, sep, date_format):
+    """The lines the original write_compact_to_ts wrote, formatting a row at a time"""
+    lines = ""
+    for i in df.index:
+        x = df.loc[i]
+        for c in x.index:
+            if isinstance(x[c], np.ndarray):
+                lines += "|".join(x[c].astype(str)) + sep
+            elif isinstance(x[c], pd.Timestamp):
+                lines += x[c].strftime(date_format) + sep
+            else:
+                lines += str(x[c]) + sep
+        lines += "\n"
+    return lines
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_write_ts_matches_baseline(tmp_path, n_jobs):
+    df = _make_compact()
+    write_compact_to_ts(
+        df,
+        tmp_path / "block.ts",
+        STATIC_COLUMNS,
+        TIME_VARYING_COLUMNS,
+        chunk_size=2,
+        n_jobs=n_jobs,
+    )
+    text = (tmp_path / "block.ts").read_text()
+    header, data = text.split("@data\n")
+    assert header.count("@column") == len(df.columns)
+    assert data == _write_ts_baseline(df, ";", "%Y-%m-%d %H-%M-%S")
+
+    write_compact_to_ts(
+        df,
+        tmp_path / "block.ts.gz",
+        STATIC_COLUMNS,
+        TIME_VARYING_COLUMNS,
+        chunk_size=2,
+        n_jobs=n_jobs,
+        compression="gzip",
+    )
+    with gzip.open(tmp_path / "block.ts.gz", "rt") as f:
+        assert f.read() == text
+    _assert_compact_equal(
+        read_ts_to_compact(tmp_path / "block.ts.gz", compression="gzip"),
+        read_ts_to_compact(tmp_path / "block.ts"),
+    )
+
+
+def _write_blocks(df, path):
+    """Writes the series in a .ts block, a compressed .ts block and a binary block"""
+    path.mkdir()
+    blocks = [df.iloc[:3], df.iloc[3:5], df.iloc[5:]]
+    write_compact_to_ts(
+        blocks[0], path / "block_0.ts", STATIC_COLUMNS, TIME_VARYING_COLUMNS
+    )
+    write_compact_to_ts(
+        blocks[1],
+        path / "block_1.ts.gz",
+        STATIC_COLUMNS,
+        TIME_VARYING_COLUMNS,
+        compression="gzip",
+    )
+    write_compact_to_binary(
+        blocks[2], path / "block_2", STATIC_COLUMNS, TIME_VARYING_COLUMNS
+    )
+
+
+def test_compact_dataset(tmp_path):
+    df = _make_compact(missing=False)
+    _write_blocks(df, tmp_path / "dataset")
+    dataset = CompactDataset(tmp_path / "dataset", "LCLid", max_cached_blocks=1)
+    assert len(dataset) == len(df) and "MAC000004" in dataset
+    pd.testing.assert_index_equal(
+        dataset.select({"Acorn": "A"}),
+        pd.Index(df.loc[df["Acorn"] == "A", "LCLid"], name="LCLid"),
+    )
+    ts_ids = ["MAC000006", "MAC000001", "MAC000003"]
+    loaded = dataset.load(ts_ids=ts_ids)
+    # In the order of the blocks
+    assert loaded["LCLid"].tolist() == ["MAC000001", "MAC000003", "MAC000006"]
+    for _, row in loaded.iterrows():
+        expected = df.set_index("LCLid").loc[row["LCLid"]]
+        np.testing.assert_array_equal(
+            row["energy_consumption"], expected["energy_consumption"]
+        )
+        np.testing.assert_array_equal(row["holidays"], expected["holidays"])
+        assert row["start_timestamp"] == expected["start_timestamp"]
+    series = dataset["MAC000005"]
+    np.testing.assert_array_equal(
+        series["energy_consumption"], df["energy_consumption"][5]
+    )
+
+
+def test_compact_dataset_without_static_columns(tmp_path):
+    df = _make_compact(missing=False)[TIME_VARYING_COLUMNS]
+    (tmp_path / "dataset").mkdir()
+    write_compact_to_ts(df, tmp_path / "dataset" / "block.ts", [], TIME_VARYING_COLUMNS)
+    dataset = CompactDataset.__new__(CompactDataset)
+    dataset.sep, dataset.encoding = ";", "utf-8"
+    dataset.date_format = "%Y-%m-%d %H-%M-%S"
+    static = dataset._read_static(tmp_path / "dataset" / "block.ts")
+    assert static.shape == (len(df), 0)
+    with pytest.raises(
+        AssertionError, match="`id_column` should be one of the static columns"
+    ):
+        CompactDataset(tmp_path / "dataset", "LCLid")
+
+
+def test_reduce_memory_footprint_dtypes():
+    rng = np.random.default_rng(0)
+    n = 1000
+    df = pd.DataFrame(
+        {
+            "int": rng.integers(-100, 100, n),
+            "float": rng.normal(size=n).astype("float32").astype("float64"),
+            "large_float": rng.normal(size=n) * 1e300,
+            "nullable_int": pd.array(rng.integers(0, 1000, n), dtype="Int64"),
+            "nullable_float": pd.array(
+                rng.normal(size=n).astype("float32"), dtype="Float64"
+            ),
+            "all_na": pd.array([None] * n, dtype="Int64"),
+            "category": rng.choice(["a", "b", "c"], n).astype(object),
+            "string": pd.array(rng.choice(["a", "b"], n), dtype="string"),
+        }
+    )
+    df.loc[::7, ["nullable_int", "nullable_float"]] = pd.NA
+    expected = df.copy()
+    df, report = reduce_memory_footprint(df, return_report=True)
+    assert df.dtypes.astype(str).to_dict() == {
+        "int": "int8",
+        "float": "float32",
+        "large_float": "float64",
+        "nullable_int": "Int16",
+        "nullable_float": "Float32",
+        "all_na": "Int64",
+        "category": "category",
+        "string": "string",
+    }
+    assert list(df.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        df.astype({"category": object}), expected, check_dtype=False, rtol=1e-6
+    )
+    assert (report["bytes_after"] <= report["bytes_before"]).all()
+
+
+def test_reduce_memory_footprint_peak_memory():
+    rng = np.random.default_rng(0)
+    n = 200_000
+    df = pd.DataFrame(
+        {
+            f"f{i}": rng.normal(size=n).astype("float32").astype("float64")
+            for i in range(10)
+        }
+    )
+    size = df.memory_usage(index=False).sum()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    reduce_memory_footprint(df)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The dataframe is a single block, which is released only once all its columns are converted to float32.
+    # On top of that, the temporary arrays of the tolerance check of one column
+    assert peak - start <= size / 2 + 3 * n * 8
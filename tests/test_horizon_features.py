@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from src.feature_engineering.autoregressive_features import add_lags
+from src.feature_engineering.horizon_features import get_direct_horizon_features
+
+
+def _get_features(df, horizons, output):
+    return get_direct_horizon_features(
+        df,
+        "y",
+        horizons,
+        lags=[1, 3],
+        rolls=[4],
+        agg_funcs=["mean", "std"],
+        alphas=[0.5],
+        ts_id="ts_id",
+        output=output,
+    )
+
+
+# Short time series, with missing ids
+PANEL = {"n_series": 15, "length": 60, "nan_id_frac": 0.02}
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+def test_horizon_features_match_lags(panel):
+    df = panel
+    horizons = [1, 2, 5]
+    tensor, feature_names = _get_features(df, horizons, "tensor")
+    for k, h in enumerate(horizons):
+        expected, _ = add_lags(df, [1 + h - 1, 3 + h - 1], "y", ts_id="ts_id")
+        np.testing.assert_array_equal(tensor[:, k, :2], expected.iloc[:, -2:].values)
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+@pytest.mark.parametrize("horizons", [[1, 2, 3, 4], [2, 5, 8], [3, 1, 7]])
+def test_horizon_views_match_tensor(panel, horizons):
+    df = panel
+    tensor, _ = _get_features(df, horizons, "tensor")
+    views, feature_names = _get_features(df, horizons, "views")
+    assert views.feature_names == feature_names
+    for k, h in enumerate(horizons):
+        assert np.shares_memory(views[h], views.base)
+        np.testing.assert_array_equal(views.take(h), tensor[:, k])
+    if np.unique(np.diff(horizons)).size == 1:
+        tensor_view = views.as_tensor_view()
+        assert np.shares_memory(tensor_view, views.base)
+        np.testing.assert_array_equal(tensor_view[views.positions], tensor)
+    else:
+        with pytest.raises(AssertionError):
+            views.as_tensor_view()
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_engineering.memory_planner import (
+    MemoryPlan,
+    _get_compute_dtype,
+    get_memory_report,
+)
+from src.feature_engineering.pipeline import FeaturePipeline
+
+
+def test_memory_plan_dtypes():
+    plan = MemoryPlan(lags_dtype="float64", rolling_dtype="float16")
+    assert {
+        kind: plan.get_dtype(kind)
+        for kind in ["lags", "rolling", "seasonal_rolling", "ewma", "fourier"]
+    } == {
+        "lags": np.float64,
+        "rolling": np.float16,
+        "seasonal_rolling": np.float16,
+        "ewma": np.float32,
+        "fourier": np.float32,
+    }
+    with pytest.raises(AssertionError, match="should be one of"):
+        MemoryPlan(ewma_dtype="int8")
+
+
+@pytest.mark.parametrize(
+    "dtype, compute_dtype",
+    [("float16", "float32"), ("float32", "float32"), ("float64", "float64")],
+)
+def test_get_compute_dtype(dtype, compute_dtype):
+    assert _get_compute_dtype(np.dtype(dtype)) == np.dtype(compute_dtype)
+
+
+def _make_pipeline(memory_plan=None, n_jobs=1):
+    return (
+        FeaturePipeline(
+            ts_id="ts_id", verbose=False, memory_plan=memory_plan, n_jobs=n_jobs
+        )
+        .add_lags("y", [1, 2])
+        .add_rolling_features("y", [3, 7], agg_funcs=["mean", "std"])
+        .add_seasonal_rolling_features("y", [24], [2], agg_funcs=["mean", "max"])
+        .add_ewma("y", alphas=[0.5])
+        .add_fourier_features(["hour"], [24])
+        .add_temporal_features("timestamp", "h", add_elapsed=False, drop=False)
+    )
+
+
+@pytest.mark.parametrize("panel", [{"n_series": 6, "length": 300}], indirect=True)
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_pipeline_features_in_planned_dtypes(panel, n_jobs):
+    df = panel
+    df["hour"] = df["time"] % 24
+    df["timestamp"] = pd.Timestamp("2021-01-01") + pd.to_timedelta(df["time"], "h")
+    plan = MemoryPlan(lags_dtype="float64", rolling_dtype="float16")
+    pipeline = _make_pipeline(plan, n_jobs)
+    features, added_features = pipeline.run(df)
+    expected, _ = _make_pipeline().run(df)
+    report = pipeline.memory_report.set_index("feature")
+    assert report.index.tolist() == added_features
+    for feature in added_features:
+        family = report.loc[feature, "family"]
+        if family == "temporal":
+            assert features[feature].dtype.itemsize <= 2
+            np.testing.assert_array_equal(features[feature], expected[feature])
+            continue
+        dtype = plan.get_dtype(family)
+        assert features[feature].dtype == dtype
+        # Within the precision of the planned dtype
+        np.testing.assert_allclose(
+            features[feature],
+            expected[feature],
+            rtol=np.finfo(dtype).resolution * 2,
+            atol=np.finfo(dtype).resolution,
+        )
+    families = report.loc[report["family"] != "temporal", "family"]
+    assert families.value_counts().to_dict() == {
+        "lags": 2,
+        "rolling": 4,
+        "seasonal_rolling": 2,
+        "ewma": 1,
+        "fourier": 2,
+    }
+
+
+@pytest.mark.parametrize("panel", [{"n_series": 5, "length": 50}], indirect=True)
+def test_memory_report_matches_memory_usage(panel):
+    df = panel.assign(x=np.arange(len(panel), dtype=np.float32))
+    features = ["y", "x", "ts_id"]
+    report = get_memory_report(df, features, {"x": "lags"})
+    assert report["feature"].tolist() == features
+    assert report["family"].tolist() == [None, "lags", None]
+    assert report["dtype"].tolist() == ["float64", "float32", "object"]
+    assert report["bytes"].tolist() == [
+        df[f].memory_usage(index=False, deep=True) for f in features
+    ]
+
+
+@pytest.mark.parametrize(
+    "panel", [{"n_series": 50, "length": 2000, "equal_lengths": True}], indirect=True
+)
+def test_float16_features_are_not_computed_in_a_float32_block(panel):
+    peak_memory = {}
+    for dtype in ["float32", "float16"]:
+        pipeline = FeaturePipeline(
+            ts_id="ts_id", verbose=False, memory_plan=MemoryPlan(rolling_dtype=dtype)
+        )
+        for agg_funcs in [["mean", "std"], ["max", "min"]]:
+            pipeline.add_rolling_features("y", [3, 7, 14, 28], agg_funcs=agg_funcs)
+        _, added_features = pipeline.run(panel)
+        peak_memory[dtype] = pipeline.peak_memory
+    # Casting a float32 block to float16 would save only half of the block
+    float32_block_bytes = len(added_features) * len(panel) * 4
+    assert peak_memory["float32"] - peak_memory["float16"] >= float32_block_bytes
@@ -0,0 +1,381 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.linear_model import LinearRegression, SGDRegressor
+
+from src.forecasting.ml_forecasting import (
+    BatchMLForecast,
+    FeatureConfig,
+    ForecastJob,
+    MissingValueConfig,
+    MLForecast,
+    ModelConfig,
+    fit_many,
+    predict_many,
+)
+
+# Equal lengths, so that every time series has the same train and test windows
+PANEL = {"n_series": 4, "length": 30, "nan_frac": 0, "equal_lengths": True}
+
+
+def _add_features(df, seed=0):
+    """Adds the features of the target and missing values to them"""
+    rng = np.random.default_rng(seed)
+    for col in ["x_bfill", "x_ffill", "x_mean"]:
+        df[col] = rng.normal(size=len(df))
+    df["y"] = df["x_bfill"] + 2 * df["x_ffill"] - df["x_mean"]
+    for col in ["x_bfill", "x_ffill", "x_mean"]:
+        df.loc[rng.random(len(df)) < 0.2, col] = np.nan
+    return df
+
+
+def _make_batch_forecaster(mode, features, **model_kwargs):
+    return BatchMLForecast(
+        ModelConfig(model=LinearRegression(), name="lr", **model_kwargs),
+        FeatureConfig(
+            date="time",
+            target="y",
+            continuous_features=features,
+            index_cols=["ts_id", "time"],
+        ),
+        ts_id="ts_id",
+        missing_config=_missing_config(),
+        mode=mode,
+    )
+
+
+def _missing_config():
+    return MissingValueConfig(bfill_columns=["x_bfill"], ffill_columns=["x_ffill"])
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+def test_batch_local_scaling(panel):
+    rng = np.random.default_rng(0)
+    df = panel.assign(
+        # The variance is tiny compared to the square of the mean
+        x_large=1e8 + rng.normal(size=len(panel)),
+        x_constant=0.1,
+    )
+    forecaster = _make_batch_forecaster(
+        "local", ["x_large", "x_constant"], normalize=True
+    ).fit(df)
+    mean, scale = forecaster._scale_stats
+    grouped = df.groupby("ts_id")
+    np.testing.assert_allclose(
+        mean["x_large"], grouped["x_large"].mean()[mean.index], rtol=1e-15
+    )
+    np.testing.assert_allclose(
+        scale["x_large"], grouped["x_large"].std(ddof=0)[scale.index], rtol=1e-6
+    )
+    # Constant features are left as they are
+    assert (scale["x_constant"] == 1).all()
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+def test_batch_evaluate(panel):
+    pytest.importorskip("darts")
+    df = _add_features(panel)
+    forecaster = _make_batch_forecaster("global", ["x_bfill", "x_ffill", "x_mean"])
+    forecaster.fit(df[df["time"] < 20])
+    test = df[df["time"] >= 20]
+    evaluation = forecaster.evaluate(test)
+    assert isinstance(evaluation, pd.DataFrame)
+    assert len(evaluation) == len(test)
+    np.testing.assert_array_equal(evaluation["actual"], test["y"])
+    pd.testing.assert_series_equal(
+        evaluation["lr"], forecaster.predict(test), check_names=False
+    )
+    metrics = evaluation.groupby(level="ts_id").first()
+    errors = (evaluation["actual"] - evaluation["lr"]).abs()
+    np.testing.assert_allclose(
+        metrics["MAE"], errors.groupby(level="ts_id").mean()[metrics.index]
+    )
+
+
+class _SlowRegressor(RegressorMixin, BaseEstimator):
+    """Predicts the mean of the target after sleeping for `delay` seconds, or fails to fit if `fail`"""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+
+    def fit(self, X, y):
+        time.sleep(self.delay)
+        if self.fail:
+            raise ValueError("The model could not be fit")
+        self.mean_ = np.mean(y)
+        return self
+
+    def predict(self, X):
+        time.sleep(self.delay)
+        return np.full(len(X), self.mean_)
+
+
+def _make_jobs(df, models):
+    feature_config = FeatureConfig(
+        date="time", target="y", continuous_features=["x_bfill", "x_ffill", "x_mean"]
+    )
+    train, test = df[df["time"] < 20], df[df["time"] >= 20]
+    jobs = []
+    for (_id, rows), model in zip(train.groupby("ts_id"), models):
+        jobs.append(
+            ForecastJob(
+                key=_id,
+                model_config=ModelConfig(model=model, name="model"),
+                feature_config=feature_config,
+                X=rows[feature_config.continuous_features],
+                y=rows["y"],
+                missing_config=_missing_config(),
+                X_test=test.loc[
+                    test["ts_id"] == _id, feature_config.continuous_features
+                ],
+            )
+        )
+    return jobs
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_fit_many_isolates_failures(panel, n_jobs):
+    df = _add_features(panel)
+    models = [_SlowRegressor(), _SlowRegressor(fail=True)] + [_SlowRegressor()] * 2
+    jobs = _make_jobs(df, models)
+    with pytest.warns(UserWarning, match="Job id_1 failed"):
+        results = list(fit_many(jobs, n_jobs=n_jobs))
+    assert [r.key for r in results] == [job.key for job in jobs]
+    failed = results[1]
+    assert failed.failed and failed.forecaster is None and failed.y_pred is None
+    assert "The model could not be fit" in failed.error
+    assert failed.fit_time is None and failed.predict_time is None
+    for job, result in zip(jobs, results):
+        if result.key == failed.key:
+            continue
+        assert not result.failed and result.error is None
+        assert result.fit_time > 0 and result.predict_time > 0
+        pd.testing.assert_series_equal(
+            result.y_pred, result.forecaster.predict(job.X_test)
+        )
+        np.testing.assert_allclose(result.y_pred, job.y.mean())
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+def test_many_results_in_job_order(panel):
+    df = _add_features(panel)
+    # The first job finishes last
+    models = [_SlowRegressor(delay=1.0)] + [_SlowRegressor()] * 3
+    jobs = _make_jobs(df, models)
+    keys = [job.key for job in jobs]
+    unordered = [r.key for r in fit_many(jobs, n_jobs=2, ordered=False)]
+    assert unordered[-1] == keys[0] and sorted(unordered) == keys
+    results = list(fit_many(jobs, n_jobs=2))
+    assert [r.key for r in results] == keys
+
+    forecasters = {r.key: r.forecaster for r in results}
+    X = {job.key: job.X_test for job in reversed(jobs)}
+    # A job whose features do not match the trained model fails on its own
+    X[keys[2]] = X[keys[2]].drop(columns="x_mean")
+    with pytest.warns(UserWarning, match=f"Job {keys[2]} failed"):
+        predictions = list(predict_many(forecasters, X, n_jobs=2))
+    assert [r.key for r in predictions] == list(X)
+    for result in predictions:
+        if result.key == keys[2]:
+            assert result.failed and result.predict_time is None
+        else:
+            assert not result.failed and result.predict_time > 0
+            assert len(result.y_pred) == len(X[result.key])
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+def test_imputation_plan_matches_impute_missing_values(panel):
+    df = _add_features(panel)
+    # Leading and trailing missing values, which bfill and ffill within a time series leave
+    df.loc[df["time"] < 3, ["x_bfill", "x_ffill"]] = np.nan
+    df.loc[df["time"] > 26, ["x_bfill", "x_ffill"]] = np.nan
+    # A time series which is all missing, filled with the mean of the whole column
+    df.loc[df["ts_id"] == "id_3", "x_mean"] = np.nan
+    config = _missing_config()
+    expected = config.impute_missing_values(df, ts_id="ts_id")
+    imputed = config.fit(df, ts_id="ts_id").transform(df)
+    assert not imputed.isnull().any().any()
+    pd.testing.assert_frame_equal(imputed, expected)
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+@pytest.mark.parametrize("mode", ["global", "local"])
+def test_batch_predict_with_leading_missing_values(panel, mode):
+    df = _add_features(panel)
+    train, test = df[df["time"] < 20], df[df["time"] >= 20].copy()
+    # The test window of a time series starts with missing values, which ffill cannot fill
+    test.loc[(test["ts_id"] == "id_0") & (test["time"] < 23), "x_ffill"] = np.nan
+    forecaster = _make_batch_forecaster(mode, ["x_bfill", "x_ffill", "x_mean"]).fit(
+        train
+    )
+    y_pred = forecaster.predict(test)
+    assert len(y_pred) == len(test)
+    assert not y_pred.isnull().any()
+
+
+def _make_feature_frame(n=12, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "timestamp": np.repeat(pd.date_range("2021-01-01", periods=n // 2), 2),
+            "ts_id": pd.Categorical(["a", "b"] * (n // 2)),
+            "x1": rng.normal(size=n),
+            "y": rng.normal(size=n),
+            "cat": pd.Categorical(rng.choice(["u", "v", None], n)),
+            "x2": rng.normal(size=n),
+            "flag": rng.random(n) > 0.5,
+            "exog": rng.normal(size=n),
+        }
+    )
+    df["y_orig"] = df["y"] * 2
+    feature_config = FeatureConfig(
+        date="timestamp",
+        target="y",
+        original_target="y_orig",
+        continuous_features=["x2", "x1", "exog"],
+        categorical_features=["cat", "ts_id"],
+        boolean_features=["flag"],
+        index_cols=["timestamp", "ts_id"],
+        exogenous_features=["exog"],
+    )
+    return df, feature_config
+
+
+def _get_X_y_baseline(feature_config, df, categorical, exogenous):
+    """The original get_X_y, which selected the columns through a set"""
+    feature_list = list(feature_config.continuous_features)
+    if categorical:
+        feature_list += (
+            feature_config.categorical_features + feature_config.boolean_features
+        )
+    if not exogenous:
+        feature_list = list(set(feature_list) - set(feature_config.exogenous_features))
+    index_cols = feature_config.index_cols
+    delete_index_cols = list(set(index_cols) - set(feature_config.feature_list))
+    X = (
+        df.loc[:, list(set(feature_list + index_cols))]
+        .set_index(index_cols, drop=False)
+        .drop(columns=delete_index_cols)
+    )
+    y, y_orig = [
+        df.loc[:, [col] + index_cols].set_index(index_cols, drop=True)
+        for col in [feature_config.target, feature_config.original_target]
+    ]
+    return X, y, y_orig
+
+
+@pytest.mark.parametrize(
+    "categorical, exogenous, columns",
+    [
+        (False, False, ["x2", "x1", "ts_id"]),
+        (False, True, ["x2", "x1", "exog", "ts_id"]),
+        (True, False, ["x2", "x1", "cat", "ts_id", "flag"]),
+    ],
+)
+def test_get_X_y_matches_baseline_in_stable_order(categorical, exogenous, columns):
+    df, feature_config = _make_feature_frame()
+    X, y, y_orig = feature_config.get_X_y(df, categorical, exogenous)
+    assert X.columns.tolist() == columns
+    X_baseline, y_baseline, y_orig_baseline = _get_X_y_baseline(
+        feature_config, df, categorical, exogenous
+    )
+    pd.testing.assert_frame_equal(X, X_baseline[columns])
+    pd.testing.assert_frame_equal(y, y_baseline)
+    pd.testing.assert_frame_equal(y_orig, y_orig_baseline)
+
+
+def test_compiled_feature_selector_matches_get_X_y():
+    df, feature_config = _make_feature_frame()
+    selector = feature_config.compile(categorical=True)
+    X_df, y_df, y_orig_df = feature_config.get_X_y(df, categorical=True)
+    # The categorical features as their codes, with the missing values as NaN
+    expected = X_df.assign(
+        cat=X_df["cat"].cat.codes.where(X_df["cat"].notna()),
+        ts_id=X_df["ts_id"].cat.codes,
+    ).astype(np.float32)
+    for columns in [df.columns, df.columns[::-1]]:
+        X, y, y_orig = selector(df[columns])
+        assert X.dtype == np.float32 and X.flags.c_contiguous
+        np.testing.assert_array_equal(X, expected.values)
+        np.testing.assert_array_equal(y, y_df["y"].values)
+        np.testing.assert_array_equal(y_orig, y_orig_df["y_orig"].values)
+    X, y, y_orig = selector(df, as_frame=True)
+    pd.testing.assert_index_equal(X.index, X_df.index)
+    assert X.columns.tolist() == X_df.columns.tolist()
+    pd.testing.assert_series_equal(y, y_df["y"])
+    pd.testing.assert_series_equal(y_orig, y_orig_df["y_orig"])
+
+
+def _make_regression(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({"a": rng.normal(5, 2, n), "b": rng.normal(-3, 1, n)})
+    y = pd.Series(X["a"] - 2 * X["b"] + rng.normal(0, 0.1, n), name="y")
+    return X, y
+
+
+def _make_forecaster(model, **model_kwargs):
+    return MLForecast(
+        ModelConfig(model=model, name="model", **model_kwargs),
+        FeatureConfig(date="date", target="y", continuous_features=["a", "b"]),
+        missing_config=MissingValueConfig(),
+    )
+
+
+@pytest.mark.filterwarnings("ignore::sklearn.exceptions.ConvergenceWarning")
+def test_update_matches_fit_on_concatenated_data():
+    X, y = _make_regression()
+    # A single ordered pass, so that the updates of fit are the same as those of partial_fit
+    model = SGDRegressor(
+        learning_rate="constant", eta0=0.001, max_iter=1, tol=None, shuffle=False
+    )
+    incremental = _make_forecaster(model, fill_missing=False)
+    incremental.fit(X[:120], y[:120]).update(X[120:], y[120:])
+    full = _make_forecaster(model, fill_missing=False).fit(X, y)
+    np.testing.assert_allclose(incremental._model.coef_, full._model.coef_)
+    np.testing.assert_allclose(incremental._model.intercept_, full._model.intercept_)
+    pd.testing.assert_series_equal(incremental.predict(X), full.predict(X))
+
+
+def test_update_statistics_match_fit_on_concatenated_data():
+    X, y = _make_regression()
+    X.loc[::5, "a"] = np.nan
+    forecaster = _make_forecaster(SGDRegressor(), normalize=True)
+    forecaster.fit(X[:120], y[:120]).update(X[120:], y[120:])
+    full = _make_forecaster(SGDRegressor(), normalize=True).fit(X, y)
+    assert forecaster._imputation_plan.fill_values == pytest.approx(
+        full._imputation_plan.fill_values
+    )
+    # `a` is scaled after filling with the means known at the time, which differ from the overall mean
+    b = list(full._scaler.feature_names_in_).index("b")
+    np.testing.assert_allclose(forecaster._scaler.mean_[b], full._scaler.mean_[b])
+    np.testing.assert_allclose(forecaster._scaler.var_[b], full._scaler.var_[b])
+
+
+class _BoostedTrees(RegressorMixin, BaseEstimator):
+    """Stands in for LightGBM, which continues boosting from `init_model`"""
+
+    def fit(self, X, y, init_model=None):
+        self.mean_ = np.mean(y)
+        return self
+
+    def predict(self, X):
+        return np.full(len(X), self.mean_)
+
+
+def test_update_keeps_statistics_of_boosted_trees():
+    X, y = _make_regression()
+    X.loc[::5, "a"] = np.nan
+    forecaster = _make_forecaster(_BoostedTrees(), normalize=True).fit(X[:120], y[:120])
+    fill_values = dict(forecaster._imputation_plan.fill_values)
+    scaler_mean = forecaster._scaler.mean_.copy()
+    forecaster.update(X[120:] + 10, y[120:])
+    assert forecaster._imputation_plan.fill_values == fill_values
+    np.testing.assert_array_equal(forecaster._scaler.mean_, scaler_mean)
+    forecaster.update(X[120:] + 10, y[120:], update_statistics=True)
+    assert forecaster._imputation_plan.fill_values != fill_values
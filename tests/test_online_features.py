@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from src.feature_engineering.autoregressive_features import (
+    add_ewma,
+    add_lags,
+    add_rolling_features,
+)
+from src.feature_engineering.online_features import OnlineFeatureState
+
+
+def _next_step_features(df, state):
+    """The features `add_*` produce for the time step after the last observation of every series"""
+    next_step = df.groupby("ts_id").tail(1).assign(y=np.nan)
+    full = pd.concat([df, next_step], ignore_index=True).sort_values(
+        "ts_id", kind="stable"
+    )
+    full, _ = add_lags(full, state.lags, "y", ts_id="ts_id")
+    full, _ = add_rolling_features(
+        full, state.rolls, "y", agg_funcs=state.agg_funcs, ts_id="ts_id"
+    )
+    full, _ = add_ewma(full, "y", alphas=state.ewma_params, ts_id="ts_id")
+    return full.groupby("ts_id").tail(1).set_index("ts_id")[state.feature_names]
+
+
+def test_online_features_match_batch():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {"ts_id": np.repeat(["a", "b", "c"], 100), "y": rng.normal(5, 2, 300)}
+    )
+    df.loc[rng.random(len(df)) < 0.05, "y"] = np.nan
+    history = df.groupby("ts_id").head(60)
+    new = df.drop(history.index)
+    state = OnlineFeatureState(
+        "y",
+        lags=[1, 7],
+        rolls=[3, 10],
+        agg_funcs=["mean", "std", "min", "max"],
+        alphas=[0.2, 0.7],
+        ts_id="ts_id",
+    )
+    state.fit(history).update(new)
+    expected = _next_step_features(df, state)
+    pd.testing.assert_frame_equal(
+        state.transform(), expected, check_names=False, rtol=1e-10
+    )
+
+
+def test_online_rolling_features_long_stream():
+    # Running sums of the stream would drift away from the exact statistics of the window
+    n = 20_000
+    y = 1e6 + 1.24 * np.arange(n)
+    state = OnlineFeatureState("y", rolls=[3], agg_funcs=["mean", "std"], ts_id="ts_id")
+    state.fit(pd.DataFrame({"ts_id": "a", "y": y[:10]}))
+    for chunk in np.array_split(y[10:], 100):
+        state.update(pd.DataFrame({"ts_id": "a", "y": chunk}))
+    features = state.transform()
+    np.testing.assert_allclose(features["y_rolling_3_mean"], y[-3:].mean(), rtol=1e-12)
+    np.testing.assert_allclose(
+        features["y_rolling_3_std"], y[-3:].std(ddof=1), rtol=1e-9
+    )
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_engineering.out_of_core import _get_partitions, run_out_of_core
+from src.feature_engineering.pipeline import FeaturePipeline
+
+
+def test_get_partitions():
+    n_rows_per_series = np.array([3, 4, 10, 2, 2, 5])
+    partitions = _get_partitions(n_rows_per_series, max_rows=6)
+    # The series longer than `max_rows` gets a partition of its own
+    assert [p.tolist() for p in partitions] == [[0], [1], [2], [3, 4], [5]]
+    assert [p.tolist() for p in _get_partitions(n_rows_per_series, max_rows=100)] == [
+        list(range(6))
+    ]
+
+
+def _read_output(path, output_format):
+    if output_format == "parquet":
+        return pd.read_parquet(path)
+    return pd.read_feather(path).set_index("index").rename_axis(None)
+
+
+@pytest.mark.parametrize("panel", [{"n_series": 12, "length": 80}], indirect=True)
+@pytest.mark.parametrize("file_format", ["parquet", "feather"])
+def test_out_of_core_matches_in_memory(panel, tmp_path, file_format):
+    pytest.importorskip("pyarrow", exc_type=ImportError)
+    # The rows of the time series are interleaved, so every partition is spread over the file
+    df = panel.reset_index(drop=True)
+    input_path = tmp_path / f"panel.{file_format}"
+    if file_format == "parquet":
+        df.to_parquet(input_path, row_group_size=100)
+    else:
+        df.to_feather(input_path)
+    pipeline = (
+        FeaturePipeline(ts_id="ts_id", verbose=False)
+        .add_lags("y", [1, 3])
+        .add_rolling_features("y", [4], agg_funcs=["mean", "std"])
+        .add_ewma("y", alphas=[0.5])
+    )
+    paths, added_features = run_out_of_core(
+        pipeline,
+        input_path,
+        tmp_path / "output",
+        memory_budget=50_000,
+        output_format=file_format,
+        n_calibration_rows=100,
+    )
+    assert len(paths) > 1
+    result = pd.concat([_read_output(p, file_format) for p in paths]).sort_index()
+    expected, expected_features = pipeline.run(df)
+    assert added_features == expected_features
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,147 @@
+import os
+import subprocess
+import sys
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_engineering._kernels import _restore_order
+from src.feature_engineering.autoregressive_features import (
+    add_ewma,
+    add_lags,
+    add_rolling_features,
+    add_seasonal_rolling_features,
+)
+from src.feature_engineering.pipeline import FeaturePipeline
+from src.feature_engineering.temporal_features import bulk_add_fourier_features
+
+
+def _make_pipeline(n_jobs=1):
+    return (
+        FeaturePipeline(ts_id="ts_id", verbose=False, n_jobs=n_jobs)
+        .add_lags("y", [1, 2, 7])
+        .add_rolling_features("y", [3, 14], agg_funcs=["mean", "std", "max"])
+        .add_ewma("y", alphas=[0.3, 0.8])
+    )
+
+
+# Equal lengths, so that the shards of the process pool are balanced
+PANEL = {"n_series": 50, "length": 400, "equal_lengths": True}
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_pipeline_matches_functions(panel, n_jobs):
+    df = panel
+    features, _ = _make_pipeline(n_jobs).run(df)
+    expected, _ = add_lags(df, [1, 2, 7], "y", ts_id="ts_id")
+    expected, _ = add_rolling_features(
+        expected, [3, 14], "y", agg_funcs=["mean", "std", "max"], ts_id="ts_id"
+    )
+    expected, _ = add_ewma(expected, "y", alphas=[0.3, 0.8], ts_id="ts_id")
+    pd.testing.assert_frame_equal(features, expected[features.columns], rtol=1e-12)
+
+
+@pytest.mark.parametrize("panel", [PANEL], indirect=True)
+def test_pipeline_peak_memory_covers_shared_memory(panel):
+    df = panel
+    serial, parallel = _make_pipeline(n_jobs=1), _make_pipeline(n_jobs=2)
+    _, added_features = serial.run(df)
+    parallel.run(df)
+    # The block of features and the sorted values are copied to shared memory for the workers
+    shared_bytes = (len(added_features) + 1) * len(df) * 8
+    assert parallel.peak_memory >= serial.peak_memory + shared_bytes
+
+
+def test_pipeline_peak_memory_excludes_compilation():
+    # In a new process, so that the kernels are not compiled yet by the other tests
+    code = (
+        "from conftest import make_panel\n"
+        "from test_pipeline import PANEL, _make_pipeline\n"
+        "df, pipeline = make_panel(**PANEL), _make_pipeline()\n"
+        "pipeline.run(df)\n"
+        "first_peak = pipeline.peak_memory\n"
+        "pipeline.run(df)\n"
+        "print(first_peak, pipeline.peak_memory)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    first_peak, second_peak = map(int, output.split()[-2:])
+    assert first_peak == pytest.approx(second_peak, rel=0.1)
+
+
+def test_pipeline_fourier_features():
+    df = pd.DataFrame({"hour": np.arange(100) % 24, "month": np.arange(100) % 12 + 1})
+    pipeline = FeaturePipeline(verbose=False).add_fourier_features(
+        ["hour", "month"], [24, 12], n_fourier_terms=2
+    )
+    features, added_features = pipeline.run(df)
+    expected, _ = bulk_add_fourier_features(
+        df, ["hour", "month"], [24, 12], n_fourier_terms=2
+    )
+    pd.testing.assert_frame_equal(features, expected[features.columns])
+
+    df.loc[5, "hour"] = np.nan
+    with pytest.raises(ValueError, match="missing or infinite"):
+        pipeline.run(df)
+
+
+def test_restore_order_in_place():
+    rng = np.random.default_rng(0)
+    block = rng.normal(size=(4, 10000))
+    sort_order = rng.permutation(block.shape[1])
+    expected = np.empty_like(block)
+    expected[:, sort_order] = block
+    tracemalloc.start()
+    try:
+        restored = _restore_order(block, sort_order)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    np.testing.assert_array_equal(restored, expected)
+    assert np.shares_memory(restored, block)
+    # A row of scratch, not a second block
+    assert peak < 2 * block[0].nbytes
+
+
+@pytest.mark.parametrize("panel", [{"n_series": 10, "length": 100}], indirect=True)
+def test_pipeline_drops_duplicate_features(panel):
+    df = panel
+    df["hour"] = df["time"] % 24
+    pipeline = (
+        FeaturePipeline(ts_id="ts_id", verbose=False)
+        .add_seasonal_rolling_features("y", [7], [2, 3], agg_funcs=["mean"])
+        .add_seasonal_rolling_features("y", [7, 24], [3, 4], agg_funcs=["mean"])
+        .add_fourier_features(["hour"], [24], n_fourier_terms=1)
+        .add_fourier_features(["hour"], [24], n_fourier_terms=2)
+    )
+    features, added_features = pipeline.run(df)
+    assert len(added_features) == len(set(added_features))
+    assert len(features.columns) == len(set(features.columns))
+    expected, _ = add_seasonal_rolling_features(
+        df, [7], [2, 3, 4], "y", agg_funcs=["mean"], ts_id="ts_id"
+    )
+    expected, _ = add_seasonal_rolling_features(
+        expected, [24], [3, 4], "y", agg_funcs=["mean"], ts_id="ts_id"
+    )
+    expected, _ = bulk_add_fourier_features(expected, ["hour"], [24], n_fourier_terms=2)
+    assert sorted(added_features) == sorted(set(expected.columns) - set(df.columns))
+    pd.testing.assert_frame_equal(features, expected[features.columns])
+
+
+def test_pipeline_warns_only_for_features_per_time_series():
+    df = pd.DataFrame({"hour": np.arange(48) % 24, "y": np.arange(48.0)})
+    pipeline = FeaturePipeline(verbose=False).add_fourier_features(["hour"], [24])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        pipeline.run(df)
+    with pytest.warns(UserWarning, match="Assuming just one unique time series"):
+        pipeline.add_lags("y", [1]).run(df)